@@ -1,9 +1,78 @@
 from flask import Flask
+from flask.json.provider import DefaultJSONProvider
 from config import Config
 from flask_sqlalchemy import SQLAlchemy
+from app.basedatos import configurar_motor, normalizar_uri, opciones_motor
+from app.cache import instalar_cache
+from app.dinero import Dinero
+from app.metricas import instalar_metricas
+from app.sesiones import configurar_sesiones
 
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class ProveedorJSON(DefaultJSONProvider):
+    # Los importes se devuelven como números con dos decimales.
+    # Con orjson instalado las respuestas se serializan con él; el resultado es el mismo que con json.
+    @staticmethod
+    def default(o):
+        if isinstance(o, Dinero):
+            return float(o)
+        return DefaultJSONProvider.default(o)
+
+    def _opciones_orjson(self):
+        opciones = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        return opciones | orjson.OPT_SORT_KEYS if self.sort_keys else opciones
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._opciones_orjson()).decode()
+
+    def response(self, *args, **kwargs):
+        if orjson is None or self._app.debug:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default, option=self._opciones_orjson()), mimetype=self.mimetype)
+
+
+# Importar el paquete solo crea `app` y `db`: no abre conexiones ni carga las rutas. Los módulos de la
+# aplicación se registran sobre `app` al importarse, y los importa `crear_app`.
 app = Flask(__name__)
 app.config.from_object(Config)
+app.json = ProveedorJSON(app)
+app.config['SQLALCHEMY_DATABASE_URI'] = normalizar_uri(app.config['SQLALCHEMY_DATABASE_URI'])
+app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', opciones_motor(app.config))
 db = SQLAlchemy(app)
 
-from app import routes, models
\ No newline at end of file
+
+def crear_app():
+    """
+    Termina de armar la aplicación: configura el motor, las métricas, las sesiones y el cache, carga las
+    rutas, los comandos y los hooks de cada módulo y registra la API.
+
+    No toca el esquema: las migraciones corren aparte, una sola vez por despliegue (`flask migrar`, o el
+    hook `on_starting` de gunicorn.conf.py antes de crear los workers). Llamarla de nuevo devuelve la misma
+    aplicación.
+
+    Returns:
+        Flask: La aplicación lista para atender requests.
+    """
+    if 'api' in app.blueprints:
+        return app
+    with app.app_context():
+        configurar_motor(db.engine, app.config)
+        instalar_metricas(app, db.engine)
+        configurar_sesiones(app, db.engine)
+
+    instalar_cache(app)
+
+    from app import routes, migraciones
+    from app.api import api
+
+    app.register_blueprint(api)
+    return app
\ No newline at end of file
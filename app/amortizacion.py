@@ -0,0 +1,162 @@
+import numpy as np
+from app.dinero import Dinero, a_centavos
+
+# Sistemas de amortización soportados:
+#   'frances': cuota constante, el interés se calcula sobre el saldo.
+#   'aleman': amortización de capital constante, la cuota baja mes a mes.
+#   'plano': interés simple sobre el monto inicial, cuota constante (el cálculo histórico del simulador).
+SISTEMAS = ('frances', 'aleman', 'plano')
+SISTEMAS_CUOTA_FIJA = ('frances', 'plano')
+
+# Plazo máximo en meses (30 años). Los cronogramas reservan un arreglo por mes, así que el plazo tiene que estar acotado.
+PLAZO_MAXIMO = 360
+
+
+def _tasa_mensual(interes_anual):
+    return np.asarray(interes_anual, dtype=np.float64) / 100 / 12
+
+
+def _validar_plazos(plazos):
+    plazos = np.asarray(plazos)
+    if plazos.size and (plazos.min() < 1 or plazos.max() > PLAZO_MAXIMO):
+        raise ValueError(f'El plazo debe estar entre 1 y {PLAZO_MAXIMO} meses')
+
+
+def _cuota_francesa(p, r, n):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(r > 0, p * r / (1 - (1 + r) ** -n), p / n)
+
+
+def resumen(montos, interes_anual, plazos, sistema='frances'):
+    """
+    Calcula cuota inicial, total de intereses y total a pagar para muchos escenarios a la vez.
+
+    Los argumentos se combinan con las reglas de broadcasting de NumPy, así que se puede pasar
+    un escalar y un arreglo, o arreglos con ejes distintos para armar una grilla.
+
+    Args:
+        montos(float | array): Monto del préstamo.
+        interes_anual(float | array): Interés anual en porcentaje.
+        plazos(int | array): Cantidad de cuotas mensuales.
+        sistema(str): Uno de SISTEMAS.
+    Returns:
+        dict: Arreglos 'cuota_inicial', 'total_interes' y 'total_pagar' con la forma combinada de los argumentos.
+    Raises:
+        ValueError: Si algún plazo está fuera de 1..PLAZO_MAXIMO o el sistema no existe.
+    """
+    _validar_plazos(plazos)
+    p = np.asarray(montos, dtype=np.float64)
+    r = _tasa_mensual(interes_anual)
+    n = np.asarray(plazos, dtype=np.float64)
+
+    if sistema == 'frances':
+        cuota = _cuota_francesa(p, r, n)
+        total_interes = cuota * n - p
+    elif sistema == 'aleman':
+        cuota = p / n + p * r
+        total_interes = p * r * (n + 1) / 2
+    elif sistema == 'plano':
+        total_interes = p * r * n
+        cuota = (p + total_interes) / n
+    else:
+        raise ValueError(f'Sistema de amortización desconocido: {sistema}')
+
+    cuota, total_interes = np.broadcast_arrays(cuota, total_interes)
+    return {'cuota_inicial': cuota, 'total_interes': total_interes, 'total_pagar': total_interes + p}
+
+
+def cronogramas(montos, interes_anual, plazos, sistema='frances'):
+    """
+    Arma los cronogramas mes a mes de muchos préstamos a la vez.
+
+    Se agrega un último eje con los meses, hasta el plazo más largo; los meses posteriores
+    al plazo de cada escenario quedan en cero.
+
+    Args:
+        montos(float | array): Monto del préstamo.
+        interes_anual(float | array): Interés anual en porcentaje.
+        plazos(int | array): Cantidad de cuotas mensuales.
+        sistema(str): Uno de SISTEMAS.
+    Returns:
+        dict: Arreglos 'cuota', 'interes', 'amortizacion' y 'saldo' (saldo al final de cada mes),
+            con forma (*escenarios, meses).
+    Raises:
+        ValueError: Si algún plazo está fuera de 1..PLAZO_MAXIMO o el sistema no existe.
+    """
+    _validar_plazos(plazos)
+    p, r, n = np.broadcast_arrays(
+        np.asarray(montos, dtype=np.float64),
+        _tasa_mensual(interes_anual),
+        np.asarray(plazos, dtype=np.int64),
+    )
+    p, r, n = p[..., None], r[..., None], n[..., None]
+    meses = np.arange(1, int(n.max()) + 1)
+    vigente = meses <= n
+
+    if sistema == 'frances':
+        cuota = _cuota_francesa(p, r, n)
+        factor = (1 + r) ** (meses - 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            saldo_anterior = np.where(r > 0, p * factor - cuota * (factor - 1) / r, p - cuota * (meses - 1))
+        interes = saldo_anterior * r
+        amortizacion = cuota - interes
+    elif sistema == 'aleman':
+        amortizacion = p / n
+        saldo_anterior = p - amortizacion * (meses - 1)
+        interes = saldo_anterior * r
+        cuota = amortizacion + interes
+    elif sistema == 'plano':
+        amortizacion = p / n
+        saldo_anterior = p - amortizacion * (meses - 1)
+        interes = p * r
+        cuota = amortizacion + interes
+    else:
+        raise ValueError(f'Sistema de amortización desconocido: {sistema}')
+
+    forma = vigente.shape
+    resultado = {
+        'cuota': np.broadcast_to(cuota, forma),
+        'interes': np.broadcast_to(interes, forma),
+        'amortizacion': np.broadcast_to(amortizacion, forma),
+        'saldo': np.broadcast_to(saldo_anterior - amortizacion, forma),
+    }
+    return {clave: np.where(vigente, valor, 0.0) for clave, valor in resultado.items()}
+
+
+def cronograma(monto, interes_anual, plazo, sistema='frances'):
+    """
+    Arma el cronograma mes a mes de un préstamo, redondeado a centavos.
+
+    Args:
+        monto(float | Dinero): Monto del préstamo.
+        interes_anual(float): Interés anual en porcentaje.
+        plazo(int): Cantidad de cuotas mensuales.
+        sistema(str): Uno de SISTEMAS.
+    Returns:
+        list: Un diccionario por mes con 'mes', 'cuota', 'interes', 'amortizacion' y 'saldo' (Dinero).
+    """
+    tabla = cronogramas(float(monto), interes_anual, plazo, sistema)
+    columnas = [a_centavos(np.abs(tabla[clave])).tolist() for clave in ('cuota', 'interes', 'amortizacion', 'saldo')]
+    return [
+        {'mes': mes, 'cuota': Dinero(cuota), 'interes': Dinero(interes), 'amortizacion': Dinero(amortizacion), 'saldo': Dinero(saldo)}
+        for mes, (cuota, interes, amortizacion, saldo) in enumerate(zip(*columnas), start=1)
+    ]
+
+
+def comparar(montos, interes_anual, plazos, sistemas=SISTEMAS):
+    """
+    Calcula el resumen de todos los sistemas sobre la grilla (sistema, tasa, plazo, monto) en una sola pasada por sistema.
+
+    Args:
+        montos(iterable): Montos a comparar.
+        interes_anual(iterable): Tasas anuales a comparar, en porcentaje.
+        plazos(iterable): Plazos a comparar, en meses.
+        sistemas(iterable): Sistemas a comparar.
+    Returns:
+        dict: Para cada clave del resumen, un arreglo de forma (sistemas, tasas, plazos, montos).
+    """
+    tasas = np.asarray(list(interes_anual), dtype=np.float64)[:, None, None]
+    plazos = np.asarray(list(plazos), dtype=np.float64)[None, :, None]
+    montos = np.asarray(list(montos), dtype=np.float64)[None, None, :]
+    resumenes = [resumen(montos, tasas, plazos, sistema) for sistema in sistemas]
+    return {clave: np.stack([r[clave] for r in resumenes]) for clave in ('cuota_inicial', 'total_interes', 'total_pagar')}
@@ -0,0 +1,383 @@
+"""
+API JSON versionada (/api/v1) sobre las mismas operaciones de `app.funciones` que usan las páginas.
+
+Cada operación responde en una sola request con el resultado y el estado de la cuenta que cambió, sin
+redirecciones ni páginas renderizadas. El usuario es el de la sesión (POST /api/v1/sesion crea uno).
+
+    GET  /cuenta                        saldo, dólares y versión de la cuenta
+    GET  /transferencias                historial, paginado con ?antes_de=<siguiente>&limite=
+    GET  /transferencias/archivo        resumen por mes de transferencias y préstamos archivados
+    POST /transferencias                {"beneficiario", "monto"}
+    POST /transferencias/lote           lista de {"beneficiario", "monto"} (mismo formato que /transferencia/lote)
+    POST /prestamos/simulacion          {"monto", "tasa", "plazo", "sistema"}
+    GET  /prestamos                     préstamos vigentes
+    POST /prestamos                     {"monto", "tasa", "plazo", "sistema"}
+    POST /prestamos/<id>/pagos          paga la próxima cuota
+    GET  /cotizacion                    precio del dólar
+    POST /dolares/compras, /dolares/ventas   {"cantidad", "cotizacion"}
+    GET  /cotizaciones                  cotización firmada, ?origen=&destino=
+    POST /cambios                       {"origen", "destino", "cantidad", "cotizacion"}
+    GET  /tenencias                     tenencias en cada moneda y su valuación en ?moneda= (ARS por defecto)
+
+Con ?campos=a,b la respuesta incluye solo esos campos (en los listados, de cada elemento).
+Las cotizaciones firmadas (ver `app.divisas`) fijan la tasa de la operación que las recibe; sin ellas se
+opera a la cotización vigente. Las operaciones que mueven dinero aceptan el encabezado Idempotency-Key (ver `app.idempotencia`).
+Los errores de datos responden 400 con {"error": mensaje}.
+"""
+from flask import Blueprint, abort, jsonify, make_response, request, session
+from app import app
+from app.amortizacion import PLAZO_MAXIMO, SISTEMAS, SISTEMAS_CUOTA_FIJA
+from app.archivo import obtener_resumen_archivado
+from app.cotizacion import obtener_precio_dolar
+from app.dinero import CERO, Dinero, sumar
+from app.divisas import emitir_cotizacion, leer_cotizacion, matriz_vigente
+from app.funciones import cambiar_moneda, crear_usuario_temporal, leer_lote_transferencias, obtener_cuenta, obtener_detalle_prestamo, obtener_prestamos_usuario, obtener_tenencias, obtener_transferencias_usuario, pagar_cuota_prestamo, realizar_transferencia, realizar_transferencias_lote, registrar_compra_dolares, registrar_prestamo, registrar_venta_dolares, simular_prestamo, version_cuenta
+from app.idempotencia import idempotente
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Cantidad máxima de transferencias por página del historial.
+LIMITE_HISTORIAL = 500
+
+
+def _error(mensaje, estado=400):
+    return jsonify({'error':mensaje}), estado
+
+
+def _usuario():
+    usuario = session.get('usuario_id')
+    if not usuario:
+        abort(make_response(_error('Usuario no identificado.', 401)))
+    return usuario
+
+
+def _datos():
+    datos = request.get_json(silent=True)
+    return datos if isinstance(datos, dict) else request.form
+
+
+def responder(datos, estado=200, coleccion=None):
+    """
+    Arma la respuesta JSON aplicando la selección de campos de ?campos=.
+
+    Args:
+        datos(dict): Cuerpo de la respuesta.
+        estado(int): Código HTTP.
+        coleccion(str): Clave de `datos` con la lista de elementos a la que se aplica la selección.
+            Sin ella, la selección se aplica a las claves de `datos`.
+    Returns:
+        tuple: (Response, estado).
+    """
+    campos = request.args.get('campos')
+    if campos:
+        campos = {campo.strip() for campo in campos.split(',')}
+        if coleccion:
+            datos = {**datos, coleccion:[{k:v for k, v in elemento.items() if k in campos} for elemento in datos[coleccion]]}
+        else:
+            datos = {k:v for k, v in datos.items() if k in campos}
+    return jsonify(datos), estado
+
+
+def _cuenta(usuario):
+    cuenta = obtener_cuenta(usuario)
+    if cuenta is None:
+        abort(make_response(_error('Usuario no encontrado.', 404)))
+    return cuenta
+
+
+def _prestamo(fila):
+    return {
+        'id':fila.id,
+        'cuotas':fila.cuotas,
+        'cuotas_pagadas':fila.cuotas_pagadas or 0,
+        'cuota_mensual':Dinero(fila.cuota_mensual),
+        'interes_anual':fila.interes_anual,
+        'monto':Dinero(fila.monto),
+        'monto_total':Dinero(fila.monto_total),
+    }
+
+
+def _condiciones_prestamo(datos, sistemas):
+    # Convierte y valida monto, tasa, plazo y sistema de un préstamo.
+    try:
+        monto = Dinero.desde(datos['monto'])
+        tasa = int(datos['tasa'])
+        plazo = int(datos['plazo'])
+    except (KeyError, TypeError):
+        raise ValueError('Faltan datos: monto, tasa y plazo son obligatorios')
+    except ValueError:
+        raise ValueError('Datos del préstamo inválidos')
+    sistema = datos.get('sistema', 'plano')
+    if sistema not in sistemas:
+        raise ValueError(f"Sistema de amortización no disponible: {', '.join(sistemas)}")
+    if monto <= CERO or tasa < 0:
+        raise ValueError('Datos del préstamo inválidos')
+    if not 0 < plazo <= PLAZO_MAXIMO:
+        raise ValueError(f'El plazo debe estar entre 1 y {PLAZO_MAXIMO} meses')
+    return monto, tasa, plazo, sistema
+
+
+@api.route('/sesion', methods=['POST'])
+def crear_sesion():
+    # El usuario se guarda en la base con su primera operación, como en las páginas.
+    if 'usuario_id' in session:
+        return responder({'usuario':session['usuario_id']})
+    return responder({'usuario':crear_usuario_temporal()}, 201)
+
+
+@api.route('/cuenta')
+def cuenta():
+    usuario = _usuario()
+    fila = _cuenta(usuario)
+    return responder({
+        'usuario':usuario,
+        'saldo':Dinero(fila.saldo),
+        'dolares':Dinero(fila.dolares),
+        'version':version_cuenta(usuario),
+    })
+
+
+@api.route('/transferencias')
+def transferencias():
+    usuario = _usuario()
+    _cuenta(usuario)
+    antes_de = request.args.get('antes_de', type=int)
+    limite = min(request.args.get('limite', app.config['HISTORIAL_POR_PAGINA'], type=int), LIMITE_HISTORIAL)
+    if limite <= 0:
+        return _error('El límite debe ser mayor a cero.')
+
+    filas = obtener_transferencias_usuario(usuario, antes_de, limite)
+    elementos = [{
+        'id':fila.id,
+        'remitente':fila.remitente,
+        'beneficiario':fila.beneficiario,
+        'monto':Dinero(fila.transaccion),
+        'fecha':fila.fecha,
+        'tipo':'enviada' if fila.remitente == usuario else 'recibida',
+    } for fila in filas]
+    siguiente = filas[-1].id if len(filas) == limite else None
+    return responder({'transferencias':elementos, 'siguiente':siguiente}, coleccion='transferencias')
+
+
+@api.route('/transferencias/archivo')
+def transferencias_archivadas():
+    usuario = _usuario()
+    _cuenta(usuario)
+    return responder({'resumen':obtener_resumen_archivado(usuario)}, coleccion='resumen')
+
+
+@api.route('/transferencias', methods=['POST'])
+@idempotente
+def crear_transferencia():
+    usuario = _usuario()
+    datos = _datos()
+    try:
+        beneficiario = datos['beneficiario']
+        monto = Dinero.desde(datos['monto'])
+        id_transferencia = realizar_transferencia(beneficiario, usuario, monto)
+    except KeyError:
+        return _error('Faltan datos: beneficiario y monto son obligatorios.')
+    except (TypeError, ValueError) as e:
+        return _error(f'{e}.')
+
+    return responder({
+        'id':id_transferencia,
+        'beneficiario':beneficiario,
+        'monto':monto,
+        'saldo':Dinero(_cuenta(usuario).saldo),
+    }, 201)
+
+
+@api.route('/transferencias/lote', methods=['POST'])
+@idempotente
+def crear_transferencias_lote():
+    usuario = _usuario()
+    try:
+        pagos = leer_lote_transferencias(request.get_json(), 'json')
+    except Exception:
+        return _error('Error al procesar los datos del lote.')
+    if not pagos:
+        return _error('El lote no contiene transferencias.')
+    if len(pagos) > app.config['TRANSFERENCIAS_LOTE_MAXIMO']:
+        return _error(f"El lote supera el máximo de {app.config['TRANSFERENCIAS_LOTE_MAXIMO']} transferencias.")
+
+    try:
+        resultados = realizar_transferencias_lote(usuario, pagos)
+    except ValueError as e:
+        return _error(f'{e}.')
+
+    realizadas = [r for r in resultados if r['estado'] == 'realizada']
+    return responder({
+        'realizadas':len(realizadas),
+        'rechazadas':len(resultados) - len(realizadas),
+        'total':sumar(r['monto'] for r in realizadas),
+        'saldo':Dinero(_cuenta(usuario).saldo),
+        'resultados':resultados,
+    }, coleccion='resultados')
+
+
+@api.route('/prestamos/simulacion', methods=['POST'])
+def simular():
+    try:
+        monto, tasa, plazo, sistema = _condiciones_prestamo(_datos(), SISTEMAS)
+        total_interes, total_pagar, cuota = simular_prestamo(tasa, monto, plazo, sistema)
+    except ValueError as e:
+        return _error(f'{e}.')
+    return responder({
+        'monto':monto,
+        'tasa':tasa,
+        'plazo':plazo,
+        'sistema':sistema,
+        'cuota_mensual':cuota,
+        'total_interes':total_interes,
+        'total_pagar':total_pagar,
+        'solicitable':sistema in SISTEMAS_CUOTA_FIJA,
+    })
+
+
+@api.route('/prestamos')
+def prestamos():
+    usuario = _usuario()
+    _cuenta(usuario)
+    return responder({'prestamos':[_prestamo(fila) for fila in obtener_prestamos_usuario(usuario)]}, coleccion='prestamos')
+
+
+@api.route('/prestamos', methods=['POST'])
+@idempotente
+def crear_prestamo():
+    usuario = _usuario()
+    try:
+        # Las condiciones se recalculan acá; solo se pueden solicitar préstamos de cuota constante.
+        monto, tasa, plazo, sistema = _condiciones_prestamo(_datos(), SISTEMAS_CUOTA_FIJA)
+        _, total, cuota = simular_prestamo(tasa, monto, plazo, sistema)
+        id_prestamo = registrar_prestamo(usuario, monto, plazo, cuota, tasa, total)
+    except ValueError as e:
+        return _error(f'{e}.')
+    return responder({
+        'prestamo':_prestamo(obtener_detalle_prestamo(id_prestamo)),
+        'saldo':Dinero(_cuenta(usuario).saldo),
+    }, 201)
+
+
+@api.route('/prestamos/<int:prestamo_id>/pagos', methods=['POST'])
+@idempotente
+def pagar_prestamo(prestamo_id):
+    usuario = _usuario()
+    try:
+        pagar_cuota_prestamo(prestamo_id, usuario)
+    except ValueError as e:
+        return _error(f'{e}.')
+    return responder({
+        'prestamo':_prestamo(obtener_detalle_prestamo(prestamo_id)),
+        'saldo':Dinero(_cuenta(usuario).saldo),
+    })
+
+
+@api.route('/cotizacion')
+def cotizacion():
+    precio = obtener_precio_dolar()
+    if precio is None:
+        return _error('No se pudo obtener el precio del dólar.', 503)
+    return responder({'moneda':'USD', 'precio':precio})
+
+
+def _monedas(datos):
+    try:
+        return str(datos['origen']).upper(), str(datos['destino']).upper()
+    except KeyError:
+        raise ValueError('Faltan datos: origen y destino son obligatorios')
+
+
+def _tasa(datos, usuario, origen, destino):
+    # La tasa de la cotización firmada que manda el cliente o, si no manda ninguna, la vigente.
+    if datos.get('cotizacion'):
+        return leer_cotizacion(datos['cotizacion'], usuario, origen, destino)
+    return matriz_vigente().tasa(origen, destino)
+
+
+@api.route('/cotizaciones')
+def cotizaciones():
+    usuario = _usuario()
+    try:
+        cotizacion = emitir_cotizacion(usuario, *_monedas(request.args))
+    except ValueError as e:
+        return _error(f'{e}.')
+    return responder(cotizacion)
+
+
+@api.route('/cambios', methods=['POST'])
+@idempotente
+def crear_cambio():
+    usuario = _usuario()
+    datos = _datos()
+    try:
+        origen, destino = _monedas(datos)
+        cantidad = Dinero.desde(datos['cantidad'])
+        tasa = _tasa(datos, usuario, origen, destino)
+        importe = cambiar_moneda(usuario, origen, destino, cantidad, tasa)
+    except KeyError:
+        return _error('Falta la cantidad a cambiar.')
+    except (TypeError, ValueError) as e:
+        return _error(f'{e}.')
+    return responder({
+        'origen':origen,
+        'destino':destino,
+        'cantidad':cantidad,
+        'tasa':tasa,
+        'importe':importe,
+        'tenencias':obtener_tenencias(usuario),
+    }, 201)
+
+
+@api.route('/tenencias')
+def tenencias():
+    usuario = _usuario()
+    _cuenta(usuario)
+    moneda = request.args.get('moneda', 'ARS').upper()
+    actuales = obtener_tenencias(usuario)
+    try:
+        convertidos, sin_cotizacion = matriz_vigente().convertir([t.centavos for t in actuales.values()], list(actuales), moneda)
+    except ValueError as e:
+        return _error(f'{e}.')
+    return responder({
+        'tenencias':actuales,
+        'moneda':moneda,
+        'valuacion':Dinero(int(convertidos.sum())),
+        'sin_cotizacion':[m for m, falta in zip(actuales, sin_cotizacion) if falta],
+    })
+
+
+def _operar_dolares(registrar):
+    usuario = _usuario()
+    datos = _datos()
+    try:
+        precio = _tasa(datos, usuario, 'USD', 'ARS')
+    except ValueError as e:
+        return _error(f'{e}.', 400 if datos.get('cotizacion') else 503)
+    try:
+        cantidad = Dinero.desde(datos['cantidad'])
+        importe = registrar(usuario, cantidad, precio)
+    except KeyError:
+        return _error('Falta la cantidad de dólares.')
+    except (TypeError, ValueError) as e:
+        return _error(f'{e}.')
+    fila = _cuenta(usuario)
+    return responder({
+        'cantidad':cantidad,
+        'precio':precio,
+        'importe':importe,
+        'saldo':Dinero(fila.saldo),
+        'dolares':Dinero(fila.dolares),
+    }, 201)
+
+
+@api.route('/dolares/compras', methods=['POST'])
+@idempotente
+def comprar_dolares():
+    return _operar_dolares(registrar_compra_dolares)
+
+
+@api.route('/dolares/ventas', methods=['POST'])
+@idempotente
+def vender_dolares():
+    return _operar_dolares(registrar_venta_dolares)
@@ -0,0 +1,309 @@
+"""
+Archivo de datos cerrados: saca de las tablas de uso diario lo que ya no cambia y lo guarda comprimido.
+
+    - transferencias con más de ARCHIVO_RETENCION_DIAS días;
+    - préstamos pagados por completo, con sus cuotas rechazadas;
+    - usuarios temporales abandonados, al borrarlos (ver `app.usuarios.limpiar_usuarios_temporales`).
+
+Lo archivado se guarda en 'archivo_bloques', de a ARCHIVO_LOTE filas por bloque: cada bloque tiene las
+columnas de sus filas como JSON comprimido con zlib y un resumen sin comprimir (cantidad y montos) que
+se suma sin leer los datos. Por usuario y mes quedan en 'resumen_archivo' la cantidad y el monto de lo
+archivado, que se consultan como cualquier tabla.
+
+Cada lote se archiva en su propia transacción, y se puede correr en segundo plano cada ARCHIVO_INTERVALO
+segundos o con `flask archivar`.
+"""
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+import click
+from sqlalchemy import bindparam, text
+from app import app, db
+from app.basedatos import nombre_dialecto, para_actualizar
+from app.dinero import Dinero
+
+logger = logging.getLogger(__name__)
+
+# Mes de 'resumen_archivo' de las transferencias anteriores a que se registrara la fecha.
+MES_SIN_FECHA = '0000-00'
+
+_COLUMNAS_TRANSFERENCIAS = ('id', 'remitente', 'beneficiario', 'transaccion', 'fecha')
+
+
+def _fecha(valor):
+    # SQLite devuelve las fechas como texto y PostgreSQL como datetime: se guardan con el formato de SQLite.
+    if isinstance(valor, datetime.datetime):
+        return valor.strftime('%Y-%m-%d %H:%M:%S')
+    return valor
+
+
+def _comprimir(tablas):
+    return zlib.compress(json.dumps(tablas, separators=(',', ':')).encode(), 6)
+
+
+def _columnas(filas, nombres):
+    return {nombre:[_fecha(fila[i]) for fila in filas] for i, nombre in enumerate(nombres)}
+
+
+def guardar_bloque(conexion, tipo, tablas, resumen, desde_id=None, hasta_id=None, meses=(None, None)):
+    """
+    Guarda un bloque del archivo. Se llama en la misma transacción que borra las filas archivadas.
+
+    Args:
+        conexion(Connection): Conexión con la transacción en curso.
+        tipo(str): 'transferencias', 'prestamos' o 'usuarios'.
+        tablas(dict): Nombre de tabla -> columnas (nombre -> lista de valores).
+        resumen(dict): Totales del bloque que se pueden leer sin descomprimirlo.
+        desde_id(int): Menor id archivado.
+        hasta_id(int): Mayor id archivado.
+        meses(tuple): (primer mes, último mes) de las filas, con formato 'AAAA-MM'.
+    Returns:
+        Esta función no retorna valor.
+    """
+    filas = max((len(next(iter(columnas.values()), [])) for columnas in tablas.values()), default=0)
+    conexion.execute(text('''
+        INSERT INTO archivo_bloques (tipo, desde_id, hasta_id, desde_mes, hasta_mes, filas, resumen, datos, creado)
+        VALUES (:tipo, :desde_id, :hasta_id, :desde_mes, :hasta_mes, :filas, :resumen, :datos, CURRENT_TIMESTAMP)
+    '''), {'tipo':tipo, 'desde_id':desde_id, 'hasta_id':hasta_id, 'desde_mes':meses[0], 'hasta_mes':meses[1],
+           'filas':filas, 'resumen':json.dumps(resumen), 'datos':_comprimir(tablas)})
+
+
+def leer_bloque(id_bloque):
+    """
+    Devuelve las filas de un bloque del archivo.
+
+    Args:
+        id_bloque(int): ID del bloque.
+    Returns:
+        dict: Nombre de tabla -> lista de filas (diccionarios columna -> valor).
+        None: Si el bloque no existe.
+    """
+    datos = db.session.execute(text('SELECT datos FROM archivo_bloques WHERE id = :id'), {'id':id_bloque}).scalar()
+    if datos is None:
+        return None
+    tablas = json.loads(zlib.decompress(datos))
+    return {tabla:[dict(zip(columnas, valores)) for valores in zip(*columnas.values())] for tabla, columnas in tablas.items()}
+
+
+def _archivar_transferencias(conexion, limite, tamano_lote):
+    # Archiva las transferencias más viejas de la tabla, hasta la primera más nueva que `limite`.
+    # Devuelve la cantidad archivada.
+    if nombre_dialecto(conexion) == 'sqlite':
+        conexion.exec_driver_sql('BEGIN IMMEDIATE')
+    filas = conexion.execute(text('''
+        SELECT id, id_usuario_remitente, id_usuario_beneficiario, transaccion, fecha
+        FROM transferencias ORDER BY id LIMIT :lote
+    ''' + para_actualizar(conexion)), {'lote':tamano_lote}).fetchall()
+    viejas = []
+    for fila in filas:
+        if fila.fecha is not None and str(_fecha(fila.fecha)) >= limite:
+            break
+        viejas.append(fila)
+    if not viejas:
+        conexion.commit()
+        return 0
+
+    # Las filas de los usuarios se bloquean como en cualquier operación que cambia su historial,
+    # y cada uno recibe un movimiento en cero: así cambia la versión de su cuenta y no se sirven páginas viejas.
+    usuarios = sorted({fila.id_usuario_remitente for fila in viejas} | {fila.id_usuario_beneficiario for fila in viejas})
+    ids = bindparam('ids', expanding=True)
+    uuids = dict(conexion.execute(text('SELECT id, "user" FROM "user" WHERE id IN :ids ORDER BY id' + para_actualizar(conexion)).bindparams(ids), {'ids':usuarios}).fetchall())
+
+    resumen = {}
+    for fila in viejas:
+        mes = str(_fecha(fila.fecha))[:7] if fila.fecha is not None else MES_SIN_FECHA
+        for id_usuario, concepto in ((fila.id_usuario_remitente, 'enviadas'), (fila.id_usuario_beneficiario, 'recibidas')):
+            cantidad, monto = resumen.get((id_usuario, mes, concepto), (0, 0))
+            resumen[(id_usuario, mes, concepto)] = (cantidad + 1, monto + fila.transaccion)
+    meses = sorted({mes for _, mes, _ in resumen})
+
+    guardar_bloque(conexion, 'transferencias', {
+        'transferencias':_columnas([(f.id, uuids[f.id_usuario_remitente], uuids[f.id_usuario_beneficiario], f.transaccion, f.fecha) for f in viejas], _COLUMNAS_TRANSFERENCIAS),
+    }, {'cantidad':len(viejas), 'monto':sum(fila.transaccion for fila in viejas)}, viejas[0].id, viejas[-1].id, (meses[0], meses[-1]))
+    conexion.execute(text('''
+        INSERT INTO resumen_archivo (id_usuario, mes, concepto, cantidad, monto) VALUES (:id_usuario, :mes, :concepto, :cantidad, :monto)
+        ON CONFLICT (id_usuario, mes, concepto)
+        DO UPDATE SET cantidad = resumen_archivo.cantidad + excluded.cantidad, monto = resumen_archivo.monto + excluded.monto
+    '''), [{'id_usuario':id_usuario, 'mes':mes, 'concepto':concepto, 'cantidad':cantidad, 'monto':monto}
+           for (id_usuario, mes, concepto), (cantidad, monto) in sorted(resumen.items())])
+    conexion.execute(text('DELETE FROM transferencias WHERE id IN :ids').bindparams(ids), {'ids':[fila.id for fila in viejas]})
+    conexion.execute(text('''
+        INSERT INTO movimientos (id_usuario, moneda, monto, tipo, fecha) VALUES (:id_usuario, 'ARS', 0, 'archivo', CURRENT_TIMESTAMP)
+    '''), [{'id_usuario':id_usuario} for id_usuario in usuarios])
+    conexion.commit()
+    return len(viejas)
+
+
+def _archivar_prestamos(conexion, desde, tamano_lote):
+    # Archiva los préstamos pagados con id mayor a `desde`. Devuelve (cantidad archivada, último id leído).
+    if nombre_dialecto(conexion) == 'sqlite':
+        conexion.exec_driver_sql('BEGIN IMMEDIATE')
+    columnas = ('id', 'id_usuario', 'cuotas_pagadas', 'cuota_mensual', 'interes_anual', 'monto', 'monto_total', 'periodo_cobrado')
+    prestamos = conexion.execute(text(f'''
+        SELECT {', '.join(columnas)} FROM prestamos
+        WHERE id > :desde AND cuotas <= 0 ORDER BY id LIMIT :lote
+    ''' + para_actualizar(conexion)), {'desde':desde, 'lote':tamano_lote}).fetchall()
+    if not prestamos:
+        conexion.commit()
+        return 0, None
+
+    ids = [prestamo.id for prestamo in prestamos]
+    por_id = bindparam('ids', expanding=True)
+    columnas_rechazos = ('id', 'id_prestamo', 'periodo', 'motivo', 'fecha')
+    rechazos = conexion.execute(text(f'SELECT {", ".join(columnas_rechazos)} FROM cuotas_rechazadas WHERE id_prestamo IN :ids ORDER BY id').bindparams(por_id), {'ids':ids}).fetchall()
+
+    mes = datetime.date.today().strftime('%Y-%m')
+    resumen = {}
+    for prestamo in prestamos:
+        cantidad, monto = resumen.get(prestamo.id_usuario, (0, 0))
+        resumen[prestamo.id_usuario] = (cantidad + 1, monto + prestamo.monto)
+    guardar_bloque(conexion, 'prestamos', {
+        'prestamos':_columnas(prestamos, columnas),
+        'cuotas_rechazadas':_columnas(rechazos, columnas_rechazos),
+    }, {
+        'cantidad':len(prestamos),
+        'monto':sum(prestamo.monto for prestamo in prestamos),
+        'deuda':sum(prestamo.monto_total for prestamo in prestamos),
+        'cuotas_pagadas':sum(prestamo.cuotas_pagadas or 0 for prestamo in prestamos),
+        'cobrado':sum((prestamo.cuotas_pagadas or 0) * (prestamo.cuota_mensual or 0) for prestamo in prestamos),
+    }, ids[0], ids[-1], (mes, mes))
+    conexion.execute(text('''
+        INSERT INTO resumen_archivo (id_usuario, mes, concepto, cantidad, monto) VALUES (:id_usuario, :mes, 'prestamos', :cantidad, :monto)
+        ON CONFLICT (id_usuario, mes, concepto)
+        DO UPDATE SET cantidad = resumen_archivo.cantidad + excluded.cantidad, monto = resumen_archivo.monto + excluded.monto
+    '''), [{'id_usuario':id_usuario, 'mes':mes, 'cantidad':cantidad, 'monto':monto} for id_usuario, (cantidad, monto) in sorted(resumen.items())])
+    conexion.execute(text('DELETE FROM cuotas_rechazadas WHERE id_prestamo IN :ids').bindparams(por_id), {'ids':ids})
+    conexion.execute(text('DELETE FROM prestamos WHERE id IN :ids').bindparams(por_id), {'ids':ids})
+    conexion.commit()
+    return len(prestamos), ids[-1]
+
+
+def archivar(retencion_dias=None, tamano_lote=None):
+    """
+    Archiva las transferencias viejas y los préstamos pagados, de a un lote por transacción.
+
+    Args:
+        retencion_dias(int): Días que las transferencias quedan en la tabla. Por defecto, ARCHIVO_RETENCION_DIAS.
+        tamano_lote(int): Filas por bloque. Por defecto, ARCHIVO_LOTE.
+    Returns:
+        dict: 'transferencias' y 'prestamos' archivados y 'bloques' escritos.
+    Raises:
+        ValueError: Si la retención es negativa o el tamaño de lote no es positivo.
+    """
+    retencion_dias = app.config['ARCHIVO_RETENCION_DIAS'] if retencion_dias is None else retencion_dias
+    tamano_lote = tamano_lote or app.config['ARCHIVO_LOTE']
+    if retencion_dias < 0:
+        raise ValueError('La retención no puede ser negativa')
+    if tamano_lote < 1:
+        raise ValueError('El tamaño de lote debe ser positivo')
+    # CURRENT_TIMESTAMP de SQLite es UTC, y con ese formato se comparan las fechas.
+    limite = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=retencion_dias)).strftime('%Y-%m-%d %H:%M:%S')
+
+    resultado = {'transferencias':0, 'prestamos':0, 'bloques':0}
+    with db.engine.connect() as conexion:
+        try:
+            while True:
+                archivadas = _archivar_transferencias(conexion, limite, tamano_lote)
+                if not archivadas:
+                    break
+                resultado['transferencias'] += archivadas
+                resultado['bloques'] += 1
+            desde = 0
+            while True:
+                archivados, desde = _archivar_prestamos(conexion, desde, tamano_lote)
+                if not archivados:
+                    break
+                resultado['prestamos'] += archivados
+                resultado['bloques'] += 1
+        except Exception:
+            conexion.rollback()
+            raise
+    return resultado
+
+
+def obtener_resumen_archivado(usuario):
+    """
+    Obtiene el resumen por mes de lo archivado de un usuario.
+
+    Args:
+        usuario(str): ID del usuario.
+    Returns:
+        list: Diccionarios con 'mes', 'concepto' ('enviadas', 'recibidas' o 'prestamos'), 'cantidad' y
+            'monto' (Dinero), del mes más reciente al más antiguo.
+    """
+    consulta = text('''
+        SELECT r.mes, r.concepto, r.cantidad, r.monto FROM resumen_archivo r JOIN "user" u ON u.id = r.id_usuario
+        WHERE u."user" = :usuario ORDER BY r.mes DESC, r.concepto
+    ''')
+    return [{'mes':fila.mes, 'concepto':fila.concepto, 'cantidad':fila.cantidad, 'monto':Dinero(fila.monto)}
+            for fila in db.session.execute(consulta, {'usuario':usuario})]
+
+
+def iterar_transferencias_archivadas(usuario):
+    """
+    Recorre las transferencias archivadas del usuario, descomprimiendo solo los bloques de los meses en que tiene alguna.
+
+    Args:
+        usuario(str): ID del usuario.
+    Returns:
+        generator: Filas (remitente, beneficiario, transaccion, id, fecha), de la más reciente a la más antigua.
+    """
+    meses = db.session.execute(text('''
+        SELECT MIN(r.mes), MAX(r.mes) FROM resumen_archivo r JOIN "user" u ON u.id = r.id_usuario
+        WHERE u."user" = :usuario AND r.concepto IN ('enviadas', 'recibidas')
+    '''), {'usuario':usuario}).fetchone()
+    if meses is None or meses[0] is None:
+        return
+    bloques = db.session.execute(text('''
+        SELECT id FROM archivo_bloques WHERE tipo = 'transferencias' AND desde_mes <= :hasta AND hasta_mes >= :desde ORDER BY id DESC
+    '''), {'desde':meses[0], 'hasta':meses[1]}).scalars().all()
+    for id_bloque in bloques:
+        filas = leer_bloque(id_bloque)['transferencias']
+        for fila in reversed(filas):
+            if usuario in (fila['remitente'], fila['beneficiario']):
+                yield tuple(fila[columna] for columna in ('remitente', 'beneficiario', 'transaccion', 'id', 'fecha'))
+
+
+_pid_archivo = None
+_lock_archivo = threading.Lock()
+
+
+def _archivar_periodicamente(intervalo):
+    while True:
+        time.sleep(intervalo)
+        try:
+            with app.app_context():
+                archivar()
+        except Exception:
+            logger.warning('No se pudieron archivar los datos cerrados.', exc_info=True)
+
+
+@app.before_request
+def iniciar_archivo():
+    # Un hilo de archivo por proceso, arrancado con la primera request (los hilos no sobreviven al fork).
+    global _pid_archivo
+    intervalo = app.config['ARCHIVO_INTERVALO']
+    if not intervalo or _pid_archivo == os.getpid():
+        return
+    with _lock_archivo:
+        if _pid_archivo != os.getpid():
+            _pid_archivo = os.getpid()
+            threading.Thread(target=_archivar_periodicamente, args=(intervalo,), daemon=True, name='archivo').start()
+
+
+@app.cli.command('archivar')
+@click.option('--retencion', type=int, default=None, help='Días que las transferencias quedan en la tabla (por defecto, ARCHIVO_RETENCION_DIAS).')
+@click.option('--lote', type=int, default=None, help='Filas por bloque (por defecto, ARCHIVO_LOTE).')
+def archivar_comando(retencion, lote):
+    """Archiva las transferencias viejas y los préstamos pagados."""
+    inicio = time.perf_counter()
+    try:
+        resultado = archivar(retencion, lote)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    print(f"Transferencias archivadas: {resultado['transferencias']}. Préstamos archivados: {resultado['prestamos']}. "
+          f"Bloques: {resultado['bloques']} ({time.perf_counter() - inicio:.2f} s).")
@@ -0,0 +1,123 @@
+from sqlalchemy import event
+
+# Pragmas que se aplican a cada conexión nueva de SQLite según el perfil.
+# 'default' deja SQLite como viene (journal de rollback, sin busy timeout explícito).
+PERFILES_SQLITE = {
+    'default': {},
+    'produccion': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'foreign_keys': 'ON',
+        'temp_store': 'MEMORY',
+    },
+}
+
+
+def normalizar_uri(uri):
+    """
+    Ajusta la URI de la base de datos al formato que espera SQLAlchemy.
+
+    Algunos proveedores entregan 'postgres://', que SQLAlchemy 2 ya no acepta.
+
+    Args:
+        uri(str): URI configurada.
+    Returns:
+        str: La URI normalizada.
+    """
+    if uri.startswith('postgres://'):
+        return 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def nombre_dialecto(conexion):
+    """
+    Devuelve el nombre del dialecto ('sqlite' o 'postgresql') de una conexión o sesión.
+
+    Args:
+        conexion(Connection | Session): Conexión o sesión de SQLAlchemy.
+    Returns:
+        str: Nombre del dialecto.
+    """
+    dialecto = getattr(conexion, 'dialect', None) or conexion.get_bind().dialect
+    return dialecto.name
+
+
+def para_actualizar(conexion):
+    """
+    Sufijo para bloquear las filas leídas hasta el fin de la transacción.
+
+    En PostgreSQL es 'FOR UPDATE'. SQLite no lo soporta ni lo necesita: un solo escritor tiene la base a la vez.
+
+    Args:
+        conexion(Connection | Session): Conexión o sesión de SQLAlchemy.
+    Returns:
+        str: ' FOR UPDATE' o una cadena vacía.
+    """
+    return ' FOR UPDATE' if nombre_dialecto(conexion) == 'postgresql' else ''
+
+
+def opciones_motor(config):
+    """
+    Arma las opciones del motor de SQLAlchemy (SQLALCHEMY_ENGINE_OPTIONS) según el perfil configurado.
+
+    Args:
+        config(dict): Configuración de la aplicación.
+    Returns:
+        dict: Opciones para `create_engine`.
+    """
+    if config['DB_PERFIL'] == 'default':
+        return {}
+    opciones = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+    }
+    if config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        # Espera del driver antes de devolver "database is locked", en segundos.
+        opciones['connect_args'] = {'timeout': config['DB_BUSY_TIMEOUT_MS'] / 1000}
+    else:
+        # En un servidor las conexiones pueden cortarse del otro lado: se verifican y se reciclan.
+        opciones['pool_pre_ping'] = True
+        opciones['pool_recycle'] = config['DB_POOL_RECYCLE']
+    return opciones
+
+
+def pragmas_sqlite(config):
+    """
+    Devuelve los pragmas a aplicar en cada conexión de SQLite según el perfil configurado.
+
+    Args:
+        config(dict): Configuración de la aplicación.
+    Returns:
+        dict: Nombre del pragma -> valor.
+    """
+    pragmas = dict(PERFILES_SQLITE[config['DB_PERFIL']])
+    if pragmas:
+        pragmas['busy_timeout'] = config['DB_BUSY_TIMEOUT_MS']
+        pragmas['cache_size'] = -config['SQLITE_CACHE_KB']
+        pragmas['mmap_size'] = config['SQLITE_MMAP_BYTES']
+    return pragmas
+
+
+def configurar_motor(engine, config):
+    """
+    Registra los pragmas del perfil para que se apliquen a cada conexión que abra el motor.
+
+    Args:
+        engine(Engine): Motor de SQLAlchemy de la aplicación.
+        config(dict): Configuración de la aplicación.
+    Returns:
+        Esta función no retorna valor.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = pragmas_sqlite(config)
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def aplicar_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for nombre, valor in pragmas.items():
+            cursor.execute(f'PRAGMA {nombre}={valor}')
+        cursor.close()
@@ -0,0 +1,175 @@
+"""
+Cache de páginas renderizadas con validación por ETag y URLs de archivos estáticos con hash de contenido.
+
+Las páginas GET decoradas con `cachear_pagina` se guardan ya renderizadas en memoria del proceso:
+    - sin `version`, son páginas fijas (formularios): dependen solo de las plantillas;
+    - con `version`, la clave incluye la versión de la cuenta del usuario, que cambia con cada escritura.
+La ETag se calcula antes de renderizar, así un navegador que ya tiene la página recibe un 304 sin tocar la
+plantilla. Las páginas se sirven con 'no-cache' (se revalidan siempre), porque la misma URL puede tener que
+mostrar un mensaje flash después de un POST; mientras haya mensajes pendientes en la sesión no se usa el cache.
+
+Los archivos de app/static se enlazan con ?v=<hash del contenido> y esas URLs se sirven con max-age de un año.
+"""
+import collections
+import functools
+import hashlib
+import os
+import threading
+from datetime import datetime, timezone
+from flask import Response, current_app, request, session
+
+
+class CachePaginas:
+    """
+    LRU de respuestas renderizadas, compartido por los hilos del proceso.
+
+    Args:
+        maximo(int): Cantidad máxima de páginas guardadas.
+    """
+
+    def __init__(self, maximo=1000):
+        self.maximo = maximo
+        self._paginas = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            pagina = self._paginas.get(clave)
+            if pagina is not None:
+                self._paginas.move_to_end(clave)
+            return pagina
+
+    def guardar(self, clave, pagina):
+        with self._lock:
+            self._paginas[clave] = pagina
+            self._paginas.move_to_end(clave)
+            while len(self._paginas) > self.maximo:
+                self._paginas.popitem(last=False)
+
+    def vaciar(self):
+        with self._lock:
+            self._paginas.clear()
+
+
+cache_paginas = CachePaginas()
+_estado = {'version_plantillas':'', 'modificacion_plantillas':None}
+_hashes_estaticos = {}
+
+
+def _recorrer(carpeta):
+    for raiz, _, archivos in sorted(os.walk(carpeta)):
+        for archivo in sorted(archivos):
+            yield os.path.join(raiz, archivo)
+
+
+def _responder(cuerpo, mimetype, etag, ultima_modificacion):
+    respuesta = Response(cuerpo, mimetype=mimetype)
+    respuesta.set_etag(etag)
+    if ultima_modificacion is not None:
+        respuesta.last_modified = ultima_modificacion
+    respuesta.cache_control.no_cache = True
+    respuesta.cache_control.private = True
+    respuesta.vary.add('Cookie')
+    return respuesta.make_conditional(request)
+
+
+def cachear_pagina(version=None):
+    """
+    Decorador que cachea la respuesta GET de una vista y responde 304 cuando el navegador ya la tiene.
+
+    Args:
+        version(callable): Función sin argumentos que devuelve la versión de los datos de la página para el
+            usuario de la sesión, o None si esa request no se debe cachear. Sin ella, la página es fija.
+    Returns:
+        callable: El decorador.
+    """
+    def decorador(vista):
+        @functools.wraps(vista)
+        def envoltura(*args, **kwargs):
+            if request.method != 'GET' or not current_app.config['CACHE_PAGINAS'] or '_flashes' in session:
+                return vista(*args, **kwargs)
+            if version is None:
+                clave = (request.endpoint, request.full_path)
+                ultima_modificacion = _estado['modificacion_plantillas']
+            else:
+                datos = version()
+                if datos is None:
+                    return vista(*args, **kwargs)
+                clave = (request.endpoint, request.full_path, session.get('usuario_id'), datos)
+                ultima_modificacion = None
+            etag = hashlib.sha1(repr((_estado['version_plantillas'], clave)).encode()).hexdigest()
+
+            if request.if_none_match.contains(etag):
+                return _responder(b'', None, etag, ultima_modificacion)
+            pagina = cache_paginas.obtener(clave)
+            if pagina is None:
+                respuesta = current_app.make_response(vista(*args, **kwargs))
+                # Solo se guardan páginas completas que no dejaron mensajes para la request siguiente.
+                if respuesta.status_code != 200 or respuesta.is_streamed or '_flashes' in session:
+                    return respuesta
+                pagina = (respuesta.get_data(), respuesta.mimetype)
+                cache_paginas.guardar(clave, pagina)
+            return _responder(pagina[0], pagina[1], etag, ultima_modificacion)
+        return envoltura
+    return decorador
+
+
+def hash_estatico(carpeta, archivo):
+    """
+    Devuelve un hash corto del contenido de un archivo estático, recalculado solo si el archivo cambió.
+
+    Args:
+        carpeta(str): Carpeta de archivos estáticos.
+        archivo(str): Ruta del archivo dentro de la carpeta.
+    Returns:
+        str: Los primeros 12 caracteres del SHA-1 del contenido, o None si el archivo no existe.
+    """
+    ruta = os.path.join(carpeta, archivo)
+    try:
+        modificacion = os.stat(ruta).st_mtime_ns
+    except OSError:
+        return None
+    guardado = _hashes_estaticos.get(ruta)
+    if guardado is None or guardado[0] != modificacion:
+        with open(ruta, 'rb') as contenido:
+            guardado = (modificacion, hashlib.sha1(contenido.read()).hexdigest()[:12])
+        _hashes_estaticos[ruta] = guardado
+    return guardado[1]
+
+
+def instalar_cache(app):
+    """
+    Configura el cache de páginas y las URLs versionadas de los archivos estáticos.
+
+    Args:
+        app(Flask): La aplicación.
+    Returns:
+        Esta función no retorna valor.
+    """
+    cache_paginas.maximo = app.config['CACHE_PAGINAS_MAXIMO']
+    carpeta_plantillas = os.path.join(app.root_path, app.template_folder)
+    contenido = hashlib.sha1()
+    modificacion = 0
+    for ruta in _recorrer(carpeta_plantillas):
+        with open(ruta, 'rb') as archivo:
+            contenido.update(archivo.read())
+        modificacion = max(modificacion, int(os.path.getmtime(ruta)))
+    _estado['version_plantillas'] = contenido.hexdigest()
+    _estado['modificacion_plantillas'] = datetime.fromtimestamp(modificacion, timezone.utc)
+
+    @app.url_defaults
+    def versionar_estaticos(endpoint, valores):
+        if endpoint == 'static' and 'filename' in valores and 'v' not in valores:
+            version = hash_estatico(app.static_folder, valores['filename'])
+            if version:
+                valores['v'] = version
+
+    @app.after_request
+    def cachear_estaticos(respuesta):
+        # Una URL con ?v= cambia cuando cambia el archivo: el navegador puede guardarla sin revalidar.
+        if request.endpoint == 'static' and request.args.get('v'):
+            respuesta.cache_control.public = True
+            respuesta.cache_control.max_age = app.config['ESTATICOS_MAX_AGE']
+            respuesta.cache_control.immutable = True
+            respuesta.cache_control.no_cache = None
+        return respuesta
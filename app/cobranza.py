@@ -0,0 +1,179 @@
+import datetime
+import re
+import click
+from sqlalchemy import text
+from app import app, db
+from app.basedatos import nombre_dialecto, para_actualizar
+from app.dinero import Dinero
+from app.reportes import acumular
+
+# Préstamos con cuotas pendientes que todavía no se cobraron en el período.
+_CONDICION_VENCIDOS = 'cuotas > 0 AND (periodo_cobrado IS NULL OR periodo_cobrado < :periodo)'
+
+
+def periodo_actual():
+    """
+    Devuelve el período de cobro del mes en curso.
+
+    Returns:
+        str: Período con formato 'AAAA-MM'.
+    """
+    return datetime.date.today().strftime('%Y-%m')
+
+
+def _iniciar_lote(conexion):
+    # En SQLite se toma el lock de escritura desde el principio: si el lote empezara leyendo,
+    # otro escritor podría adelantarse y la transacción fallaría al pasar a escribir.
+    if nombre_dialecto(conexion) == 'sqlite':
+        conexion.exec_driver_sql('BEGIN IMMEDIATE')
+    conexion.execute(text('''
+        CREATE TEMPORARY TABLE IF NOT EXISTS cuotas_lote (
+            id_prestamo INTEGER NOT NULL PRIMARY KEY,
+            id_usuario INTEGER NOT NULL,
+            cuota INTEGER,
+            motivo VARCHAR(200)
+        )
+    '''))
+
+
+def _cobrar_lote(conexion, periodo, desde, hasta):
+    """
+    Cobra en una sola transacción las cuotas vencidas de los préstamos con id en (desde, hasta].
+
+    Las cuotas de cada usuario se cobran en orden de préstamo mientras el saldo alcance; el resto
+    se registra en 'cuotas_rechazadas'.
+
+    Returns:
+        tuple: (cobrados, rechazados, monto cobrado).
+    """
+    rango = {'periodo':periodo, 'desde':desde, 'hasta':hasta}
+    _iniciar_lote(conexion)
+    if nombre_dialecto(conexion) == 'postgresql':
+        # Mismo orden que el pago manual de una cuota (préstamo y después usuario) para no provocar deadlocks.
+        conexion.execute(text(f'SELECT id FROM prestamos WHERE id > :desde AND id <= :hasta AND {_CONDICION_VENCIDOS} ORDER BY id' + para_actualizar(conexion)), rango)
+        conexion.execute(text(f'''
+            SELECT id FROM "user"
+            WHERE id IN (SELECT id_usuario FROM prestamos WHERE id > :desde AND id <= :hasta AND {_CONDICION_VENCIDOS})
+            ORDER BY id
+        ''' + para_actualizar(conexion)), rango)
+
+    conexion.execute(text(f'''
+        INSERT INTO cuotas_lote (id_prestamo, id_usuario, cuota, motivo)
+        SELECT id, id_usuario, cuota_mensual,
+            CASE
+                WHEN cuota_mensual IS NULL THEN 'Cuota no definida'
+                WHEN acumulado > saldo THEN 'Saldo insuficiente'
+            END
+        FROM (
+            SELECT p.id, p.id_usuario, p.cuota_mensual, u.saldo,
+                SUM(p.cuota_mensual) OVER (PARTITION BY p.id_usuario ORDER BY p.id) AS acumulado
+            FROM prestamos p JOIN "user" u ON u.id = p.id_usuario
+            WHERE p.id > :desde AND p.id <= :hasta AND {_CONDICION_VENCIDOS}
+        ) AS vencidos
+    '''), rango)
+
+    conexion.execute(text('''
+        INSERT INTO cuotas_rechazadas (id_prestamo, periodo, motivo, fecha)
+        SELECT id_prestamo, :periodo, motivo, CURRENT_TIMESTAMP FROM cuotas_lote WHERE motivo IS NOT NULL
+        ON CONFLICT (id_prestamo, periodo) DO NOTHING
+    '''), rango)
+    conexion.execute(text('''
+        UPDATE "user"
+        SET saldo = saldo - (SELECT SUM(c.cuota) FROM cuotas_lote c WHERE c.id_usuario = "user".id AND c.motivo IS NULL)
+        WHERE id IN (SELECT id_usuario FROM cuotas_lote WHERE motivo IS NULL)
+    '''))
+    conexion.execute(text('''
+        UPDATE prestamos
+        SET cuotas = cuotas - 1, cuotas_pagadas = COALESCE(cuotas_pagadas, 0) + 1,
+            monto_total = monto_total - cuota_mensual, periodo_cobrado = :periodo
+        WHERE id IN (SELECT id_prestamo FROM cuotas_lote WHERE motivo IS NULL)
+    '''), rango)
+    conexion.execute(text('''
+        INSERT INTO movimientos (id_usuario, moneda, monto, tipo, referencia, fecha)
+        SELECT id_usuario, 'ARS', -cuota, 'cuota', id_prestamo, CURRENT_TIMESTAMP FROM cuotas_lote WHERE motivo IS NULL
+        ORDER BY id_prestamo
+    '''))
+
+    cobrados, rechazados, monto = conexion.execute(text('''
+        SELECT
+            COALESCE(SUM(CASE WHEN motivo IS NULL THEN 1 ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN motivo IS NULL THEN 0 ELSE 1 END), 0),
+            COALESCE(SUM(CASE WHEN motivo IS NULL THEN cuota ELSE 0 END), 0)
+        FROM cuotas_lote
+    ''')).fetchone()
+    terminados = conexion.execute(text('''
+        SELECT COUNT(*) FROM prestamos WHERE cuotas = 0 AND id IN (SELECT id_prestamo FROM cuotas_lote WHERE motivo IS NULL)
+    ''')).scalar()
+    acumular(conexion, [
+        ('cuotas_cobradas', 'ARS', cobrados, monto),
+        ('deuda_prestamos', 'ARS', -terminados, -monto),
+        ('depositos', 'ARS', 0, -monto),
+    ], desde)
+    conexion.execute(text('DELETE FROM cuotas_lote'))
+    conexion.commit()
+    return cobrados, rechazados, monto
+
+
+def procesar_cuotas_mensuales(periodo=None, tamano_lote=1000):
+    """
+    Debita la cuota del período de todos los préstamos vigentes.
+
+    Los préstamos se recorren por id en lotes de `tamano_lote`, cada uno en su propia transacción y con
+    sentencias sobre conjuntos, así la memoria no depende de la cantidad de préstamos. Un préstamo se cobra
+    una sola vez por período; si el saldo no alcanza queda registrado en 'cuotas_rechazadas' y se vuelve a
+    intentar en la próxima ejecución del mismo período.
+
+    Args:
+        periodo(str): Período a cobrar con formato 'AAAA-MM'. Por defecto, el mes en curso.
+        tamano_lote(int): Cantidad de préstamos por transacción.
+    Returns:
+        dict: 'periodo', 'lotes', 'cobrados', 'rechazados' y 'monto_cobrado' (Dinero).
+    Raises:
+        ValueError: Si el período o el tamaño de lote no son válidos.
+    """
+    periodo = periodo or periodo_actual()
+    if not re.fullmatch(r'\d{4}-(0[1-9]|1[0-2])', periodo):
+        raise ValueError('El período debe tener el formato AAAA-MM')
+    if tamano_lote < 1:
+        raise ValueError('El tamaño de lote debe ser positivo')
+
+    siguiente_limite = text(f'''
+        SELECT MAX(id) FROM (
+            SELECT id FROM prestamos WHERE id > :desde AND {_CONDICION_VENCIDOS} ORDER BY id LIMIT :lote
+        ) AS lote
+    ''')
+    resumen = {'periodo':periodo, 'lotes':0, 'cobrados':0, 'rechazados':0, 'monto_cobrado':Dinero(0)}
+    desde = 0
+    with db.engine.connect() as conexion:
+        try:
+            while True:
+                hasta = conexion.execute(siguiente_limite, {'desde':desde, 'periodo':periodo, 'lote':tamano_lote}).scalar()
+                conexion.commit()
+                if hasta is None:
+                    break
+                cobrados, rechazados, monto = _cobrar_lote(conexion, periodo, desde, hasta)
+                resumen['lotes'] += 1
+                resumen['cobrados'] += cobrados
+                resumen['rechazados'] += rechazados
+                resumen['monto_cobrado'] += Dinero(int(monto))
+                desde = hasta
+        except Exception:
+            conexion.rollback()
+            raise
+        finally:
+            conexion.execute(text('DROP TABLE IF EXISTS cuotas_lote'))
+            conexion.commit()
+    return resumen
+
+
+@app.cli.command('cobrar-cuotas')
+@click.option('--periodo', default=None, help='Período a cobrar (AAAA-MM). Por defecto, el mes en curso.')
+@click.option('--lote', default=1000, show_default=True, help='Préstamos por transacción.')
+def cobrar_cuotas_comando(periodo, lote):
+    """Debita la cuota mensual de todos los préstamos vigentes."""
+    try:
+        resumen = procesar_cuotas_mensuales(periodo, lote)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    print(f"Período {resumen['periodo']}: {resumen['cobrados']} cuotas cobradas por ${resumen['monto_cobrado']}, "
+          f"{resumen['rechazados']} rechazadas ({resumen['lotes']} lotes).")
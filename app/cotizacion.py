@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+import threading
+import time
+from flask import current_app
+from app.metricas import medir_http
+
+logger = logging.getLogger(__name__)
+
+
+class FuenteHTTP:
+    """
+    Obtiene las cotizaciones desde una API HTTP con formato exchangerate-api.
+
+    Usa una sesión propia, así los refrescos reutilizan la conexión (keep-alive y TLS) en vez de abrir una nueva cada vez.
+
+    Args:
+        url(str): Dirección de la API.
+        timeout(float): Segundos máximos de espera por la respuesta.
+    """
+
+    def __init__(self, url, timeout):
+        self.url = url
+        self.timeout = timeout
+        # requests se importa recién acá: con las fuentes 'archivo' o 'fija' no se carga.
+        import requests
+        self.sesion = requests.Session()
+
+    def obtener(self):
+        with medir_http('cotizacion'):
+            response = self.sesion.get(self.url, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()['rates']
+
+
+class FuenteArchivo:
+    """
+    Lee las cotizaciones desde un archivo JSON local.
+
+    El archivo puede tener el mismo formato que la API ({"rates": {...}}) o ser directamente el diccionario de tasas.
+
+    Args:
+        ruta(str): Ruta del archivo.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+
+    def obtener(self):
+        with open(self.ruta, encoding='utf-8') as archivo:
+            data = json.load(archivo)
+        return data.get('rates', data)
+
+
+class FuenteFija:
+    """
+    Devuelve siempre las mismas cotizaciones, sin salir del proceso. Pensada para pruebas y desarrollo local.
+
+    Args:
+        tasas(dict): Tasas por moneda, con el dólar como base.
+    """
+
+    def __init__(self, tasas):
+        self.tasas = dict(tasas)
+
+    def obtener(self):
+        return dict(self.tasas)
+
+
+class ProveedorCotizaciones:
+    """
+    Mantiene las cotizaciones en memoria y en un archivo de cache compartido entre los workers.
+
+    Las lecturas nunca esperan a la red mientras haya un valor utilizable: si el valor venció se devuelve
+    igual (mientras no supere `maximo_vencido`) y se pide el refresco en segundo plano.
+
+    Args:
+        fuente: Objeto con un método `obtener()` que devuelve el diccionario de tasas.
+        ruta_cache(str): Archivo JSON compartido entre procesos. None para usar solo memoria.
+        ttl(int): Segundos durante los que una cotización se considera vigente.
+        maximo_vencido(int): Segundos durante los que se sigue sirviendo una cotización vencida.
+        timeout(float): Espera máxima cuando todavía no hay ninguna cotización disponible.
+    """
+
+    def __init__(self, fuente, ruta_cache=None, ttl=300, maximo_vencido=21600, timeout=2.0):
+        self.fuente = fuente
+        self.ruta_cache = ruta_cache
+        self.ttl = ttl
+        self.maximo_vencido = maximo_vencido
+        self.timeout = timeout
+        self._tasas = None
+        self._actualizado = 0.0
+        self._lock = threading.Lock()
+        self._refrescando = False
+        self._listo = threading.Event()
+        self._pid_actualizador = None
+
+    def tasas(self):
+        """
+        Devuelve el diccionario de tasas vigente.
+
+        Returns:
+            dict: Tasas por moneda, con el dólar como base.
+            None: Si no hay ninguna cotización utilizable.
+        """
+        self._iniciar_actualizador()
+        if self._edad() >= self.ttl:
+            self._leer_cache_compartido()
+        edad = self._edad()
+        if edad < self.ttl:
+            return self._tasas
+
+        self._refrescar_en_segundo_plano()
+        if self._tasas is not None and edad < self.maximo_vencido:
+            return self._tasas
+
+        # Sin ningún valor utilizable: se espera el refresco en curso, como máximo `timeout` segundos.
+        self._listo.wait(self.timeout)
+        return self._tasas if self._edad() < self.maximo_vencido else None
+
+    def refrescar(self):
+        """
+        Consulta la fuente y guarda el resultado en memoria y en el cache compartido.
+
+        Returns:
+            Esta función no retorna valor.
+        """
+        try:
+            # Otro worker pudo haber refrescado el archivo mientras tanto.
+            self._leer_cache_compartido()
+            if self._edad() < self.ttl:
+                return
+            tasas = self.fuente.obtener()
+            actualizado = time.time()
+            self._guardar(tasas, actualizado)
+            self._escribir_cache_compartido(tasas, actualizado)
+        except Exception:
+            logger.warning('No se pudo actualizar la cotización.', exc_info=True)
+        finally:
+            with self._lock:
+                self._refrescando = False
+            self._listo.set()
+
+    def _edad(self):
+        return time.time() - self._actualizado if self._tasas is not None else float('inf')
+
+    def _guardar(self, tasas, actualizado):
+        with self._lock:
+            if actualizado > self._actualizado:
+                self._tasas = tasas
+                self._actualizado = actualizado
+
+    def _leer_cache_compartido(self):
+        if not self.ruta_cache:
+            return
+        try:
+            if os.path.getmtime(self.ruta_cache) <= self._actualizado:
+                return
+            with open(self.ruta_cache, encoding='utf-8') as archivo:
+                data = json.load(archivo)
+            self._guardar(data['rates'], data['actualizado'])
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _escribir_cache_compartido(self, tasas, actualizado):
+        if not self.ruta_cache:
+            return
+        temporal = f'{self.ruta_cache}.{os.getpid()}.tmp'
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            json.dump({'rates': tasas, 'actualizado': actualizado}, archivo)
+        os.replace(temporal, self.ruta_cache)
+
+    def _refrescar_en_segundo_plano(self):
+        with self._lock:
+            if self._refrescando:
+                return
+            self._refrescando = True
+            self._listo.clear()
+        threading.Thread(target=self.refrescar, daemon=True).start()
+
+    def _iniciar_actualizador(self):
+        # Los hilos no sobreviven al fork de gunicorn, por eso se arranca uno por proceso.
+        if self._pid_actualizador == os.getpid():
+            return
+        with self._lock:
+            if self._pid_actualizador == os.getpid():
+                return
+            self._pid_actualizador = os.getpid()
+            self._refrescando = False
+        threading.Thread(target=self._actualizar_periodicamente, daemon=True).start()
+
+    def _actualizar_periodicamente(self):
+        intervalo = max(self.ttl / 4, 1)
+        while True:
+            if self._edad() >= self.ttl * 0.8:
+                self._refrescar_en_segundo_plano()
+            time.sleep(intervalo)
+
+
+_proveedor = None
+
+
+def crear_fuente(config):
+    """
+    Crea la fuente de cotizaciones indicada en la configuración.
+
+    Args:
+        config(dict): Configuración de la aplicación.
+    Returns:
+        FuenteHTTP | FuenteArchivo | FuenteFija: La fuente configurada.
+    """
+    fuente = config['COTIZACION_FUENTE']
+    if fuente == 'http':
+        return FuenteHTTP(config['COTIZACION_URL'], config['COTIZACION_TIMEOUT'])
+    if fuente == 'archivo':
+        return FuenteArchivo(config['COTIZACION_ARCHIVO'])
+    if fuente == 'fija':
+        return FuenteFija({'USD': 1.0, 'ARS': config['COTIZACION_PRECIO_FIJO']})
+    raise ValueError(f'Fuente de cotizaciones desconocida: {fuente}')
+
+
+def configurar_proveedor(proveedor):
+    """
+    Reemplaza el proveedor de cotizaciones del proceso, por ejemplo por uno con `FuenteFija` en pruebas.
+
+    Args:
+        proveedor(ProveedorCotizaciones): El proveedor a utilizar.
+    Returns:
+        Esta función no retorna valor.
+    """
+    global _proveedor
+    _proveedor = proveedor
+
+
+def obtener_proveedor():
+    """
+    Devuelve el proveedor de cotizaciones del proceso, creándolo a partir de la configuración si hace falta.
+
+    Returns:
+        ProveedorCotizaciones: El proveedor compartido.
+    """
+    global _proveedor
+    if _proveedor is None:
+        config = current_app.config
+        _proveedor = ProveedorCotizaciones(
+            crear_fuente(config),
+            ruta_cache=config['COTIZACION_CACHE'],
+            ttl=config['COTIZACION_TTL'],
+            maximo_vencido=config['COTIZACION_MAXIMO_VENCIDO'],
+            timeout=config['COTIZACION_TIMEOUT'],
+        )
+    return _proveedor
+
+
+def obtener_precio_dolar():
+    """
+    Obtiene el precio del dólar frente al peso argentino (ARS) desde el cache de cotizaciones.
+
+    Returns:
+        float: Precio de un dólar en pesos.
+        None: Si no hay ninguna cotización disponible.
+    """
+    tasas = obtener_proveedor().tasas()
+    if not tasas or 'ARS' not in tasas:
+        return None
+    return tasas['ARS']
@@ -0,0 +1,215 @@
+from decimal import ROUND_FLOOR, ROUND_HALF_UP, Decimal, InvalidOperation
+from functools import total_ordering
+import numpy as np
+
+_CENTAVO = Decimal('0.01')
+# Rango de los centavos que entran en un BIGINT de la base (entero con signo de 64 bits).
+CENTAVOS_MINIMOS, CENTAVOS_MAXIMOS = -2 ** 63, 2 ** 63 - 1
+
+
+@total_ordering
+class Dinero:
+    """
+    Importe exacto guardado como un entero de centavos.
+
+    Es la forma en que la aplicación maneja saldos, transferencias, cuotas y operaciones en dólares:
+    la base guarda los mismos centavos (BIGINT) y las cuentas se hacen con enteros, sin redondeos
+    intermedios. Solo se redondea al crear un importe desde un valor con más de dos decimales o al
+    multiplicarlo por un número (precio, tasa): al centavo más cercano, salvo que `multiplicar` pida otro
+    redondeo.
+
+    Args:
+        centavos(int): Importe en centavos.
+    """
+
+    __slots__ = ('centavos',)
+
+    def __init__(self, centavos=0):
+        if isinstance(centavos, bool) or not isinstance(centavos, (int, np.integer)):
+            raise TypeError('Dinero se crea a partir de centavos enteros; usar Dinero.desde() para otros valores')
+        object.__setattr__(self, 'centavos', int(centavos))
+
+    @classmethod
+    def desde(cls, valor):
+        """
+        Convierte un importe en unidades (texto del formulario, JSON o número) a centavos, redondeando al centavo.
+
+        Args:
+            valor(str | int | float | Decimal | Dinero): Importe en pesos o dólares.
+        Returns:
+            Dinero: El importe.
+        Raises:
+            ValueError: Si el valor no es un importe válido o no entra en un BIGINT de la base.
+        """
+        if isinstance(valor, Dinero):
+            return valor
+        try:
+            # Los float pasan por su representación más corta, así 0.1 es 10 centavos y no 0.1000000000000000055.
+            decimal = Decimal(repr(valor) if isinstance(valor, float) else str(valor).strip())
+        except InvalidOperation:
+            raise ValueError(f'Importe inválido: {valor!r}') from None
+        if not decimal.is_finite():
+            raise ValueError(f'Importe inválido: {valor!r}')
+        # Se descarta antes de redondear: quantize falla con exponentes más grandes que su precisión.
+        if abs(decimal) > Decimal(CENTAVOS_MAXIMOS).scaleb(-2) + 1:
+            raise ValueError(f'Importe fuera de rango: {valor!r}')
+        centavos = int(decimal.quantize(_CENTAVO, rounding=ROUND_HALF_UP).scaleb(2))
+        if not CENTAVOS_MINIMOS <= centavos <= CENTAVOS_MAXIMOS:
+            raise ValueError(f'Importe fuera de rango: {valor!r}')
+        return cls(centavos)
+
+    def __setattr__(self, nombre, valor):
+        raise AttributeError('Dinero es inmutable')
+
+    def a_decimal(self):
+        """
+        Returns:
+            Decimal: El importe en unidades, con dos decimales.
+        """
+        return Decimal(self.centavos).scaleb(-2)
+
+    def __add__(self, otro):
+        if not isinstance(otro, Dinero):
+            return NotImplemented
+        return Dinero(self.centavos + otro.centavos)
+
+    def __sub__(self, otro):
+        if not isinstance(otro, Dinero):
+            return NotImplemented
+        return Dinero(self.centavos - otro.centavos)
+
+    def multiplicar(self, factor, redondeo=ROUND_HALF_UP):
+        """
+        Multiplica el importe por un número y redondea el resultado al centavo.
+
+        Args:
+            factor(int | float | Decimal | str): Precio, tasa o cantidad.
+            redondeo(str): Modo de redondeo de `decimal`. ROUND_FLOOR redondea hacia abajo, a favor del banco
+                cuando el resultado es lo que se le acredita al usuario.
+        Returns:
+            Dinero: El producto.
+        """
+        if isinstance(factor, (int, np.integer)):
+            return Dinero(self.centavos * int(factor))
+        factor = Decimal(repr(factor) if isinstance(factor, float) else str(factor))
+        return Dinero(int((self.centavos * factor).quantize(Decimal(1), rounding=redondeo)))
+
+    def __mul__(self, factor):
+        if isinstance(factor, (Dinero, bool)):
+            return NotImplemented
+        return self.multiplicar(factor)
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Dinero(-self.centavos)
+
+    def __abs__(self):
+        return Dinero(abs(self.centavos))
+
+    def __bool__(self):
+        return self.centavos != 0
+
+    def __eq__(self, otro):
+        if not isinstance(otro, Dinero):
+            return NotImplemented
+        return self.centavos == otro.centavos
+
+    def __lt__(self, otro):
+        if not isinstance(otro, Dinero):
+            return NotImplemented
+        return self.centavos < otro.centavos
+
+    def __hash__(self):
+        return hash(self.centavos)
+
+    def __float__(self):
+        return self.centavos / 100
+
+    def __str__(self):
+        signo = '-' if self.centavos < 0 else ''
+        unidades, centavos = divmod(abs(self.centavos), 100)
+        return f'{signo}{unidades}.{centavos:02d}'
+
+    def __format__(self, especificacion):
+        return format(self.a_decimal(), especificacion) if especificacion else str(self)
+
+    def __repr__(self):
+        return f"Dinero('{self}')"
+
+    def __reduce__(self):
+        return (Dinero, (self.centavos,))
+
+
+CERO = Dinero(0)
+
+
+def a_centavos(valores):
+    """
+    Redondea muchos importes en unidades (por ejemplo, resultados de NumPy) a centavos enteros en una sola operación.
+
+    Args:
+        valores(float | array): Importes en unidades.
+    Returns:
+        ndarray: Centavos como enteros de 64 bits, con la misma forma que `valores`.
+    """
+    valores = np.asarray(valores, dtype=np.float64)
+    # Redondeo a la mitad hacia afuera del cero, igual que Dinero.desde.
+    return (np.sign(valores) * np.floor(np.abs(valores) * 100 + 0.5)).astype(np.int64)
+
+
+def desde_centavos(centavos):
+    """
+    Convierte un arreglo de centavos en importes.
+
+    Args:
+        centavos(iterable): Centavos enteros.
+    Returns:
+        list: Un Dinero por elemento, en el mismo orden (recorriendo el arreglo aplanado).
+    """
+    return [Dinero(c) for c in np.asarray(centavos, dtype=np.int64).ravel().tolist()]
+
+
+def sumar(importes):
+    """
+    Suma muchos importes.
+
+    La suma se hace con enteros de Python, que no desbordan: un total fuera del rango de un BIGINT se
+    devuelve tal cual y lo rechaza quien lo vaya a guardar (ver `en_rango`).
+
+    Args:
+        importes(iterable): Objetos Dinero.
+    Returns:
+        Dinero: La suma.
+    """
+    return Dinero(sum(i.centavos for i in importes))
+
+
+def sumar_por_grupo(claves, centavos):
+    """
+    Suma centavos agrupados por clave, por ejemplo las acreditaciones de un lote por beneficiario.
+
+    Args:
+        claves(iterable): Clave entera de cada importe.
+        centavos(iterable): Centavos de cada importe, en el mismo orden.
+    Returns:
+        dict: Clave -> Dinero con la suma de sus importes.
+    """
+    # Enteros de Python y no int64 de NumPy, que desborda sin avisar con sumas grandes.
+    sumas = {}
+    for clave, monto in zip(claves, centavos):
+        clave = int(clave)
+        sumas[clave] = sumas.get(clave, 0) + int(monto)
+    return {clave:Dinero(suma) for clave, suma in sorted(sumas.items())}
+
+
+def en_rango(importe):
+    """
+    Indica si un importe entra en un BIGINT de la base.
+
+    Args:
+        importe(Dinero): El importe.
+    Returns:
+        bool: True si sus centavos están entre CENTAVOS_MINIMOS y CENTAVOS_MAXIMOS.
+    """
+    return CENTAVOS_MINIMOS <= importe.centavos <= CENTAVOS_MAXIMOS
@@ -0,0 +1,217 @@
+"""
+Motor de cambio entre monedas: matriz de cotizaciones, cotizaciones firmadas y valuación de tenencias.
+
+Las tasas del proveedor (app/cotizacion.py) vienen con el dólar como base. Con ellas se arma una matriz
+NumPy de tipos cruzados, `matriz[i, j]` = unidades de la moneda j por unidad de la moneda i, así que la
+conversión entre cualquier par es una lectura, y la de muchos importes a la vez, una operación vectorial.
+La matriz se rearma solo cuando el proveedor trae tasas nuevas.
+
+Una cotización emitida lleva la tasa en un token firmado que vence en DIVISAS_VALIDEZ_COTIZACION segundos:
+la operación que lo recibe se hace a esa tasa, la que vio el usuario, sin volver a consultar el proveedor.
+"""
+import time
+import click
+import numpy as np
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from sqlalchemy import text
+from app import app, db
+from app.cotizacion import obtener_proveedor
+from app.dinero import Dinero, a_centavos
+from app.libro import COLUMNAS_SALDO
+
+
+class MatrizCotizaciones:
+    """
+    Tipos de cambio cruzados entre todas las monedas de un juego de tasas.
+
+    Args:
+        tasas(dict): Unidades de cada moneda por dólar.
+    """
+
+    def __init__(self, tasas):
+        self.tasas = tasas
+        validas = {'USD':1.0, **{moneda:tasa for moneda, tasa in tasas.items() if tasa and tasa > 0}}
+        self.monedas = tuple(sorted(validas))
+        self.indice = {moneda:i for i, moneda in enumerate(self.monedas)}
+        por_dolar = np.array([validas[moneda] for moneda in self.monedas], dtype=np.float64)
+        self.matriz = por_dolar[None, :] / por_dolar[:, None]
+
+    def posicion(self, moneda):
+        """
+        Devuelve la fila (o columna) de la moneda en la matriz.
+
+        Args:
+            moneda(str): Código ISO de la moneda.
+        Returns:
+            int: La posición.
+        Raises:
+            ValueError: Si la moneda no tiene cotización.
+        """
+        try:
+            return self.indice[moneda]
+        except KeyError:
+            raise ValueError(f'No hay cotización para la moneda {moneda}')
+
+    def tasa(self, origen, destino):
+        """
+        Devuelve cuántas unidades de `destino` vale una unidad de `origen`.
+
+        Args:
+            origen(str): Moneda de origen.
+            destino(str): Moneda de destino.
+        Returns:
+            float: El tipo de cambio.
+        Raises:
+            ValueError: Si alguna de las monedas no tiene cotización.
+        """
+        return float(self.matriz[self.posicion(origen), self.posicion(destino)])
+
+    def convertir(self, centavos, monedas, destino):
+        """
+        Convierte muchos importes, cada uno en su moneda, a una moneda de destino en una sola pasada.
+
+        Args:
+            centavos(array): Importes en centavos.
+            monedas(array): Moneda de cada importe. Las que no tienen cotización convierten a cero.
+            destino(str): Moneda de destino.
+        Returns:
+            tuple: (centavos convertidos como enteros de 64 bits, máscara de los importes sin cotización).
+        """
+        unicas, posiciones = np.unique(np.asarray(monedas, dtype=object), return_inverse=True)
+        columna = self.matriz[:, self.posicion(destino)]
+        factores = np.array([columna[self.indice[m]] if m in self.indice else np.nan for m in unicas], dtype=np.float64)[posiciones]
+        sin_cotizacion = np.isnan(factores)
+        factores[sin_cotizacion] = 0.0
+        return a_centavos(np.asarray(centavos, dtype=np.float64) * factores / 100), sin_cotizacion
+
+
+_matriz = {'vigente':None}
+
+
+def matriz_vigente():
+    """
+    Devuelve la matriz armada con las tasas vigentes del proveedor, rearmándola solo si cambiaron.
+
+    Returns:
+        MatrizCotizaciones: La matriz.
+    Raises:
+        ValueError: Si no hay ninguna cotización disponible.
+    """
+    tasas = obtener_proveedor().tasas()
+    if not tasas:
+        raise ValueError('No hay cotizaciones disponibles')
+    matriz = _matriz['vigente']
+    if matriz is None or matriz.tasas is not tasas:
+        matriz = MatrizCotizaciones(tasas)
+        _matriz['vigente'] = matriz
+    return matriz
+
+
+def _serializador():
+    return URLSafeTimedSerializer(app.secret_key, salt='cotizacion')
+
+
+def emitir_cotizacion(usuario, origen, destino):
+    """
+    Cotiza un cambio para el usuario y firma la tasa, para que la operación se haga a esa tasa.
+
+    Args:
+        usuario(str): ID del usuario.
+        origen(str): Moneda que entrega.
+        destino(str): Moneda que recibe.
+    Returns:
+        dict: 'origen', 'destino', 'tasa', 'vence' (segundos desde epoch) y 'token'.
+    Raises:
+        ValueError: Si alguna moneda no tiene cotización o son la misma.
+    """
+    if origen == destino:
+        raise ValueError('Las monedas de origen y destino deben ser distintas')
+    tasa = matriz_vigente().tasa(origen, destino)
+    token = _serializador().dumps({'usuario':usuario, 'origen':origen, 'destino':destino, 'tasa':tasa})
+    vence = int(time.time()) + app.config['DIVISAS_VALIDEZ_COTIZACION']
+    return {'origen':origen, 'destino':destino, 'tasa':tasa, 'vence':vence, 'token':token}
+
+
+def leer_cotizacion(token, usuario, origen, destino):
+    """
+    Verifica una cotización emitida con `emitir_cotizacion` y devuelve su tasa.
+
+    Args:
+        token(str): El token de la cotización.
+        usuario(str): ID del usuario que opera.
+        origen(str): Moneda que entrega.
+        destino(str): Moneda que recibe.
+    Returns:
+        float: La tasa cotizada.
+    Raises:
+        ValueError: Si el token venció, no es válido o es de otro usuario u otro par de monedas.
+    """
+    try:
+        datos = _serializador().loads(token, max_age=app.config['DIVISAS_VALIDEZ_COTIZACION'])
+    except SignatureExpired:
+        raise ValueError('La cotización venció, volvé a cotizar')
+    except BadSignature:
+        raise ValueError('La cotización no es válida')
+    if (datos.get('usuario'), datos.get('origen'), datos.get('destino')) != (usuario, origen, destino):
+        raise ValueError('La cotización no corresponde a esta operación')
+    return datos['tasa']
+
+
+# Tenencias de un rango de usuarios, una fila por moneda: las columnas de 'user' y la tabla 'tenencias'.
+_CONSULTA_TENENCIAS = ' UNION ALL '.join(
+    [f'''SELECT id AS id_usuario, '{moneda}' AS moneda, {columna} AS cantidad FROM "user"
+         WHERE id > :desde AND id <= :hasta''' for moneda, columna in COLUMNAS_SALDO.items()]
+    + ['SELECT id_usuario, moneda, cantidad FROM tenencias WHERE id_usuario > :desde AND id_usuario <= :hasta AND cantidad <> 0']
+)
+
+
+def valuar_cuentas(destino='ARS', tamano_lote=50000):
+    """
+    Valúa las tenencias de todas las cuentas en una moneda, con las cotizaciones vigentes.
+
+    Las tenencias se leen por rangos de `tamano_lote` usuarios y cada rango se convierte y se suma por cuenta
+    con operaciones vectoriales, sin recorrer las filas en Python.
+
+    Args:
+        destino(str): Moneda en la que se valúa.
+        tamano_lote(int): Usuarios por consulta.
+    Returns:
+        tuple: (ids internos de los usuarios, valuación en centavos de `destino`, cantidad de tenencias en
+            monedas sin cotización, que se valúan en cero), los dos primeros como arreglos de NumPy.
+    Raises:
+        ValueError: Si la moneda de destino no tiene cotización.
+    """
+    matriz = matriz_vigente()
+    matriz.posicion(destino)
+    ids, totales, sin_cotizacion = [], [], 0
+    consulta = text(_CONSULTA_TENENCIAS)
+    with db.engine.connect() as conexion:
+        maximo = conexion.execute(text('SELECT COALESCE(MAX(id), 0) FROM "user"')).scalar()
+        for desde in range(0, maximo, tamano_lote):
+            filas = conexion.execute(consulta, {'desde':desde, 'hasta':desde + tamano_lote}).fetchall()
+            if not filas:
+                continue
+            usuarios, monedas, cantidades = zip(*filas)
+            convertidos, faltantes = matriz.convertir(np.array(cantidades, dtype=np.int64), monedas, destino)
+            unicos, posiciones = np.unique(np.array(usuarios, dtype=np.int64), return_inverse=True)
+            sumas = np.zeros(len(unicos), dtype=np.int64)
+            np.add.at(sumas, posiciones, convertidos)
+            ids.append(unicos)
+            totales.append(sumas)
+            sin_cotizacion += int(faltantes.sum())
+    if not ids:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), sin_cotizacion
+    return np.concatenate(ids), np.concatenate(totales), sin_cotizacion
+
+
+@app.cli.command('valuar-tenencias')
+@click.option('--moneda', default='ARS', show_default=True, help='Moneda en la que se valúan las tenencias.')
+@click.option('--lote', default=50000, show_default=True, help='Usuarios por consulta.')
+def valuar_tenencias_comando(moneda, lote):
+    """Valúa las tenencias de todas las cuentas con las cotizaciones vigentes."""
+    moneda = moneda.upper()
+    inicio = time.perf_counter()
+    ids, totales, sin_cotizacion = valuar_cuentas(moneda, lote)
+    print(f'Cuentas valuadas: {len(ids)} en {time.perf_counter() - inicio:.2f} s. Total: {Dinero(int(totales.sum()))} {moneda}.')
+    if sin_cotizacion:
+        print(f'Tenencias en monedas sin cotización (valuadas en cero): {sin_cotizacion}')
@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from flask import g
+from sqlalchemy import create_engine
+from app import app, db
+from app.basedatos import configurar_motor, nombre_dialecto, opciones_motor
+from app.metricas import registrar_consultas
+
+logger = logging.getLogger(__name__)
+
+
+class Escritor:
+    """
+    Ejecuta las operaciones que modifican saldos desde un único hilo por proceso, juntando en una sola
+    transacción (un solo commit) las que llegan casi a la vez.
+
+    Una operación es una función `operacion(conexion, *args)` que escribe sin confirmar. Cada una corre dentro
+    de su propio SAVEPOINT: si falla, se deshace solo lo suyo y su error le llega a quien la envió, mientras
+    las demás del lote se confirman. El hilo toma las operaciones acumuladas cada `espera` segundos, como
+    máximo `maximo` por transacción.
+
+    El escritor usa su propia conexión, fuera del pool de la aplicación: las requests que esperan su
+    resultado tienen tomadas conexiones del pool y no deben poder dejarlo sin una.
+
+    Args:
+        espera(float): Segundos que se esperan para juntar operaciones antes de escribir.
+        maximo(int): Operaciones por transacción.
+        timeout(float): Segundos que `ejecutar` espera el resultado antes de rendirse.
+    """
+
+    def __init__(self, espera=0.002, maximo=200, timeout=30):
+        self.espera = espera
+        self.maximo = maximo
+        self.timeout = timeout
+        self._pendientes = []
+        self._condicion = threading.Condition()
+        self._pid = None
+
+    def enviar(self, operacion, *args):
+        """
+        Encola una operación para la próxima transacción del escritor.
+
+        Args:
+            operacion(callable): Función `operacion(conexion, *args)`.
+            args: Argumentos de la operación.
+        Returns:
+            Future: Se completa con lo que devuelve la operación, o con su excepción, después del commit.
+        """
+        futuro = Future()
+        with self._condicion:
+            # Los hilos no sobreviven al fork de gunicorn, por eso se arranca uno por proceso.
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pendientes = []
+                threading.Thread(target=self._procesar, daemon=True, name='escritor').start()
+            self._pendientes.append((futuro, operacion, args))
+            self._condicion.notify()
+        return futuro
+
+    def ejecutar(self, operacion, *args):
+        """
+        Envía una operación y espera su resultado.
+
+        Args:
+            operacion(callable): Función `operacion(conexion, *args)`.
+            args: Argumentos de la operación.
+        Returns:
+            Lo que devuelve la operación.
+        Raises:
+            TimeoutError: Si la transacción no terminó a tiempo (la operación todavía puede confirmarse).
+            Exception: El error de la operación, o el de la base si falló la transacción del lote.
+        """
+        return self.enviar(operacion, *args).result(self.timeout)
+
+    def _motor(self):
+        opciones = {**opciones_motor(app.config), 'pool_size':1, 'max_overflow':0}
+        motor = create_engine(db.engine.url, **opciones)
+        configurar_motor(motor, app.config)
+        if app.config['METRICAS_HABILITADAS']:
+            registrar_consultas(motor)
+        return motor
+
+    def _procesar(self):
+        motor = None
+        while True:
+            with self._condicion:
+                while not self._pendientes:
+                    self._condicion.wait()
+            time.sleep(self.espera)
+            with self._condicion:
+                lote = self._pendientes[:self.maximo]
+                del self._pendientes[:self.maximo]
+            lote = [pendiente for pendiente in lote if pendiente[0].set_running_or_notify_cancel()]
+            try:
+                with app.app_context():
+                    motor = motor or self._motor()
+                    with motor.connect() as conexion:
+                        resultados = self._escribir(conexion, lote)
+            except Exception as e:
+                logger.warning('No se pudo confirmar un lote de %d escrituras.', len(lote), exc_info=True)
+                for futuro, _, _ in lote:
+                    futuro.set_exception(e)
+            else:
+                for (futuro, _, _), (resultado, error) in zip(lote, resultados):
+                    if error is None:
+                        futuro.set_result(resultado)
+                    else:
+                        futuro.set_exception(error)
+
+    def _escribir(self, conexion, lote):
+        if nombre_dialecto(conexion) == 'sqlite':
+            conexion.exec_driver_sql('BEGIN IMMEDIATE')
+        resultados = []
+        for _, operacion, args in lote:
+            try:
+                with conexion.begin_nested():
+                    resultados.append((operacion(conexion, *args), None))
+            except Exception as e:
+                resultados.append((None, e))
+        conexion.commit()
+        return resultados
+
+
+escritor = Escritor(app.config['ESCRITOR_ESPERA_MS'] / 1000, app.config['ESCRITOR_LOTE'])
+
+
+def ejecutar_escritura(operacion, *args):
+    """
+    Ejecuta una operación de escritura y la confirma.
+
+    Con ESCRITOR_AGRUPADO la ejecuta el escritor del proceso junto con las que lleguen a la vez; si no,
+    corre en la sesión del request con su propio commit.
+
+    Deja `g.escritura_posible` en True salvo que la operación se rechace con ValueError, que es cuando se
+    sabe que no se confirmó nada suyo. Con cualquier otro error (por ejemplo TimeoutError, o un fallo del
+    commit) la operación pudo haberse aplicado (ver `app.idempotencia.idempotente`).
+
+    Args:
+        operacion(callable): Función `operacion(conexion, *args)` que escribe sin confirmar.
+        args: Argumentos de la operación.
+    Returns:
+        Lo que devuelve la operación.
+    Raises:
+        ValueError: Si la operación se rechazó; no se confirma nada de ella.
+        TimeoutError: Si el escritor no terminó a tiempo; la operación todavía puede confirmarse.
+        Exception: El error de la operación o de la base.
+    """
+    anterior = g.get('escritura_posible', False)
+    g.escritura_posible = True
+    try:
+        if app.config['ESCRITOR_AGRUPADO']:
+            return escritor.ejecutar(operacion, *args)
+        try:
+            resultado = operacion(db.session, *args)
+            db.session.commit()
+            return resultado
+        except Exception:
+            db.session.rollback()
+            raise
+    except ValueError:
+        g.escritura_posible = anterior
+        raise
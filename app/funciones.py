@@ -1,31 +1,117 @@
-from flask import session
+from flask import g, session
+import csv
+from decimal import ROUND_FLOOR
+import io
+import json
 import uuid
-from sqlalchemy import text
+import numpy as np
+from sqlalchemy import bindparam, text
 from app import db
+from app.amortizacion import SISTEMAS_CUOTA_FIJA, resumen
+from app.basedatos import para_actualizar
+from app.cobranza import periodo_actual
+from app.dinero import CERO, Dinero, a_centavos, en_rango, sumar, sumar_por_grupo
+from app.escritor import ejecutar_escritura
+from app.libro import COLUMNAS_SALDO, registrar_movimientos
+from app.reportes import acumular
+from app.usuarios import aprovisionador
 
 
 def crear_usuario_temporal():
     """
-    Crea un ID al usuario y lo registra en la sesion.
+    Crea un ID al usuario y lo registra en la sesion, sin escribir todavía en la base.
 
-    El usuario se genera con un saldo inicial predeterminado y se almacena en la tabla 'user'.
+    El usuario se guarda en la tabla 'user', con el saldo inicial, recién cuando la sesión vuelve en otra request
+    (ver `aprovisionar_usuario`): los clientes que no guardan la cookie, como crawlers o health checks, no crean filas.
+    Tampoco crean sesiones en la base: hasta esa segunda request la sesión viaja solo en la cookie firmada
+    (ver `app.sesiones.InterfazSesiones`).
 
     Returns:
-        str: El ID único generado para el usuario, si se creó correctamente.
-        None: Si ocurre algún error durante el proceso de creación.
+        str: El ID único generado para el usuario.
     """
-    try:
-        #Genera un usuario temporal con un ID único y lo guarda en la tabla user.
-        usuario_id = str(uuid.uuid4())  #Genera el id del usuario.
-        saldo = 1000000
-        dolares = 0
-        guardar_usuario = text('INSERT INTO user (user,saldo,dolares) VALUES (:usuario_id,:saldo,:dolares)') #Guarda el usuario en la tabla user.
-        db.session.execute(guardar_usuario, {'usuario_id':usuario_id, 'saldo':saldo, 'dolares':dolares})
-        db.session.commit()
-        session['usuario_id'] = usuario_id
-        return usuario_id
-    except Exception:
-        return None
+    usuario_id = str(uuid.uuid4())  #Genera el id del usuario.
+    session['usuario_id'] = usuario_id
+    session['pendiente'] = True
+    return usuario_id
+
+
+def aprovisionar_usuario():
+    """
+    Guarda en la tabla 'user' al usuario de la sesión si todavía está pendiente.
+
+    Los usuarios que llegan a la vez se crean juntos en una transacción (ver `app.usuarios.Aprovisionador`).
+
+    Returns:
+        Esta función no retorna valor.
+    """
+    if session.get('pendiente'):
+        aprovisionador.aprovisionar(session['usuario_id'])
+        session.pop('pendiente')
+
+
+def obtener_cuenta(usuario):
+    """
+    Obtiene id, saldo y dólares del usuario con una sola consulta por request.
+
+    El resultado queda guardado en `flask.g`, así las demás funciones de este módulo no vuelven a leer
+    la fila del usuario. Las funciones que modifican saldos llaman a `invalidar_cuenta`.
+
+    Args:
+        usuario(str): ID del usuario.
+    Returns:
+        Row: Fila con 'id', 'saldo' y 'dolares' (en centavos).
+        None: Si el usuario no existe.
+    """
+    cuentas = g.setdefault('cuentas', {})
+    if usuario not in cuentas:
+        consulta = text('SELECT id, saldo, dolares FROM "user" WHERE "user"=:usuario')
+        cuentas[usuario] = db.session.execute(consulta, {'usuario':usuario}).fetchone()
+    return cuentas[usuario]
+
+
+def invalidar_cuenta(*usuarios):
+    """
+    Descarta los datos de cuenta guardados en el request, para que la próxima lectura vaya a la base.
+
+    Args:
+        usuarios(str): IDs de los usuarios cuyos saldos cambiaron.
+    Returns:
+        Esta función no retorna valor.
+    """
+    cuentas = g.get('cuentas')
+    if cuentas:
+        for usuario in usuarios:
+            cuentas.pop(usuario, None)
+
+
+def version_cuenta(usuario, prestamo_id=None):
+    """
+    Devuelve un número que cambia cada vez que cambian los datos de la cuenta: el id de su último movimiento.
+
+    Todo lo que modifica saldos, transferencias o préstamos de una cuenta agrega un movimiento al libro,
+    y lo hace después de bloquear la fila del usuario, así los ids de sus movimientos crecen en orden de commit.
+
+    Args:
+        usuario(str): ID del usuario.
+        prestamo_id(str): Si se indica, el préstamo tiene que ser del usuario.
+    Returns:
+        int: La versión de la cuenta.
+        None: Si el usuario no existe o el préstamo no es suyo.
+    """
+    filtro_prestamo = ''
+    if prestamo_id is not None:
+        try:
+            prestamo_id = int(prestamo_id)
+        except ValueError:
+            return None
+        filtro_prestamo = 'AND EXISTS (SELECT 1 FROM prestamos p WHERE p.id = :prestamo_id AND p.id_usuario = u.id)'
+    consulta = text(f'''
+        SELECT COALESCE((SELECT MAX(id) FROM movimientos WHERE id_usuario = u.id AND moneda = 'ARS'), 0) AS ars,
+               COALESCE((SELECT MAX(id) FROM movimientos WHERE id_usuario = u.id AND moneda = 'USD'), 0) AS usd
+        FROM "user" u WHERE u."user" = :usuario {filtro_prestamo}
+    ''')
+    fila = db.session.execute(consulta, {'usuario':usuario, 'prestamo_id':prestamo_id}).fetchone()
+    return max(fila.ars, fila.usd) if fila else None
 
 
 def obtener_saldo(usuario):
@@ -35,13 +121,11 @@ def obtener_saldo(usuario):
     Args:
         usuario(str): ID del usuario.
     Returns:
-        int: El saldo del usuario.
-        None: Si no existe saldo.
+        Dinero: El saldo del usuario.
+        None: Si no existe el usuario.
     """
-    consulta = text('SELECT saldo FROM user WHERE user=:usuario')
-    saldo_result = db.session.execute(consulta, {'usuario':usuario}).fetchone()
-    saldo = saldo_result[0]
-    return saldo if saldo else None
+    cuenta = obtener_cuenta(usuario)
+    return Dinero(cuenta.saldo) if cuenta else None
       
 
 def obtener_dolares(usuario):
@@ -51,120 +135,514 @@ def obtener_dolares(usuario):
     Args:
         usuario(str): ID del usuario.
     Returns:
-        int: Los dólares del usuario.
-        None: Si no existe dólares.
+        Dinero: Los dólares del usuario.
+        None: Si no existe el usuario.
     """
-    consulta = text('SELECT dolares FROM user WHERE user=:usuario')
-    resultado = db.session.execute(consulta, {'usuario':usuario}).fetchone()
-    return float(resultado[0])
+    cuenta = obtener_cuenta(usuario)
+    return Dinero(cuenta.dolares) if cuenta else None
 
 
 def actualizar_saldo(usuario, saldo):
     """
-    Actualiza el saldo del usuario.
+    Actualiza el saldo del usuario. La diferencia queda en el libro como un movimiento de 'ajuste'.
 
     Args:
         usuario(str): ID del usuario.
-        saldo(int): El nuevo saldo del usuario.
+        saldo(Dinero): El nuevo saldo del usuario.
     Returns:
         Esta función no retorna valor.
     """
-    consulta = text('UPDATE user SET saldo=:saldo WHERE user=:usuario')
-    db.session.execute(consulta, {'saldo':saldo,'usuario':usuario})
-    db.session.commit()
+    try:
+        ejecutar_escritura(_ajustar, usuario, 'saldo', 'ARS', Dinero.desde(saldo))
+    finally:
+        invalidar_cuenta(usuario)
 
 
 def actualizar_dolares(usuario, cantidad_dolares):
     """
-    Actualiza los dólares del usuario, sumando a la cantidad actual.
+    Actualiza los dólares del usuario. La diferencia queda en el libro como un movimiento de 'ajuste'.
 
     Args:
         usuario (str): ID del usuario.
-        cantidad_dolares (float): Cantidad de dólares a agregar.
+        cantidad_dolares (Dinero): La nueva cantidad de dólares del usuario.
     Returns:
         None
     """
-    consulta = text('UPDATE user SET dolares=:cantidad_dolares WHERE user=:usuario')
-    db.session.execute(consulta, {'cantidad_dolares': cantidad_dolares, 'usuario': usuario})
-    db.session.commit()
+    try:
+        ejecutar_escritura(_ajustar, usuario, 'dolares', 'USD', Dinero.desde(cantidad_dolares))
+    finally:
+        invalidar_cuenta(usuario)
+
+
+def _ajustar(conexion, usuario, columna, moneda, valor):
+    # Operación de escritura de actualizar_saldo y actualizar_dolares (ver app.escritor).
+    ajuste = text(f'''INSERT INTO movimientos (id_usuario, moneda, monto, tipo, fecha)
+                     SELECT id, :moneda, :valor - {columna}, 'ajuste', CURRENT_TIMESTAMP FROM "user" WHERE "user"=:usuario AND {columna} <> :valor''')
+    cuenta = conexion.execute(text(f'SELECT id, {columna} AS anterior FROM "user" WHERE "user"=:usuario' + para_actualizar(conexion)), {'usuario':usuario}).fetchone()
+    conexion.execute(ajuste, {'moneda':moneda, 'valor':valor.centavos, 'usuario':usuario})
+    conexion.execute(text(f'UPDATE "user" SET {columna}=:valor WHERE "user"=:usuario'), {'valor':valor.centavos, 'usuario':usuario})
+    if cuenta:
+        acumular(conexion, [('depositos', moneda, 0, valor.centavos - cuenta.anterior)], cuenta.id)
+
+
+def _cambiar(conexion, id_usuario, debito, credito, tipo, sin_fondos):
+    # Operación de escritura de los cambios de moneda (ver app.escritor). `debito` y `credito` son pares
+    # (moneda, Dinero): se debita la moneda que entrega el usuario y se acredita la que recibe.
+    # ARS y USD están en columnas de 'user'; las demás monedas, en 'tenencias'.
+    moneda, monto = debito
+    if moneda in COLUMNAS_SALDO:
+        columna = COLUMNAS_SALDO[moneda]
+        debitar = text(f'UPDATE "user" SET {columna} = {columna} - :monto WHERE id=:id AND {columna} >= :monto')
+    else:
+        debitar = text('UPDATE tenencias SET cantidad = cantidad - :monto WHERE id_usuario=:id AND moneda=:moneda AND cantidad >= :monto')
+    if conexion.execute(debitar, {'monto':monto.centavos, 'id':id_usuario, 'moneda':moneda}).rowcount == 0:
+        raise ValueError(sin_fondos)
+
+    moneda, monto = credito
+    if moneda in COLUMNAS_SALDO:
+        columna = COLUMNAS_SALDO[moneda]
+        acreditar = text(f'UPDATE "user" SET {columna} = {columna} + :monto WHERE id=:id')
+    else:
+        acreditar = text('''INSERT INTO tenencias (id_usuario, moneda, cantidad) VALUES (:id, :moneda, :monto)
+                            ON CONFLICT (id_usuario, moneda) DO UPDATE SET cantidad = tenencias.cantidad + excluded.cantidad''')
+    conexion.execute(acreditar, {'monto':monto.centavos, 'id':id_usuario, 'moneda':moneda})
+    registrar_movimientos(conexion, [
+        {'id_usuario':id_usuario, 'moneda':debito[0], 'monto':-debito[1], 'tipo':tipo, 'referencia':None},
+        {'id_usuario':id_usuario, 'moneda':credito[0], 'monto':credito[1], 'tipo':tipo, 'referencia':None},
+    ])
+    # El volumen de cada cambio se cuenta en la moneda que entrega el usuario.
+    acumular(conexion, [
+        (tipo, debito[0], 1, debito[1].centavos),
+        ('depositos', debito[0], 0, -debito[1].centavos),
+        ('depositos', credito[0], 0, credito[1].centavos),
+    ], id_usuario)
+
+
+def _operar_dolares(usuario, cantidad_dolares, precio, compra):
+    cantidad_dolares = Dinero.desde(cantidad_dolares)
+    if cantidad_dolares <= CERO:
+        raise ValueError('La cantidad de dólares debe ser válida')
+    cuenta = obtener_cuenta(usuario)
+    if not cuenta:
+        raise ValueError('Usuario no encontrado')
+    costo_total = cantidad_dolares * precio
+    if compra:
+        operacion = (('ARS', costo_total), ('USD', cantidad_dolares), 'compra_usd', 'No tienes saldo suficiente para realizar esta compra')
+    else:
+        operacion = (('USD', cantidad_dolares), ('ARS', costo_total), 'venta_usd', 'No tienes dólares suficiente para realizar esta venta')
+    try:
+        ejecutar_escritura(_cambiar, cuenta.id, *operacion)
+    finally:
+        invalidar_cuenta(usuario)
+    return costo_total
 
 
-def obtener_transferencias_usuario(usuario):
+def registrar_compra_dolares(usuario, cantidad_dolares, precio):
     """
-    Obtiene las transferencias enviadas y recibidas del usuario.
+    Compra dólares con el saldo en pesos, en una única transacción con débito condicional.
 
     Args:
         usuario(str): ID del usuario.
+        cantidad_dolares(Dinero | str | float): Cantidad de dólares a comprar.
+        precio(float): Precio del dólar en pesos.
     Returns:
-        str: El resultado de la consulta, que contiene las transferencias.
-    """
-    consulta = text('''
-                SELECT u.user AS remitente, u_b.user AS beneficiario, t.transaccion
-                FROM transferencias t 
-                INNER JOIN user u ON t.id_usuario_remitente = u.id 
-                INNER JOIN user u_b ON t.id_usuario_beneficiario = u_b.id 
-                WHERE u.user = :usuario
-                UNION ALL
-                SELECT u_b.user AS remitente, u.user AS beneficiario, t.transaccion
-                FROM transferencias t 
-                INNER JOIN user u ON t.id_usuario_beneficiario = u.id 
-                INNER JOIN user u_b ON t.id_usuario_remitente = u_b.id 
-                WHERE u.user = :usuario
-            ''')
-    consulta_result = db.session.execute(consulta, {'usuario':usuario}).fetchall()
+        Dinero: El costo total en pesos, redondeado al centavo.
+    Raises:
+        ValueError: Si la cantidad no es válida, el usuario no existe o no tiene saldo suficiente.
+    """
+    return _operar_dolares(usuario, cantidad_dolares, precio, compra=True)
 
-    return consulta_result
 
+def cambiar_moneda(usuario, origen, destino, cantidad, tasa):
+    """
+    Cambia una cantidad de una moneda a otra, en una única transacción con débito condicional.
 
-def realizar_transferencia(id_beneficiario, usuario, transferencia, saldo):
+    Args:
+        usuario(str): ID del usuario.
+        origen(str): Moneda que entrega el usuario.
+        destino(str): Moneda que recibe.
+        cantidad(Dinero | str | float): Cantidad de `origen` a cambiar.
+        tasa(float): Unidades de `destino` por unidad de `origen` (ver `app.divisas`).
+    Returns:
+        Dinero: La cantidad acreditada en `destino`, redondeada hacia abajo al centavo, así cambiar y volver
+            a cambiar nunca deja más de lo que se tenía.
+    Raises:
+        ValueError: Si los datos no son válidos, el usuario no existe o no tiene suficiente de `origen`.
     """
-    Realiza la transferencia asegurandose que haya saldo suficiente para la transacción.
+    cantidad = Dinero.desde(cantidad)
+    if origen == destino:
+        raise ValueError('Las monedas de origen y destino deben ser distintas')
+    if cantidad <= CERO:
+        raise ValueError('La cantidad a cambiar debe ser mayor a cero')
+    importe = cantidad.multiplicar(tasa, ROUND_FLOOR)
+    if importe <= CERO:
+        raise ValueError(f'La cantidad no alcanza para recibir un centavo de {destino}')
+    cuenta = obtener_cuenta(usuario)
+    if not cuenta:
+        raise ValueError('Usuario no encontrado')
+    try:
+        ejecutar_escritura(_cambiar, cuenta.id, (origen, cantidad), (destino, importe), 'cambio', f'No tienes {origen} suficientes para este cambio')
+    finally:
+        invalidar_cuenta(usuario)
+    return importe
+
+
+def obtener_tenencias(usuario):
+    """
+    Obtiene las tenencias del usuario en cada moneda, incluidos pesos y dólares.
+
+    Args:
+        usuario(str): ID del usuario.
+    Returns:
+        dict: Moneda -> Dinero, solo con las monedas con saldo distinto de cero (pesos siempre).
+        None: Si el usuario no existe.
+    """
+    cuenta = obtener_cuenta(usuario)
+    if cuenta is None:
+        return None
+    tenencias = {'ARS':Dinero(cuenta.saldo)}
+    if cuenta.dolares:
+        tenencias['USD'] = Dinero(cuenta.dolares)
+    consulta = text('SELECT moneda, cantidad FROM tenencias WHERE id_usuario=:id AND cantidad <> 0 ORDER BY moneda')
+    tenencias.update((moneda, Dinero(cantidad)) for moneda, cantidad in db.session.execute(consulta, {'id':cuenta.id}))
+    return tenencias
+
+
+def registrar_venta_dolares(usuario, cantidad_dolares, precio):
+    """
+    Vende dólares y acredita los pesos en el saldo, en una única transacción con débito condicional.
+
+    Args:
+        usuario(str): ID del usuario.
+        cantidad_dolares(Dinero | str | float): Cantidad de dólares a vender.
+        precio(float): Precio del dólar en pesos.
+    Returns:
+        Dinero: El total acreditado en pesos, redondeado al centavo.
+    Raises:
+        ValueError: Si la cantidad no es válida, el usuario no existe o no tiene dólares suficientes.
+    """
+    return _operar_dolares(usuario, cantidad_dolares, precio, compra=False)
+
+
+# Historial de transferencias enviadas y recibidas, del más reciente al más antiguo.
+# Cada mitad recorre su índice de cobertura (remitente|beneficiario, id) a partir del cursor.
+_CONSULTA_HISTORIAL = '''
+    SELECT remitente, beneficiario, transaccion, id, fecha FROM (
+        SELECT :usuario AS remitente, u_b."user" AS beneficiario, t.transaccion, t.id, t.fecha
+        FROM transferencias t
+        INNER JOIN "user" u_b ON t.id_usuario_beneficiario = u_b.id
+        WHERE t.id_usuario_remitente = :usuarioid AND t.id < :antes_de
+        ORDER BY t.id DESC {limite}
+    ) AS enviadas
+    UNION ALL
+    SELECT remitente, beneficiario, transaccion, id, fecha FROM (
+        SELECT u_r."user" AS remitente, :usuario AS beneficiario, t.transaccion, t.id, t.fecha
+        FROM transferencias t
+        INNER JOIN "user" u_r ON t.id_usuario_remitente = u_r.id
+        WHERE t.id_usuario_beneficiario = :usuarioid AND t.id < :antes_de
+        ORDER BY t.id DESC {limite}
+    ) AS recibidas
+    ORDER BY id DESC {limite}
+'''
+_SIN_CURSOR = 2 ** 63 - 1
+
+
+def obtener_transferencias_usuario(usuario, antes_de=None, limite=50):
+    """
+    Obtiene una página de las transferencias enviadas y recibidas del usuario.
+
+    La paginación es por cursor sobre transferencias.id, así que cada página cuesta lo mismo
+    sin importar cuántas transferencias tenga el usuario.
+
+    Args:
+        usuario(str): ID del usuario.
+        antes_de(int): Devuelve solo transferencias con id menor a este valor. None para la primera página.
+        limite(int): Cantidad máxima de transferencias de la página.
+    Returns:
+        list: Filas (remitente, beneficiario, transaccion, id, fecha), de la más reciente a la más antigua.
+    """
+    cuenta = obtener_cuenta(usuario)
+    if cuenta is None:
+        return []
+    consulta = text(_CONSULTA_HISTORIAL.format(limite='LIMIT :limite'))
+    parametros = {'usuario':usuario, 'usuarioid':cuenta.id, 'antes_de':antes_de or _SIN_CURSOR, 'limite':limite}
+
+    return db.session.execute(consulta, parametros).fetchall()
+
+
+def iterar_transferencias_usuario(usuario, tamano_lote=1000):
+    """
+    Recorre todas las transferencias del usuario sin cargarlas en memoria.
+
+    Las filas se leen del cursor de la base de a `tamano_lote`, así que sirve para exportar historiales grandes.
+
+    Args:
+        usuario(str): ID del usuario.
+        tamano_lote(int): Cantidad de filas que se traen de la base por vez.
+    Returns:
+        generator: Filas (remitente, beneficiario, transaccion, id, fecha), de la más reciente a la más antigua.
+    """
+    cuenta = obtener_cuenta(usuario)
+    if cuenta is None:
+        return
+    consulta = text(_CONSULTA_HISTORIAL.format(limite=''))
+    parametros = {'usuario':usuario, 'usuarioid':cuenta.id, 'antes_de':_SIN_CURSOR}
+    yield from db.session.execute(consulta, parametros, execution_options={'yield_per':tamano_lote})
+
+
+def realizar_transferencia(id_beneficiario, usuario, transferencia):
+    """
+    Realiza la transferencia en una única transacción corta.
+
+    Ambos usuarios se resuelven con una sola consulta. El débito es condicional (saldo >= monto),
+    así que el saldo se verifica en la misma sentencia que lo modifica y no hay carrera entre workers.
 
     Args:
         id_beneficiario(str): ID del usuario al que se enviara el dinero.
         usuario(str): ID del usuario que enviara el dinero.
-        transferencia(int): El monto de la transacción.
-        saldo(int): El balance disponible del usuario que desea enviar el dinero. 
+        transferencia(Dinero | str | int): El monto de la transacción.
+
+    Returns:
+        int: ID de la transferencia registrada.
+    Raises:
+        ValueError: Si el monto no es válido, algún usuario no existe o no hay saldo suficiente.
+    """
+    transferencia = Dinero.desde(transferencia)
+    if transferencia <= CERO:
+        raise ValueError("El monto de la transferencia debe ser mayor a cero")
+    if id_beneficiario == usuario:
+        raise ValueError("No se puede transferir a la misma cuenta")
+
+    ids = obtener_ids_usuarios([usuario, id_beneficiario])
+    if usuario not in ids:
+        raise ValueError("Usuario no encontrado")
+    if id_beneficiario not in ids:
+        raise ValueError("El usuario beneficiario no existe")
+
+    try:
+        return ejecutar_escritura(_transferir, ids[usuario], ids[id_beneficiario], transferencia)
+    finally:
+        invalidar_cuenta(usuario, id_beneficiario)
+
+
+def _transferir(conexion, id_remitente, id_beneficiario, transferencia):
+    # Operación de escritura de realizar_transferencia (ver app.escritor). Devuelve el id de la transferencia.
+    bloquear_usuarios([id_remitente, id_beneficiario], conexion)
+    debitar = text('UPDATE "user" SET saldo = saldo - :monto WHERE id=:id AND saldo >= :monto')
+    if conexion.execute(debitar, {'monto':transferencia.centavos, 'id':id_remitente}).rowcount == 0:
+        raise ValueError("No hay suficiente saldo para realizar la transferencia")
+
+    acreditar = text('UPDATE "user" SET saldo = saldo + :monto WHERE id=:id')
+    conexion.execute(acreditar, {'monto':transferencia.centavos, 'id':id_beneficiario})
+
+    #Registrar la transferencia en tabla transferencias.
+    registrar_transferencia = text('''INSERT INTO transferencias (id_usuario_remitente,id_usuario_beneficiario,transaccion,fecha) 
+                                   VALUES (:usuario_remitente,:usuario_beneficiario,:transferencia,CURRENT_TIMESTAMP) RETURNING id''')
+    id_transferencia = conexion.execute(registrar_transferencia, {'usuario_remitente':id_remitente, 'usuario_beneficiario':id_beneficiario, 'transferencia':transferencia.centavos}).scalar()
+    registrar_movimientos(conexion, [
+        {'id_usuario':id_remitente, 'moneda':'ARS', 'monto':-transferencia, 'tipo':'transferencia', 'referencia':id_transferencia},
+        {'id_usuario':id_beneficiario, 'moneda':'ARS', 'monto':transferencia, 'tipo':'transferencia', 'referencia':id_transferencia},
+    ])
+    acumular(conexion, [('transferencias', 'ARS', 1, transferencia.centavos)], id_remitente)
+    return id_transferencia
+
+
+def leer_lote_transferencias(contenido, formato='csv'):
+    """
+    Convierte el contenido de un lote de transferencias en una lista de pares (beneficiario, monto).
+
+    Args:
+        contenido(str): Texto CSV (una transferencia por línea: beneficiario,monto) o JSON.
+        formato(str): 'csv' o 'json'. El JSON puede ser una lista de pares o de objetos con
+            las claves 'beneficiario' y 'monto', o un objeto con esa lista en 'transferencias'.
+    Returns:
+        list: Pares (beneficiario, monto) sin validar, en el orden recibido.
+    """
+    if formato == 'json':
+        data = json.loads(contenido) if isinstance(contenido, str) else contenido
+        if isinstance(data, dict):
+            data = data.get('transferencias', [])
+        return [(fila.get('beneficiario'), fila.get('monto')) if isinstance(fila, dict) else tuple(fila[:2]) for fila in data]
+
+    pagos = []
+    for fila in csv.reader(io.StringIO(contenido)):
+        if not fila or not fila[0].strip():
+            continue
+        if len(pagos) == 0 and fila[0].strip().lower() == 'beneficiario':
+            continue  # Encabezado opcional.
+        pagos.append((fila[0].strip(), fila[1].strip() if len(fila) > 1 else None))
+    return pagos
+
+
+def obtener_ids_usuarios(usuarios, tamano_bloque=500):
+    """
+    Resuelve el id interno de varios usuarios con consultas IN por bloques.
+
+    Los usuarios cuya cuenta ya se leyó en el request se toman de `flask.g` sin consultar la base.
+
+    Args:
+        usuarios(iterable): IDs (UUID) de los usuarios.
+        tamano_bloque(int): Cantidad máxima de parámetros por consulta.
+    Returns:
+        dict: ID del usuario -> id interno, solo para los usuarios que existen.
+    """
+    cuentas = g.get('cuentas', {})
+    ids = {usuario:cuentas[usuario].id for usuario in set(usuarios) if cuentas.get(usuario) is not None}
+    pendientes = [usuario for usuario in set(usuarios) if usuario not in ids]
+    consulta = text('SELECT "user", id FROM "user" WHERE "user" IN :usuarios').bindparams(bindparam('usuarios', expanding=True))
+    for inicio in range(0, len(pendientes), tamano_bloque):
+        ids.update(db.session.execute(consulta, {'usuarios':pendientes[inicio:inicio + tamano_bloque]}).fetchall())
+    return ids
+
 
+def bloquear_usuarios(ids, conexion=None):
+    """
+    Bloquea las filas de los usuarios hasta el fin de la transacción, en orden de id.
+
+    Tomar los bloqueos siempre en el mismo orden evita que dos transferencias cruzadas (A->B y B->A)
+    se esperen mutuamente. En SQLite no hace nada: la escritura ya bloquea la base entera.
+
+    Args:
+        ids(iterable): IDs internos de los usuarios.
+        conexion(Connection | Session): Conexión con la transacción en curso. Por defecto, la sesión del request.
     Returns:
         Esta función no retorna valor.
     """
-    checkusuariob = text('SELECT saldo,id FROM user WHERE user=:id_beneficiario')
-    datausuariob = db.session.execute(checkusuariob, {'id_beneficiario':id_beneficiario}).fetchone()
-    checkusuarior = text('SELECT id FROM user WHERE user=:usuario')
-    datausuarior = db.session.execute(checkusuarior, {'usuario':usuario}).fetchone()
-    if datausuariob:
-        nuevosaldorecibe = datausuariob[0] + transferencia
-        nuevosaldoenvia = saldo - transferencia
-        acutualizar_saldos_usuarios = text('UPDATE user SET saldo=:nuevo_saldo WHERE user=:usuario')
-        db.session.execute(acutualizar_saldos_usuarios, {'nuevo_saldo':nuevosaldorecibe,'usuario':id_beneficiario})
-        db.session.execute(acutualizar_saldos_usuarios, {'nuevo_saldo':nuevosaldoenvia,'usuario':usuario})
-        db.session.commit()
-        #Registrar la transferencia en tabla transferencias.
-         
-        registrar_transferencia = text('''INSERT INTO transferencias (id_usuario_remitente,id_usuario_beneficiario,transaccion) 
-                                       VALUES (:usuario_remitente,:usuario_beneficiario,:transferencia)''')
-        db.session.execute(registrar_transferencia, {'usuario_remitente':datausuarior[0], 'usuario_beneficiario':datausuariob[1], 'transferencia':transferencia})
-        db.session.commit()
-    
-
-def simular_prestamo(interesanual, montoprestamo, plazomeses):
+    conexion = conexion if conexion is not None else db.session
+    bloqueo = para_actualizar(conexion)
+    if bloqueo:
+        consulta = text('SELECT id FROM "user" WHERE id IN :ids ORDER BY id' + bloqueo).bindparams(bindparam('ids', expanding=True))
+        conexion.execute(consulta, {'ids':sorted(set(ids))}).fetchall()
+
+
+def realizar_transferencias_lote(usuario, pagos):
+    """
+    Realiza un lote de transferencias desde un mismo usuario en una única transacción.
+
+    Las filas inválidas se informan y se omiten. El saldo se verifica una sola vez contra el total
+    de las filas válidas: si no alcanza, o es mayor de lo que entra en la base, no se realiza ninguna.
+
+    Args:
+        usuario(str): ID del usuario que enviara el dinero.
+        pagos(list): Pares (beneficiario, monto).
+    Returns:
+        list: Un diccionario por fila con 'fila', 'beneficiario', 'monto' (Dinero si es válido), 'estado'
+            ('realizada' o 'rechazada') y 'detalle'.
+    Raises:
+        ValueError: Si el usuario que envía no existe.
+    """
+    resultados = []
+    for fila, (beneficiario, monto) in enumerate(pagos, start=1):
+        resultado = {'fila':fila, 'beneficiario':beneficiario, 'monto':monto, 'estado':'rechazada', 'detalle':None}
+        try:
+            resultado['monto'] = Dinero.desde(monto)
+        except ValueError:
+            resultado['detalle'] = 'Monto inválido'
+        else:
+            if resultado['monto'] <= CERO:
+                resultado['detalle'] = 'El monto de la transferencia debe ser mayor a cero'
+            elif not beneficiario:
+                resultado['detalle'] = 'Falta el usuario beneficiario'
+            elif beneficiario == usuario:
+                resultado['detalle'] = 'No se puede transferir a la misma cuenta'
+        resultados.append(resultado)
+
+    ids = obtener_ids_usuarios([usuario] + [r['beneficiario'] for r in resultados if r['detalle'] is None])
+    if usuario not in ids:
+        raise ValueError("Usuario no encontrado")
+    validos = []
+    for resultado in resultados:
+        if resultado['detalle'] is None:
+            if resultado['beneficiario'] in ids:
+                validos.append(resultado)
+            else:
+                resultado['detalle'] = 'El usuario beneficiario no existe'
+    if not validos:
+        return resultados
+
+    total = sumar(r['monto'] for r in validos)
+    if not en_rango(total):
+        for resultado in validos:
+            resultado['detalle'] = 'El total del lote supera el máximo permitido'
+        return resultados
+    id_remitente = ids[usuario]
+    acreditaciones = sumar_por_grupo([ids[r['beneficiario']] for r in validos], [r['monto'].centavos for r in validos])
+
+    filas = [(ids[r['beneficiario']], r['monto'].centavos) for r in validos]
+    try:
+        ejecutar_escritura(_transferir_lote, id_remitente, total, acreditaciones, filas)
+    except ValueError as e:
+        for resultado in validos:
+            resultado['detalle'] = str(e)
+        return resultados
+    finally:
+        invalidar_cuenta(usuario, *(r['beneficiario'] for r in validos))
+
+    for resultado in validos:
+        resultado['estado'] = 'realizada'
+    return resultados
+
+
+def _transferir_lote(conexion, id_remitente, total, acreditaciones, filas, tamano_bloque=500):
+    # Operación de escritura de realizar_transferencias_lote (ver app.escritor): todo el lote en un solo SAVEPOINT.
+    bloquear_usuarios([id_remitente, *acreditaciones], conexion)
+    debitar = text('UPDATE "user" SET saldo = saldo - :monto WHERE id=:id AND saldo >= :monto')
+    if conexion.execute(debitar, {'monto':total.centavos, 'id':id_remitente}).rowcount == 0:
+        raise ValueError('No hay suficiente saldo para realizar el lote')
+
+    acreditar = text('UPDATE "user" SET saldo = saldo + :monto WHERE id=:id')
+    conexion.execute(acreditar, [{'monto':monto.centavos, 'id':id_beneficiario} for id_beneficiario, monto in acreditaciones.items()])
+
+    # Un INSERT de varias filas por bloque; los movimientos se arman con las filas que devuelve RETURNING,
+    # así no dependen del orden en que la base asigna los ids.
+    movimientos = []
+    for inicio in range(0, len(filas), tamano_bloque):
+        bloque = filas[inicio:inicio + tamano_bloque]
+        valores = ', '.join(f'(:remitente, :beneficiario_{i}, :monto_{i}, CURRENT_TIMESTAMP)' for i in range(len(bloque)))
+        parametros = {'remitente':id_remitente}
+        for i, (id_beneficiario, centavos) in enumerate(bloque):
+            parametros[f'beneficiario_{i}'] = id_beneficiario
+            parametros[f'monto_{i}'] = centavos
+        registrar_transferencias = text(f'''INSERT INTO transferencias (id_usuario_remitente,id_usuario_beneficiario,transaccion,fecha)
+                                           VALUES {valores} RETURNING id, id_usuario_beneficiario, transaccion''')
+        for id_transferencia, id_beneficiario, centavos in conexion.execute(registrar_transferencias, parametros):
+            movimientos.append({'id_usuario':id_remitente, 'moneda':'ARS', 'monto':Dinero(-centavos), 'tipo':'transferencia', 'referencia':id_transferencia})
+            movimientos.append({'id_usuario':id_beneficiario, 'moneda':'ARS', 'monto':Dinero(centavos), 'tipo':'transferencia', 'referencia':id_transferencia})
+    registrar_movimientos(conexion, movimientos)
+    acumular(conexion, [('transferencias', 'ARS', len(filas), total.centavos)], id_remitente)
+
+
+def simular_prestamo(interesanual, montoprestamo, plazomeses, sistema='plano'):
     """
     Calcula las condiciones de un préstamo.
 
     Args:
         interesanual(int): Interés anual que va a tener el préstamo.
-        montoprestamo(int): Monto del préstamo.
+        montoprestamo(Dinero): Monto del préstamo.
         plazomeses(int): Cantidad de meses que se va a tener que pagar el préstamo con sus intereses aplicados.
+        sistema(str): Sistema de amortización ('frances', 'aleman' o 'plano').
     Returns:
-        int: Cantidad total de dinero que se va a pagar en interés.
-        int: Cantidad total que se va a pagar sumando el monto inicial con los intereses.
-        int: Cantidad que se va a pagar en cada cuota mensual.
+        Dinero: Cantidad total de dinero que se va a pagar en interés.
+        Dinero: Cantidad total que se va a pagar sumando el monto inicial con los intereses.
+        Dinero: Cantidad que se va a pagar en la primera cuota mensual (en los sistemas de cuota fija, en todas).
+    Raises:
+        ValueError: Si el interés es negativo o el plazo está fuera de 1..PLAZO_MAXIMO.
     """
-    interesmensual = interesanual / 12
-    totalinteres = round(((montoprestamo * interesmensual * plazomeses) / 100), 2)
-    totalpagar = round((montoprestamo + totalinteres), 2)
-    cuotamensual = round((totalpagar / plazomeses), 2)
+    if interesanual < 0:
+        raise ValueError('El interés no puede ser negativo')
+    montoprestamo = Dinero.desde(montoprestamo)
+    calculo = resumen(float(montoprestamo), interesanual, plazomeses, sistema)
+    if sistema in SISTEMAS_CUOTA_FIJA:
+        # La cuota fija se redondea hacia arriba al centavo: redondeada al más cercano, la suma de las cuotas
+        # puede quedar por debajo del capital más el interés (100 a 0% en 3 cuotas de 33,33 suma 99,99).
+        # El redondeo previo a 6 decimales descarta el ruido de punto flotante (10000.000000000002 centavos).
+        cuotamensual = Dinero(int(np.ceil(np.round(calculo['cuota_inicial'] * 100, 6))))
+        # El total es exactamente la suma de las cuotas, así el préstamo queda en cero al pagar la última.
+        totalpagar = cuotamensual * plazomeses
+    else:
+        cuotamensual = Dinero(int(a_centavos(calculo['cuota_inicial'])))
+        totalpagar = Dinero(int(a_centavos(calculo['total_pagar'])))
+    totalinteres = totalpagar - montoprestamo
 
     return totalinteres, totalpagar, cuotamensual
 
@@ -175,32 +653,39 @@ def registrar_prestamo(usuario, montoprestamo, plazoprestamo, cuotamensual, tasa
 
     Args:
         usuario(str): ID del usuario.
-        montoprestamo(int): Monto del préstamo.
+        montoprestamo(Dinero): Monto del préstamo.
         plazoprestamo(int): Cantidad de meses que se va a tener que pagar el préstamo con sus intereses aplicados.
-        cuotamensual(int): Cantidad que se va a pagar en cada cuota mensual.
+        cuotamensual(Dinero): Cantidad que se va a pagar en cada cuota mensual.
         tasaprestamo(int): Interés anual que va a tener el préstamo.
-        total(int): Monto total del préstamo sumado los interés, que se pagara concretado el pago de la totalidad de las cuotas.
+        total(Dinero): Monto total del préstamo sumado los interés, que se pagara concretado el pago de la totalidad de las cuotas.
     Returns:
-        Esta función no retorna valor.
+        int: ID del préstamo registrado.
     """
-    saldo = obtener_saldo(usuario)
-    nuevobalance = saldo + montoprestamo
-
-    # Obtener el ID del usuario
-    consulta_id_usuario = text('SELECT id FROM user WHERE user=:usuario')
-    consulta_id_usuario_result = db.session.execute(consulta_id_usuario, {'usuario':usuario}).fetchone()
-    if not consulta_id_usuario_result:
+    cuenta = obtener_cuenta(usuario)
+    if not cuenta:
         raise ValueError("Usuario no encontrado")
-    usuarioid = consulta_id_usuario_result[0]
 
-    # Insertar el préstamo en la base de datos
+    try:
+        return ejecutar_escritura(_registrar_prestamo, cuenta.id, montoprestamo, plazoprestamo, cuotamensual, tasaprestamo, total)
+    finally:
+        invalidar_cuenta(usuario)
+
+
+def _registrar_prestamo(conexion, id_usuario, montoprestamo, plazoprestamo, cuotamensual, tasaprestamo, total):
+    # Operación de escritura de registrar_prestamo (ver app.escritor). Devuelve el id del préstamo.
     consulta_registrar_prestamo = text('''INSERT INTO prestamos (id_usuario, cuotas, cuota_mensual, interes_anual, monto, monto_total) 
-                                       VALUES (:usuario_id, :plazo, :cuota, :tasa, :monto, :total)''')
-    db.session.execute(consulta_registrar_prestamo, {'usuario_id':usuarioid, 'plazo':plazoprestamo, 'cuota':cuotamensual, 'tasa':tasaprestamo, 'monto':montoprestamo, 'total':total})
+                                       VALUES (:usuario_id, :plazo, :cuota, :tasa, :monto, :total) RETURNING id''')
+    id_prestamo = conexion.execute(consulta_registrar_prestamo, {'usuario_id':id_usuario, 'plazo':plazoprestamo, 'cuota':cuotamensual.centavos, 'tasa':tasaprestamo, 'monto':montoprestamo.centavos, 'total':total.centavos}).scalar()
 
-    consulta_actualizar_balance = text('UPDATE user SET saldo=:saldo WHERE user=:usuario')
-    db.session.execute(consulta_actualizar_balance, {'saldo':nuevobalance, 'usuario':usuario})
-    db.session.commit()
+    consulta_actualizar_balance = text('UPDATE "user" SET saldo = saldo + :monto WHERE id=:usuario_id')
+    conexion.execute(consulta_actualizar_balance, {'monto':montoprestamo.centavos, 'usuario_id':id_usuario})
+    registrar_movimientos(conexion, [{'id_usuario':id_usuario, 'moneda':'ARS', 'monto':montoprestamo, 'tipo':'prestamo', 'referencia':id_prestamo}])
+    acumular(conexion, [
+        ('prestamos_otorgados', 'ARS', 1, montoprestamo.centavos),
+        ('deuda_prestamos', 'ARS', 1, total.centavos),
+        ('depositos', 'ARS', 0, montoprestamo.centavos),
+    ], id_usuario)
+    return id_prestamo
 
 
 def obtener_prestamos_usuario(usuario):
@@ -212,9 +697,7 @@ def obtener_prestamos_usuario(usuario):
     Returns:
         str: Los préstamos que el usuario solicito y tiene vigentes.
     """
-    checkusuarioid = text('SELECT id FROM user WHERE user=:usuario')
-    datausuarioid = db.session.execute(checkusuarioid, {'usuario':usuario}).fetchone()
-    usuarioid = datausuarioid[0]
+    usuarioid = obtener_cuenta(usuario).id
     checkprestamos_consulta = text('SELECT * FROM prestamos WHERE id_usuario=:usuarioid AND cuotas > 0')
     checkprestamos = db.session.execute(checkprestamos_consulta, {'usuarioid':usuarioid}).fetchall()
 
@@ -238,53 +721,59 @@ def obtener_detalle_prestamo(prestamo_id):
 
 def pagar_cuota_prestamo(prestamo_id, usuario_id):
     """
-    Paga las cuotas de un préstamo especifico, solo si hay balance suficiente.
+    Paga una cuota de un préstamo especifico, solo si hay balance suficiente.
 
     Args:
         prestamo_id(int): ID del préstamo.
-        usuario_id(int): ID del usuario.
+        usuario_id(str): ID del usuario.
     Returns:
         Esta función no retorna valor.
+    Raises:
+        ValueError: Si el préstamo no existe, no es del usuario, ya está pagado o no hay saldo suficiente.
     """
+    cuenta = obtener_cuenta(usuario_id)
+    if not cuenta:
+        raise ValueError("Usuario no encontrado")
     try:
-
-        # Obtener el préstamo y la cuota
-        consulta_prestamo = text('SELECT cuotas, cuota_mensual, monto_total FROM prestamos WHERE id=:prestamo_id')
-        prestamo = db.session.execute(consulta_prestamo, {'prestamo_id': prestamo_id}).fetchone()
-
-        if not prestamo:
-            raise ValueError("Préstamo no encontrado")
-
-        cuotas_restantes, cuota_mensual, monto_total = prestamo
-
-        # Verificar si hay cuotas restantes
-        if cuotas_restantes <= 0:
-            raise ValueError("El préstamo ya está completamente pagado")
-
-        # Verificar el saldo del usuario
-        saldo_actual = obtener_saldo(usuario_id)
-        if saldo_actual < cuota_mensual:
-            raise ValueError("Saldo insuficiente para pagar la cuota")
-
-        # Actualizar saldo del usuario
-        nuevo_saldo = saldo_actual - cuota_mensual
-        actualizar_saldo = text('UPDATE user SET saldo=:nuevo_saldo WHERE id=:usuario_id')
-        db.session.execute(actualizar_saldo, {'nuevo_saldo': nuevo_saldo, 'usuario_id': usuario_id})
-
-        # Actualizar el préstamo
-        nuevas_cuotas_restantes = cuotas_restantes - 1
-        nuevo_monto_total = round(monto_total - cuota_mensual, 2)
-        actualizar_prestamo = text('''
-            UPDATE prestamos 
-            SET cuotas=:nuevas_cuotas, monto_total=:nuevo_monto 
-            WHERE id=:prestamo_id
-        ''')
-        db.session.execute(actualizar_prestamo, {
-            'nuevas_cuotas': nuevas_cuotas_restantes,
-            'nuevo_monto': nuevo_monto_total,
-            'prestamo_id': prestamo_id
-        })
-
-        db.session.commit()
-    except Exception:
-        db.session.rollback()
\ No newline at end of file
+        prestamo_id = int(prestamo_id)
+    except (TypeError, ValueError):
+        raise ValueError("Préstamo no encontrado")
+    try:
+        ejecutar_escritura(_pagar_cuota, prestamo_id, cuenta.id)
+    finally:
+        invalidar_cuenta(usuario_id)
+
+
+def _pagar_cuota(conexion, prestamo_id, id_usuario):
+    # Operación de escritura de pagar_cuota_prestamo (ver app.escritor).
+    # Obtener el préstamo y la cuota
+    consulta_prestamo = text('SELECT id_usuario, cuotas, cuota_mensual FROM prestamos WHERE id=:prestamo_id' + para_actualizar(conexion))
+    prestamo = conexion.execute(consulta_prestamo, {'prestamo_id': prestamo_id}).fetchone()
+
+    if not prestamo or prestamo.id_usuario != id_usuario:
+        raise ValueError("Préstamo no encontrado")
+
+    # Verificar si hay cuotas restantes
+    if prestamo.cuotas <= 0:
+        raise ValueError("El préstamo ya está completamente pagado")
+
+    # Debitar la cuota solo si el saldo alcanza, en la misma sentencia
+    debitar = text('UPDATE "user" SET saldo = saldo - :cuota WHERE id=:usuario_id AND saldo >= :cuota')
+    if conexion.execute(debitar, {'cuota': prestamo.cuota_mensual, 'usuario_id': id_usuario}).rowcount == 0:
+        raise ValueError("Saldo insuficiente para pagar la cuota")
+
+    # Actualizar el préstamo. La cuota del mes queda cobrada, así el débito automático no la repite.
+    actualizar_prestamo = text('''
+        UPDATE prestamos 
+        SET cuotas = cuotas - 1, cuotas_pagadas = COALESCE(cuotas_pagadas, 0) + 1, monto_total = monto_total - cuota_mensual,
+            periodo_cobrado = :periodo
+        WHERE id=:prestamo_id
+    ''')
+    conexion.execute(actualizar_prestamo, {'prestamo_id': prestamo_id, 'periodo': periodo_actual()})
+    registrar_movimientos(conexion, [{'id_usuario':id_usuario, 'moneda':'ARS', 'monto':-Dinero(prestamo.cuota_mensual), 'tipo':'cuota', 'referencia':prestamo_id}])
+    # Con la última cuota el préstamo deja de contarse entre los vigentes.
+    acumular(conexion, [
+        ('cuotas_cobradas', 'ARS', 1, prestamo.cuota_mensual),
+        ('deuda_prestamos', 'ARS', -1 if prestamo.cuotas == 1 else 0, -prestamo.cuota_mensual),
+        ('depositos', 'ARS', 0, -prestamo.cuota_mensual),
+    ], id_usuario)
@@ -0,0 +1,114 @@
+import functools
+import hashlib
+import json
+import time
+from flask import g, jsonify, make_response, request, session
+from sqlalchemy import text
+from app import app, db
+
+
+def _reservar(usuario, clave, huella):
+    # Reserva la clave para esta request. Si ya existía (y no venció), devuelve lo guardado.
+    vencimiento = int(time.time()) - app.config['IDEMPOTENCIA_TTL']
+    with db.engine.begin() as conexion:
+        conexion.execute(text('DELETE FROM claves_idempotencia WHERE usuario = :usuario AND clave = :clave AND creada < :vencimiento'),
+                         {'usuario':usuario, 'clave':clave, 'vencimiento':vencimiento})
+        reservada = conexion.execute(text('''
+            INSERT INTO claves_idempotencia (usuario, clave, huella, creada) VALUES (:usuario, :clave, :huella, :ahora)
+            ON CONFLICT (usuario, clave) DO NOTHING
+        '''), {'usuario':usuario, 'clave':clave, 'huella':huella, 'ahora':int(time.time())}).rowcount
+        if reservada:
+            return None
+        return conexion.execute(text('SELECT huella, estado, cuerpo FROM claves_idempotencia WHERE usuario = :usuario AND clave = :clave'),
+                                {'usuario':usuario, 'clave':clave}).fetchone()
+
+
+def _completar(usuario, clave, estado, cuerpo):
+    with db.engine.begin() as conexion:
+        conexion.execute(text('UPDATE claves_idempotencia SET estado = :estado, cuerpo = :cuerpo WHERE usuario = :usuario AND clave = :clave'),
+                         {'estado':estado, 'cuerpo':cuerpo, 'usuario':usuario, 'clave':clave})
+
+
+def _liberar(usuario, clave):
+    with db.engine.begin() as conexion:
+        conexion.execute(text('DELETE FROM claves_idempotencia WHERE usuario = :usuario AND clave = :clave'), {'usuario':usuario, 'clave':clave})
+
+
+# Lo que reciben los reintentos cuando la primera request falló después de enviar su escritura.
+_RESULTADO_INCIERTO = json.dumps({
+    'error':'No se pudo confirmar si la operación se realizó. Consulta la cuenta antes de repetirla con otra clave.',
+})
+
+
+def _terminar_con_error(usuario, clave, respuesta=None):
+    # Si la operación no llegó a escribir, la clave se libera y el cliente puede reintentar con ella.
+    # Si pudo haberse aplicado, la clave queda con un 500 que reciben los reintentos, así no se aplica dos veces.
+    if not g.get('escritura_posible'):
+        _liberar(usuario, clave)
+    elif respuesta is None:
+        _completar(usuario, clave, 500, _RESULTADO_INCIERTO)
+    else:
+        _completar(usuario, clave, respuesta.status_code, respuesta.get_data(as_text=True))
+
+
+def idempotente(vista):
+    """
+    Decorador para operaciones de la API que un cliente puede reintentar con el encabezado Idempotency-Key.
+
+    La primera request con una clave se ejecuta y su respuesta queda guardada; las siguientes con la misma
+    clave reciben esa respuesta sin volver a ejecutar la operación. Una clave reutilizada con otro contenido
+    se rechaza con 422, y una cuya primera request todavía está en curso con 409.
+
+    Los errores internos (5xx y excepciones) liberan la clave solo si la request no llegó a enviar una escritura
+    (ver `app.escritor.ejecutar_escritura`). Si la envió, la operación pudo haberse confirmado, como cuando el
+    escritor no responde a tiempo o falla algo después de escribir: la clave queda guardada con el error y los
+    reintentos lo reciben en vez de repetir la operación.
+
+    Args:
+        vista(callable): La vista a proteger.
+    Returns:
+        callable: La vista decorada.
+    """
+    @functools.wraps(vista)
+    def envoltura(*args, **kwargs):
+        clave = request.headers.get('Idempotency-Key')
+        usuario = session.get('usuario_id')
+        if not clave or not usuario:
+            return vista(*args, **kwargs)
+        if len(clave) > 100:
+            return jsonify({'error':'La clave de idempotencia no puede superar los 100 caracteres.'}), 400
+
+        huella = hashlib.sha256(f'{request.method} {request.path}\n'.encode() + request.get_data()).hexdigest()
+        guardada = _reservar(usuario, clave, huella)
+        if guardada is not None:
+            if guardada.huella != huella:
+                return jsonify({'error':'La clave de idempotencia ya se usó con otro pedido.'}), 422
+            if guardada.estado is None:
+                return jsonify({'error':'Hay un pedido con la misma clave de idempotencia en curso.'}), 409
+            respuesta = app.response_class(guardada.cuerpo, status=guardada.estado, mimetype='application/json')
+            respuesta.headers['Idempotent-Replayed'] = 'true'
+            return respuesta
+
+        try:
+            respuesta = make_response(vista(*args, **kwargs))
+        except Exception:
+            _terminar_con_error(usuario, clave)
+            raise
+        if respuesta.status_code >= 500:
+            _terminar_con_error(usuario, clave, respuesta)
+        else:
+            _completar(usuario, clave, respuesta.status_code, respuesta.get_data(as_text=True))
+        return respuesta
+    return envoltura
+
+
+def purgar_claves_vencidas():
+    """
+    Borra las claves de idempotencia más viejas que IDEMPOTENCIA_TTL.
+
+    Returns:
+        int: Cantidad de claves borradas.
+    """
+    vencimiento = int(time.time()) - app.config['IDEMPOTENCIA_TTL']
+    with db.engine.begin() as conexion:
+        return conexion.execute(text('DELETE FROM claves_idempotencia WHERE creada < :vencimiento'), {'vencimiento':vencimiento}).rowcount
@@ -0,0 +1,82 @@
+from functools import lru_cache
+import math
+import numpy as np
+
+# Máximos de la proyección: con 100 años, (1 + tasa mensual) ** meses y los saldos siguen siendo finitos.
+CAPITAL_MAXIMO = 1e12
+TASA_MAXIMA = 500
+
+
+def normalizar_parametros(capital, tasa_anual, anios, aporte_mensual):
+    """
+    Lleva los parámetros de la proyección a una forma canónica, para que escenarios iguales compartan la entrada del cache.
+
+    Args:
+        capital(float): Capital inicial.
+        tasa_anual(float): Tasa de interés anual en porcentaje.
+        anios(int): Cantidad de años.
+        aporte_mensual(float): Aporte que se suma al final de cada mes.
+    Returns:
+        tuple: (capital, tasa_anual, anios, aporte_mensual) normalizados.
+    Raises:
+        ValueError: Si algún valor no es un número finito, es negativo o supera su máximo, o el plazo no es válido.
+    """
+    capital, tasa_anual, aporte_mensual = float(capital), float(tasa_anual), float(aporte_mensual)
+    # NaN pasa cualquier comparación y además nunca es igual a sí mismo, así que llenaría el cache.
+    if not all(math.isfinite(valor) for valor in (capital, tasa_anual, aporte_mensual)):
+        raise ValueError('Los valores deben ser números finitos')
+    try:
+        anios = int(anios)
+    except OverflowError:
+        raise ValueError('El plazo debe estar entre 1 y 100 años') from None
+    capital = round(capital, 2)
+    tasa_anual = round(tasa_anual, 4)
+    aporte_mensual = round(aporte_mensual, 2)
+    if capital < 0 or tasa_anual < 0 or aporte_mensual < 0:
+        raise ValueError('Los valores no pueden ser negativos')
+    if capital > CAPITAL_MAXIMO or aporte_mensual > CAPITAL_MAXIMO:
+        raise ValueError(f'El capital y el aporte mensual no pueden superar {CAPITAL_MAXIMO:,.0f}')
+    if tasa_anual > TASA_MAXIMA:
+        raise ValueError(f'La tasa anual no puede superar el {TASA_MAXIMA}%')
+    if not 1 <= anios <= 100:
+        raise ValueError('El plazo debe estar entre 1 y 100 años')
+    return capital, tasa_anual, anios, aporte_mensual
+
+
+@lru_cache(maxsize=4096)
+def _curva(capital, tasa_anual, anios, aporte_mensual):
+    tasa_mensual = tasa_anual / 100 / 12
+    meses = np.arange(anios * 12 + 1)
+    if tasa_mensual > 0:
+        factor = (1 + tasa_mensual) ** meses
+        saldos = capital * factor + aporte_mensual * (factor - 1) / tasa_mensual
+    else:
+        saldos = capital + aporte_mensual * meses
+    return tuple(np.round(saldos, 2).tolist())
+
+
+def proyectar_interes_compuesto(capital, tasa_anual, anios, aporte_mensual):
+    """
+    Calcula la evolución mes a mes de una inversión con interés compuesto y aportes mensuales.
+
+    Las curvas se guardan en un cache LRU por parámetros normalizados, ya que muchos usuarios
+    simulan los mismos escenarios.
+
+    Args:
+        capital(float): Capital inicial.
+        tasa_anual(float): Tasa de interés anual en porcentaje.
+        anios(int): Cantidad de años.
+        aporte_mensual(float): Aporte que se suma al final de cada mes.
+    Returns:
+        dict: 'capitalfinal' (saldo al final del plazo), 'aportado' (capital más aportes) y
+            'curva' (saldo al final de cada mes, empezando por el mes 0).
+    Raises:
+        ValueError: Si los parámetros no son válidos.
+    """
+    capital, tasa_anual, anios, aporte_mensual = normalizar_parametros(capital, tasa_anual, anios, aporte_mensual)
+    curva = _curva(capital, tasa_anual, anios, aporte_mensual)
+    return {
+        'capitalfinal': curva[-1],
+        'aportado': round(capital + aporte_mensual * anios * 12, 2),
+        'curva': curva,
+    }
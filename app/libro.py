@@ -0,0 +1,168 @@
+import click
+from sqlalchemy import text
+from app import app, db
+from app.basedatos import nombre_dialecto
+from app.dinero import Dinero
+from app.reportes import acumular
+
+# Columna de 'user' que proyecta el saldo de cada moneda del libro. Las demás monedas se proyectan en 'tenencias'.
+COLUMNAS_SALDO = {'ARS':'saldo', 'USD':'dolares'}
+
+# Saldo de cada (usuario, moneda) según el libro: la última instantánea más los movimientos posteriores.
+# 'nuevos' cuenta los movimientos que no estaban en la instantánea.
+_CONSULTA_LIBRO = '''
+    WITH ultima AS (
+        SELECT id_usuario, moneda, MAX(id_movimiento) AS id_movimiento
+        FROM saldos_instantanea {filtro_instantanea}
+        GROUP BY id_usuario, moneda
+    ),
+    partes AS (
+        SELECT s.id_usuario, s.moneda, s.id_movimiento, s.saldo AS monto, 0 AS nuevos
+        FROM saldos_instantanea s
+        JOIN ultima u ON u.id_usuario = s.id_usuario AND u.moneda = s.moneda AND u.id_movimiento = s.id_movimiento
+        UNION ALL
+        SELECT m.id_usuario, m.moneda, m.id, m.monto, 1
+        FROM movimientos m
+        LEFT JOIN ultima u ON u.id_usuario = m.id_usuario AND u.moneda = m.moneda
+        WHERE m.id > COALESCE(u.id_movimiento, 0) {filtro_movimientos}
+    )
+    SELECT id_usuario, moneda, MAX(id_movimiento) AS id_movimiento, SUM(monto) AS saldo, SUM(nuevos) AS nuevos
+    FROM partes
+    GROUP BY id_usuario, moneda
+'''
+
+
+def registrar_movimientos(conexion, movimientos):
+    """
+    Agrega movimientos al libro. Se llama en la misma transacción que modifica los saldos de 'user'.
+
+    Args:
+        conexion(Connection | Session): Conexión o sesión con la transacción en curso.
+        movimientos(list): Diccionarios con 'id_usuario', 'moneda', 'monto' (Dinero; positivo acredita,
+            negativo debita), 'tipo' y 'referencia' (id de la transferencia o préstamo, o None).
+    Returns:
+        Esta función no retorna valor.
+    """
+    if movimientos:
+        movimientos = [{**movimiento, 'monto':movimiento['monto'].centavos} for movimiento in movimientos]
+        consulta = text('''INSERT INTO movimientos (id_usuario, moneda, monto, tipo, referencia, fecha)
+                           VALUES (:id_usuario, :moneda, :monto, :tipo, :referencia, CURRENT_TIMESTAMP)''')
+        conexion.execute(consulta, movimientos)
+
+
+def _bloquear_libro(conexion):
+    # Frena a los escritores mientras se lee el libro, así ningún movimiento con un id menor
+    # al último leído queda sin confirmar (en PostgreSQL los ids se asignan antes del commit).
+    if nombre_dialecto(conexion) == 'postgresql':
+        conexion.execute(text('LOCK TABLE movimientos IN SHARE MODE'))
+    else:
+        conexion.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def tomar_instantaneas():
+    """
+    Guarda el saldo según el libro de cada cuenta que tuvo movimientos desde su última instantánea.
+
+    Pensada para correr periódicamente (por ejemplo con `flask instantaneas` desde cron): reconstruir
+    o verificar un saldo después solo requiere los movimientos posteriores a la última instantánea.
+
+    Returns:
+        int: Cantidad de instantáneas guardadas.
+    """
+    consulta = text(f'''
+        INSERT INTO saldos_instantanea (id_usuario, moneda, id_movimiento, saldo, fecha)
+        SELECT id_usuario, moneda, id_movimiento, saldo, CURRENT_TIMESTAMP
+        FROM ({_CONSULTA_LIBRO.format(filtro_instantanea='', filtro_movimientos='')}) AS libro
+        WHERE nuevos > 0
+    ''')
+    with db.engine.connect() as conexion:
+        _bloquear_libro(conexion)
+        guardadas = conexion.execute(consulta).rowcount
+        conexion.commit()
+    return guardadas
+
+
+def saldo_segun_libro(id_usuario, moneda='ARS'):
+    """
+    Reconstruye el saldo de una cuenta desde su última instantánea y los movimientos posteriores.
+
+    Args:
+        id_usuario(int): ID interno del usuario.
+        moneda(str): Código de la moneda ('ARS', 'USD', ...).
+    Returns:
+        Dinero: El saldo según el libro (cero si la cuenta no tiene movimientos).
+    """
+    consulta = text(_CONSULTA_LIBRO.format(
+        filtro_instantanea='WHERE id_usuario = :id_usuario AND moneda = :moneda',
+        filtro_movimientos='AND m.id_usuario = :id_usuario AND m.moneda = :moneda',
+    ))
+    fila = db.session.execute(consulta, {'id_usuario':id_usuario, 'moneda':moneda}).fetchone()
+    return Dinero(int(fila.saldo)) if fila else Dinero(0)
+
+
+def verificar_saldos(reparar=False):
+    """
+    Compara el saldo de todas las cuentas con el que resulta de reproducir el libro desde la última instantánea.
+
+    Args:
+        reparar(bool): Si es True, las cuentas con diferencias toman el saldo del libro.
+    Returns:
+        list: Filas (id_usuario, moneda, saldo de la cuenta, saldo según el libro), con los saldos en centavos,
+            de las cuentas con diferencias.
+    """
+    libro = _CONSULTA_LIBRO.format(filtro_instantanea='', filtro_movimientos='')
+    diferencias = ' UNION ALL '.join(f'''
+        SELECT u.id AS id_usuario, '{moneda}' AS moneda, u.{columna} AS saldo_cuenta, COALESCE(l.saldo, 0) AS saldo_libro
+        FROM "user" u LEFT JOIN libro l ON l.id_usuario = u.id AND l.moneda = '{moneda}'
+        WHERE u.{columna} <> COALESCE(l.saldo, 0)
+    ''' for moneda, columna in COLUMNAS_SALDO.items())
+    monedas_columna = ', '.join(f"'{moneda}'" for moneda in COLUMNAS_SALDO)
+    diferencias += f'''
+        UNION ALL
+        SELECT t.id_usuario, t.moneda, t.cantidad AS saldo_cuenta, COALESCE(l.saldo, 0) AS saldo_libro
+        FROM tenencias t LEFT JOIN libro l ON l.id_usuario = t.id_usuario AND l.moneda = t.moneda
+        WHERE t.cantidad <> COALESCE(l.saldo, 0)
+        UNION ALL
+        SELECT l.id_usuario, l.moneda, 0 AS saldo_cuenta, l.saldo AS saldo_libro
+        FROM libro l
+        WHERE l.moneda NOT IN ({monedas_columna}) AND l.saldo <> 0
+          AND NOT EXISTS (SELECT 1 FROM tenencias t WHERE t.id_usuario = l.id_usuario AND t.moneda = l.moneda)
+    '''
+    consulta = text(f'WITH libro AS ({libro}) {diferencias} ORDER BY id_usuario, moneda')
+
+    with db.engine.connect() as conexion:
+        if reparar:
+            _bloquear_libro(conexion)
+        filas = conexion.execute(consulta).fetchall()
+        if reparar:
+            for fila in filas:
+                columna = COLUMNAS_SALDO.get(fila.moneda)
+                if columna:
+                    conexion.execute(text(f'UPDATE "user" SET {columna} = :saldo WHERE id = :id'), {'saldo':fila.saldo_libro, 'id':fila.id_usuario})
+                else:
+                    conexion.execute(text('''
+                        INSERT INTO tenencias (id_usuario, moneda, cantidad) VALUES (:id, :moneda, :saldo)
+                        ON CONFLICT (id_usuario, moneda) DO UPDATE SET cantidad = excluded.cantidad
+                    '''), {'id':fila.id_usuario, 'moneda':fila.moneda, 'saldo':fila.saldo_libro})
+            acumular(conexion, [('depositos', fila.moneda, 0, fila.saldo_libro - fila.saldo_cuenta) for fila in filas])
+        conexion.commit()
+    return filas
+
+
+@app.cli.command('instantaneas')
+def instantaneas_comando():
+    """Guarda una instantánea de los saldos que cambiaron desde la anterior."""
+    print(f'Instantáneas guardadas: {tomar_instantaneas()}')
+
+
+@app.cli.command('verificar-saldos')
+@click.option('--reparar', is_flag=True, help='Corrige las cuentas con diferencias usando el saldo del libro.')
+def verificar_saldos_comando(reparar):
+    """Compara los saldos de las cuentas con el libro de movimientos."""
+    filas = verificar_saldos(reparar)
+    for fila in filas:
+        print(f'Usuario {fila.id_usuario} {fila.moneda}: cuenta {Dinero(int(fila.saldo_cuenta))}, libro {Dinero(int(fila.saldo_libro))}')
+    if not filas:
+        print('Todos los saldos coinciden con el libro.')
+    elif reparar:
+        print(f'Cuentas corregidas: {len(filas)}')
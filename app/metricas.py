@@ -0,0 +1,329 @@
+"""
+Métricas en memoria del proceso: tiempos de requests, consultas SQL, plantillas y llamadas HTTP salientes.
+
+Se exponen en formato de texto de Prometheus en /metrics, accesible solo desde la propia máquina salvo que
+METRICAS_SOLO_LOCAL sea 0. Con gunicorn cada worker tiene sus propias métricas y cada lectura de /metrics
+la responde uno de ellos.
+
+También incluye un perfilador por muestreo, apagado por defecto, para depurar en producción sin reiniciar:
+se enciende con PERFILADOR=1 o con POST /metrics/perfil?accion=iniciar y sus pilas agregadas (formato
+"collapsed" de flamegraph.pl / speedscope) se leen con GET /metrics/perfil.
+"""
+import bisect
+import collections
+import contextlib
+import os
+import sys
+import threading
+import time
+from flask import Response, abort, g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+
+# Límites de los buckets de los histogramas, en segundos.
+LIMITES = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histograma:
+    """
+    Histograma acumulado por combinación de etiquetas, con los buckets fijos de LIMITES.
+
+    Registrar una observación es una búsqueda binaria y tres sumas bajo un lock, para que medir
+    cada consulta no cambie lo que se está midiendo.
+
+    Args:
+        nombre(str): Nombre de la métrica.
+        ayuda(str): Descripción que acompaña a la métrica en /metrics.
+        etiquetas(tuple): Nombres de las etiquetas, en el orden en que se pasan a `observar`.
+    """
+
+    def __init__(self, nombre, ayuda, etiquetas):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valores, segundos):
+        """
+        Registra una duración.
+
+        Args:
+            valores(tuple): Valor de cada etiqueta.
+            segundos(float): Duración observada.
+        Returns:
+            Esta función no retorna valor.
+        """
+        posicion = bisect.bisect_left(LIMITES, segundos)
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [[0] * (len(LIMITES) + 1), 0.0, 0]
+            serie[0][posicion] += 1
+            serie[1] += segundos
+            serie[2] += 1
+
+    def exportar(self):
+        """
+        Returns:
+            list: Líneas del histograma en el formato de texto de Prometheus.
+        """
+        with self._lock:
+            series = [(valores, list(cuentas), suma, total) for valores, (cuentas, suma, total) in self._series.items()]
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} histogram']
+        for valores, cuentas, suma, total in sorted(series):
+            etiquetas = ','.join(f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(self.etiquetas, valores))
+            separador = ',' if etiquetas else ''
+            acumulado = 0
+            for limite, cuenta in zip(LIMITES, cuentas):
+                acumulado += cuenta
+                lineas.append(f'{self.nombre}_bucket{{{etiquetas}{separador}le="{limite}"}} {acumulado}')
+            lineas.append(f'{self.nombre}_bucket{{{etiquetas}{separador}le="+Inf"}} {total}')
+            lineas.append(f'{self.nombre}_sum{{{etiquetas}}} {suma:.6f}')
+            lineas.append(f'{self.nombre}_count{{{etiquetas}}} {total}')
+        return lineas
+
+    def reiniciar(self):
+        with self._lock:
+            self._series.clear()
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUESTS = Histograma('banco_request_segundos', 'Duración de las requests.', ('ruta', 'metodo', 'estado'))
+REQUESTS_DB = Histograma('banco_request_db_segundos', 'Tiempo de base de datos de cada request.', ('ruta',))
+CONSULTAS = Histograma('banco_db_consulta_segundos', 'Duración de las consultas SQL.', ('origen', 'operacion', 'resultado'))
+PLANTILLAS = Histograma('banco_plantilla_segundos', 'Duración del renderizado de plantillas.', ('plantilla',))
+HTTP_SALIENTE = Histograma('banco_http_saliente_segundos', 'Duración de las llamadas HTTP a servicios externos.', ('destino', 'resultado'))
+HISTOGRAMAS = (REQUESTS, REQUESTS_DB, CONSULTAS, PLANTILLAS, HTTP_SALIENTE)
+
+
+@contextlib.contextmanager
+def medir_http(destino):
+    """
+    Mide una llamada HTTP saliente.
+
+    Args:
+        destino(str): Nombre del servicio, por ejemplo 'cotizacion'.
+    """
+    inicio = time.perf_counter()
+    resultado = 'error'
+    try:
+        yield
+        resultado = 'ok'
+    finally:
+        HTTP_SALIENTE.observar((destino, resultado), time.perf_counter() - inicio)
+
+
+def exportar():
+    """
+    Returns:
+        str: Todas las métricas del proceso en el formato de texto de Prometheus.
+    """
+    lineas = []
+    for histograma in HISTOGRAMAS:
+        lineas.extend(histograma.exportar())
+    lineas.append('# HELP banco_perfilador_activo 1 si el perfilador por muestreo está encendido en este proceso.')
+    lineas.append('# TYPE banco_perfilador_activo gauge')
+    lineas.append(f'banco_perfilador_activo {int(perfilador.activo())}')
+    return '\n'.join(lineas) + '\n'
+
+
+def _origen():
+    # Endpoint de la request en curso; las consultas de comandos y de hilos en segundo plano quedan aparte.
+    if has_request_context():
+        return request.endpoint or 'desconocido'
+    return 'fuera_de_request'
+
+
+def _operacion(sentencia):
+    palabras = sentencia.lstrip().split(None, 1)
+    return palabras[0].upper() if palabras else ''
+
+
+def registrar_consultas(engine):
+    """
+    Mide las consultas de un motor de SQLAlchemy en el histograma CONSULTAS.
+
+    Args:
+        engine(Engine): Motor de SQLAlchemy.
+    Returns:
+        Esta función no retorna valor.
+    """
+    @event.listens_for(engine, 'before_cursor_execute')
+    def antes_de_consulta(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('inicios_consulta', []).append(time.perf_counter())
+
+    def terminar(conn, statement, resultado):
+        inicios = conn.info.get('inicios_consulta')
+        if not inicios:
+            return
+        duracion = time.perf_counter() - inicios.pop()
+        CONSULTAS.observar((_origen(), _operacion(statement), resultado), duracion)
+        if has_request_context():
+            g.tiempo_db = g.get('tiempo_db', 0.0) + duracion
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def despues_de_consulta(conn, cursor, statement, parameters, context, executemany):
+        terminar(conn, statement, 'ok')
+
+    @event.listens_for(engine, 'handle_error')
+    def error_de_consulta(contexto):
+        if contexto.connection is not None and contexto.statement is not None:
+            terminar(contexto.connection, contexto.statement, 'error')
+
+
+def _registrar_requests(app):
+    @app.before_request
+    def iniciar_medicion():
+        g.inicio_request = time.perf_counter()
+        if app.config['PERFILADOR']:
+            perfilador.iniciar_una_vez()
+
+    @app.after_request
+    def terminar_medicion(response):
+        inicio = g.pop('inicio_request', None)
+        if inicio is not None and request.endpoint not in ENDPOINTS_METRICAS:
+            ruta = request.url_rule.rule if request.url_rule else 'sin_ruta'
+            REQUESTS.observar((ruta, request.method, str(response.status_code)), time.perf_counter() - inicio)
+            REQUESTS_DB.observar((ruta,), g.get('tiempo_db', 0.0))
+        return response
+
+    def antes_de_plantilla(sender, template, context, **extra):
+        g.setdefault('inicios_plantilla', []).append(time.perf_counter())
+
+    def plantilla_renderizada(sender, template, context, **extra):
+        inicios = g.get('inicios_plantilla')
+        if inicios:
+            PLANTILLAS.observar((template.name or 'sin_nombre',), time.perf_counter() - inicios.pop())
+
+    before_render_template.connect(antes_de_plantilla, app, weak=False)
+    template_rendered.connect(plantilla_renderizada, app, weak=False)
+
+
+class Perfilador:
+    """
+    Perfilador por muestreo: cada `intervalo` segundos guarda la pila de cada hilo del proceso.
+
+    No agrega costo a las requests (solo el del hilo que muestrea) y se puede encender y apagar en caliente.
+
+    Args:
+        intervalo(float): Segundos entre muestras.
+        maximo_pilas(int): Pilas distintas que se guardan como máximo; las nuevas a partir de ahí se cuentan en '(otras)'.
+    """
+
+    def __init__(self, intervalo=0.01, maximo_pilas=20000):
+        self.intervalo = intervalo
+        self.maximo_pilas = maximo_pilas
+        self.muestras = collections.Counter()
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+        self._pid = None
+        self._pid_autoinicio = None
+
+    def activo(self):
+        return self._hilo is not None and self._hilo.is_alive() and self._pid == os.getpid()
+
+    def iniciar(self):
+        """
+        Enciende el muestreo en este proceso (los hilos no sobreviven al fork de gunicorn).
+
+        Returns:
+            Esta función no retorna valor.
+        """
+        with self._lock:
+            if self.activo():
+                return
+            self._detener.clear()
+            self._pid = os.getpid()
+            self._hilo = threading.Thread(target=self._muestrear, daemon=True, name='perfilador')
+            self._hilo.start()
+
+    def iniciar_una_vez(self):
+        # Con PERFILADOR=1 se enciende en la primera request de cada proceso, pero si después se apaga a mano queda apagado.
+        if self._pid_autoinicio != os.getpid():
+            self._pid_autoinicio = os.getpid()
+            self.iniciar()
+
+    def detener(self):
+        self._detener.set()
+
+    def reiniciar(self):
+        with self._lock:
+            self.muestras.clear()
+
+    def exportar(self):
+        """
+        Returns:
+            str: Una línea por pila ("modulo:funcion;modulo:funcion cantidad"), de la más frecuente a la menos.
+        """
+        with self._lock:
+            pilas = self.muestras.most_common()
+        return ''.join(f'{pila} {cantidad}\n' for pila, cantidad in pilas)
+
+    def _muestrear(self):
+        propio = threading.get_ident()
+        while not self._detener.wait(self.intervalo):
+            for ident, marco in sys._current_frames().items():
+                if ident == propio:
+                    continue
+                pila = []
+                while marco is not None:
+                    pila.append(f'{marco.f_globals.get("__name__", "?")}:{marco.f_code.co_name}')
+                    marco = marco.f_back
+                clave = ';'.join(reversed(pila))
+                with self._lock:
+                    if clave in self.muestras or len(self.muestras) < self.maximo_pilas:
+                        self.muestras[clave] += 1
+                    else:
+                        self.muestras['(otras)'] += 1
+
+
+perfilador = Perfilador()
+ENDPOINTS_METRICAS = ('metricas', 'perfil')
+
+
+def _solo_local(app):
+    if app.config['METRICAS_SOLO_LOCAL'] and request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(404)
+
+
+def instalar_metricas(app, engine):
+    """
+    Registra la medición de consultas, requests y plantillas, y las rutas /metrics y /metrics/perfil.
+
+    Args:
+        app(Flask): La aplicación.
+        engine(Engine): Motor de SQLAlchemy de la aplicación.
+    Returns:
+        Esta función no retorna valor.
+    """
+    if not app.config['METRICAS_HABILITADAS']:
+        return
+    perfilador.intervalo = app.config['PERFILADOR_INTERVALO_MS'] / 1000
+    registrar_consultas(engine)
+    _registrar_requests(app)
+
+    def metricas():
+        _solo_local(app)
+        return Response(exportar(), mimetype='text/plain; version=0.0.4')
+
+    def perfil():
+        _solo_local(app)
+        if request.method == 'POST':
+            accion = request.args.get('accion')
+            if accion == 'iniciar':
+                perfilador.iniciar()
+            elif accion == 'detener':
+                perfilador.detener()
+            elif accion == 'reiniciar':
+                perfilador.reiniciar()
+            else:
+                return Response('Acción inválida: usar iniciar, detener o reiniciar.\n', status=400, mimetype='text/plain')
+        return Response(perfilador.exportar(), mimetype='text/plain')
+
+    app.add_url_rule('/metrics', 'metricas', metricas)
+    app.add_url_rule('/metrics/perfil', 'perfil', perfil, methods=['GET', 'POST'])
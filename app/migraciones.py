@@ -0,0 +1,409 @@
+from sqlalchemy import inspect, text
+from app import app, db
+from app import models  # Declara en db.metadata las tablas que crea migrar() en una base vacía.
+from app.basedatos import nombre_dialecto
+from app.reportes import guardar_totales, recalcular_totales
+
+# Clave del advisory lock de PostgreSQL que serializa las migraciones entre workers.
+_CLAVE_BLOQUEO_MIGRACIONES = 727001
+
+
+def _tipo_clave_autoincremental(conexion):
+    # En SQLite una columna INTEGER PRIMARY KEY ya se autoincrementa; en PostgreSQL hace falta SERIAL.
+    return 'SERIAL' if nombre_dialecto(conexion) == 'postgresql' else 'INTEGER'
+
+
+def _agregar_claves_foraneas(conexion):
+    """
+    Agrega claves foráneas de 'transferencias' y 'prestamos' hacia 'user'.
+
+    SQLite no permite agregar una FOREIGN KEY con ALTER TABLE, así que se crea la tabla nueva,
+    se copian las filas y se reemplaza la anterior.
+    """
+    if nombre_dialecto(conexion) == 'postgresql':
+        conexion.execute(text('ALTER TABLE transferencias ADD FOREIGN KEY (id_usuario_remitente) REFERENCES "user" (id)'))
+        conexion.execute(text('ALTER TABLE transferencias ADD FOREIGN KEY (id_usuario_beneficiario) REFERENCES "user" (id)'))
+        conexion.execute(text('ALTER TABLE prestamos ADD FOREIGN KEY (id_usuario) REFERENCES "user" (id)'))
+        return
+
+    conexion.execute(text('''
+        CREATE TABLE transferencias_nueva (
+            id INTEGER NOT NULL,
+            id_usuario_remitente INTEGER NOT NULL REFERENCES "user" (id),
+            id_usuario_beneficiario INTEGER NOT NULL REFERENCES "user" (id),
+            transaccion INTEGER NOT NULL,
+            PRIMARY KEY (id)
+        )
+    '''))
+    conexion.execute(text('''
+        INSERT INTO transferencias_nueva (id, id_usuario_remitente, id_usuario_beneficiario, transaccion)
+        SELECT id, id_usuario_remitente, id_usuario_beneficiario, transaccion FROM transferencias
+    '''))
+    conexion.execute(text('DROP TABLE transferencias'))
+    conexion.execute(text('ALTER TABLE transferencias_nueva RENAME TO transferencias'))
+
+    conexion.execute(text('''
+        CREATE TABLE prestamos_nueva (
+            id INTEGER NOT NULL,
+            id_usuario INTEGER NOT NULL REFERENCES "user" (id),
+            cuotas INTEGER NOT NULL,
+            cuotas_pagadas INTEGER,
+            cuota_mensual INTEGER,
+            interes_anual INTEGER NOT NULL,
+            monto INTEGER NOT NULL,
+            monto_total INTEGER NOT NULL,
+            PRIMARY KEY (id)
+        )
+    '''))
+    conexion.execute(text('''
+        INSERT INTO prestamos_nueva (id, id_usuario, cuotas, cuotas_pagadas, cuota_mensual, interes_anual, monto, monto_total)
+        SELECT id, id_usuario, cuotas, cuotas_pagadas, cuota_mensual, interes_anual, monto, monto_total FROM prestamos
+    '''))
+    conexion.execute(text('DROP TABLE prestamos'))
+    conexion.execute(text('ALTER TABLE prestamos_nueva RENAME TO prestamos'))
+
+
+def _crear_indices(conexion):
+    """
+    Índices para el historial de transferencias y los préstamos vigentes.
+
+    Los de 'transferencias' son de cobertura: incluyen todas las columnas que lee el historial,
+    así la consulta se resuelve recorriendo solo el índice.
+    """
+    conexion.execute(text('''
+        CREATE INDEX IF NOT EXISTS ix_transferencias_remitente
+        ON transferencias (id_usuario_remitente, id, id_usuario_beneficiario, transaccion)
+    '''))
+    conexion.execute(text('''
+        CREATE INDEX IF NOT EXISTS ix_transferencias_beneficiario
+        ON transferencias (id_usuario_beneficiario, id, id_usuario_remitente, transaccion)
+    '''))
+    conexion.execute(text('CREATE INDEX IF NOT EXISTS ix_prestamos_usuario_cuotas ON prestamos (id_usuario, cuotas)'))
+
+
+def _agregar_fecha_transferencias(conexion):
+    """
+    Agrega la fecha de las transferencias y la suma a los índices de cobertura del historial.
+
+    SQLite no acepta un DEFAULT no constante en ALTER TABLE, por eso las inserciones envían la fecha.
+    Las transferencias anteriores quedan sin fecha.
+    """
+    conexion.execute(text('ALTER TABLE transferencias ADD COLUMN fecha TIMESTAMP'))
+    conexion.execute(text('DROP INDEX IF EXISTS ix_transferencias_remitente'))
+    conexion.execute(text('DROP INDEX IF EXISTS ix_transferencias_beneficiario'))
+    conexion.execute(text('''
+        CREATE INDEX ix_transferencias_remitente
+        ON transferencias (id_usuario_remitente, id, id_usuario_beneficiario, transaccion, fecha)
+    '''))
+    conexion.execute(text('''
+        CREATE INDEX ix_transferencias_beneficiario
+        ON transferencias (id_usuario_beneficiario, id, id_usuario_remitente, transaccion, fecha)
+    '''))
+
+
+def _agregar_cobranza(conexion):
+    """
+    Soporte para el débito automático de cuotas: período cobrado por préstamo y registro de cuotas rechazadas.
+    """
+    conexion.execute(text('ALTER TABLE prestamos ADD COLUMN periodo_cobrado VARCHAR(7)'))
+    conexion.execute(text(f'''
+        CREATE TABLE cuotas_rechazadas (
+            id {_tipo_clave_autoincremental(conexion)} NOT NULL,
+            id_prestamo INTEGER NOT NULL REFERENCES prestamos (id),
+            periodo VARCHAR(7) NOT NULL,
+            motivo VARCHAR(200) NOT NULL,
+            fecha TIMESTAMP,
+            PRIMARY KEY (id),
+            CONSTRAINT uq_cuotas_rechazadas_prestamo_periodo UNIQUE (id_prestamo, periodo)
+        )
+    '''))
+
+
+def _crear_libro(conexion):
+    """
+    Libro de movimientos y sus instantáneas de saldo.
+
+    Cada cuenta existente recibe un movimiento de 'apertura' por su saldo actual, así el libro
+    coincide con los saldos desde el primer momento.
+    """
+    conexion.execute(text(f'''
+        CREATE TABLE movimientos (
+            id {_tipo_clave_autoincremental(conexion)} NOT NULL,
+            id_usuario INTEGER NOT NULL REFERENCES "user" (id),
+            moneda VARCHAR(3) NOT NULL,
+            monto FLOAT NOT NULL,
+            tipo VARCHAR(20) NOT NULL,
+            referencia INTEGER,
+            fecha TIMESTAMP,
+            PRIMARY KEY (id)
+        )
+    '''))
+    conexion.execute(text('CREATE INDEX ix_movimientos_usuario_moneda ON movimientos (id_usuario, moneda, id)'))
+    conexion.execute(text('''
+        CREATE TABLE saldos_instantanea (
+            id_usuario INTEGER NOT NULL REFERENCES "user" (id),
+            moneda VARCHAR(3) NOT NULL,
+            id_movimiento INTEGER NOT NULL,
+            saldo FLOAT NOT NULL,
+            fecha TIMESTAMP,
+            PRIMARY KEY (id_usuario, moneda, id_movimiento)
+        )
+    '''))
+    conexion.execute(text('''
+        INSERT INTO movimientos (id_usuario, moneda, monto, tipo, fecha)
+        SELECT id, 'ARS', saldo, 'apertura', CURRENT_TIMESTAMP FROM "user" WHERE saldo <> 0
+        ORDER BY id
+    '''))
+    conexion.execute(text('''
+        INSERT INTO movimientos (id_usuario, moneda, monto, tipo, fecha)
+        SELECT id, 'USD', dolares, 'apertura', CURRENT_TIMESTAMP FROM "user" WHERE dolares <> 0
+        ORDER BY id
+    '''))
+
+
+# Columnas con importes, que pasan a guardarse en centavos.
+_COLUMNAS_IMPORTE = [
+    ('"user"', 'saldo'),
+    ('"user"', 'dolares'),
+    ('transferencias', 'transaccion'),
+    ('prestamos', 'cuota_mensual'),
+    ('prestamos', 'monto'),
+    ('prestamos', 'monto_total'),
+    ('movimientos', 'monto'),
+    ('saldos_instantanea', 'saldo'),
+]
+
+
+def _importes_en_centavos(conexion):
+    """
+    Pasa todos los importes a centavos enteros (BIGINT), el formato de app/dinero.py.
+
+    En SQLite alcanza con actualizar los valores, salvo en las columnas FLOAT del libro: con afinidad REAL
+    los enteros se seguirían leyendo como float, así que esas dos tablas se reconstruyen.
+    """
+    if nombre_dialecto(conexion) == 'postgresql':
+        for tabla, columna in _COLUMNAS_IMPORTE:
+            conexion.execute(text(f'ALTER TABLE {tabla} ALTER COLUMN {columna} TYPE BIGINT USING ROUND({columna} * 100)'))
+        return
+
+    for tabla, columna in _COLUMNAS_IMPORTE[:6]:
+        conexion.execute(text(f'UPDATE {tabla} SET {columna} = CAST(ROUND({columna} * 100) AS INTEGER)'))
+
+    conexion.execute(text('''
+        CREATE TABLE movimientos_nueva (
+            id INTEGER NOT NULL,
+            id_usuario INTEGER NOT NULL REFERENCES "user" (id),
+            moneda VARCHAR(3) NOT NULL,
+            monto BIGINT NOT NULL,
+            tipo VARCHAR(20) NOT NULL,
+            referencia INTEGER,
+            fecha TIMESTAMP,
+            PRIMARY KEY (id)
+        )
+    '''))
+    conexion.execute(text('''
+        INSERT INTO movimientos_nueva (id, id_usuario, moneda, monto, tipo, referencia, fecha)
+        SELECT id, id_usuario, moneda, CAST(ROUND(monto * 100) AS INTEGER), tipo, referencia, fecha FROM movimientos
+    '''))
+    conexion.execute(text('DROP TABLE movimientos'))
+    conexion.execute(text('ALTER TABLE movimientos_nueva RENAME TO movimientos'))
+    conexion.execute(text('CREATE INDEX ix_movimientos_usuario_moneda ON movimientos (id_usuario, moneda, id)'))
+
+    conexion.execute(text('''
+        CREATE TABLE saldos_instantanea_nueva (
+            id_usuario INTEGER NOT NULL REFERENCES "user" (id),
+            moneda VARCHAR(3) NOT NULL,
+            id_movimiento INTEGER NOT NULL,
+            saldo BIGINT NOT NULL,
+            fecha TIMESTAMP,
+            PRIMARY KEY (id_usuario, moneda, id_movimiento)
+        )
+    '''))
+    conexion.execute(text('''
+        INSERT INTO saldos_instantanea_nueva (id_usuario, moneda, id_movimiento, saldo, fecha)
+        SELECT id_usuario, moneda, id_movimiento, CAST(ROUND(saldo * 100) AS INTEGER), fecha FROM saldos_instantanea
+    '''))
+    conexion.execute(text('DROP TABLE saldos_instantanea'))
+    conexion.execute(text('ALTER TABLE saldos_instantanea_nueva RENAME TO saldos_instantanea'))
+
+
+# Migraciones en orden. Cada una se aplica una sola vez y queda registrada en 'schema_migraciones'.
+def _crear_sesiones(conexion):
+    """
+    Sesiones guardadas en el servidor. 'usuario' permite saber qué usuarios temporales siguen en uso;
+    'expira' está en segundos desde epoch para compararlo igual en SQLite y PostgreSQL.
+    """
+    conexion.execute(text('''
+        CREATE TABLE sesiones (
+            id VARCHAR(64) NOT NULL,
+            usuario VARCHAR(120),
+            datos TEXT NOT NULL,
+            expira BIGINT NOT NULL,
+            PRIMARY KEY (id)
+        )
+    '''))
+    conexion.execute(text('CREATE INDEX ix_sesiones_expira ON sesiones (expira)'))
+    conexion.execute(text('CREATE INDEX ix_sesiones_usuario ON sesiones (usuario)'))
+
+
+def _crear_claves_idempotencia(conexion):
+    """
+    Respuestas guardadas de las operaciones de la API enviadas con Idempotency-Key. 'estado' queda en NULL
+    mientras la primera request con esa clave está en curso.
+    """
+    conexion.execute(text('''
+        CREATE TABLE claves_idempotencia (
+            usuario VARCHAR(120) NOT NULL,
+            clave VARCHAR(100) NOT NULL,
+            huella VARCHAR(64) NOT NULL,
+            estado INTEGER,
+            cuerpo TEXT,
+            creada BIGINT NOT NULL,
+            PRIMARY KEY (usuario, clave)
+        )
+    '''))
+    conexion.execute(text('CREATE INDEX ix_claves_idempotencia_creada ON claves_idempotencia (creada)'))
+
+
+def _crear_tenencias(conexion):
+    """
+    Tenencias en monedas que no tienen columna propia en 'user' (ARS está en 'saldo' y USD en 'dolares').
+    """
+    conexion.execute(text('''
+        CREATE TABLE tenencias (
+            id_usuario INTEGER NOT NULL REFERENCES "user" (id),
+            moneda VARCHAR(3) NOT NULL,
+            cantidad BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (id_usuario, moneda)
+        )
+    '''))
+
+
+def _crear_agregados(conexion):
+    """
+    Totales del banco mantenidos con cada operación (ver app/reportes.py), arrancando de los datos existentes.
+    """
+    conexion.execute(text('''
+        CREATE TABLE agregados (
+            periodo VARCHAR(10) NOT NULL,
+            concepto VARCHAR(30) NOT NULL,
+            moneda VARCHAR(3) NOT NULL,
+            ranura INTEGER NOT NULL,
+            cantidad BIGINT NOT NULL DEFAULT 0,
+            monto BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (periodo, concepto, moneda, ranura)
+        )
+    '''))
+    guardar_totales(conexion, recalcular_totales(conexion))
+
+
+def _crear_archivo(conexion):
+    """
+    Bloques comprimidos de datos archivados y resumen por usuario y mes (ver app/archivo.py).
+    """
+    binario = 'BYTEA' if nombre_dialecto(conexion) == 'postgresql' else 'BLOB'
+    conexion.execute(text(f'''
+        CREATE TABLE archivo_bloques (
+            id {_tipo_clave_autoincremental(conexion)} NOT NULL,
+            tipo VARCHAR(20) NOT NULL,
+            desde_id INTEGER,
+            hasta_id INTEGER,
+            desde_mes VARCHAR(7),
+            hasta_mes VARCHAR(7),
+            filas INTEGER NOT NULL,
+            resumen TEXT NOT NULL,
+            datos {binario} NOT NULL,
+            creado TIMESTAMP,
+            PRIMARY KEY (id)
+        )
+    '''))
+    conexion.execute(text('CREATE INDEX ix_archivo_bloques_tipo_meses ON archivo_bloques (tipo, hasta_mes, desde_mes)'))
+    conexion.execute(text('''
+        CREATE TABLE resumen_archivo (
+            id_usuario INTEGER NOT NULL REFERENCES "user" (id),
+            mes VARCHAR(7) NOT NULL,
+            concepto VARCHAR(20) NOT NULL,
+            cantidad BIGINT NOT NULL,
+            monto BIGINT NOT NULL,
+            PRIMARY KEY (id_usuario, mes, concepto)
+        )
+    '''))
+
+
+MIGRACIONES = [
+    (1, 'Tablas iniciales', lambda conexion: None),
+    (2, 'Claves foráneas de transferencias y prestamos', _agregar_claves_foraneas),
+    (3, 'Índices de historial y préstamos vigentes', _crear_indices),
+    (4, 'Fecha de las transferencias', _agregar_fecha_transferencias),
+    (5, 'Débito automático de cuotas', _agregar_cobranza),
+    (6, 'Libro de movimientos e instantáneas de saldo', _crear_libro),
+    (7, 'Importes en centavos', _importes_en_centavos),
+    (8, 'Sesiones del lado del servidor', _crear_sesiones),
+    (9, 'Claves de idempotencia de la API', _crear_claves_idempotencia),
+    (10, 'Tenencias en otras monedas', _crear_tenencias),
+    (11, 'Totales del banco', _crear_agregados),
+    (12, 'Archivo de transferencias, préstamos y usuarios', _crear_archivo),
+]
+
+
+def migrar():
+    """
+    Lleva el esquema de la base de datos a la última versión.
+
+    En una base vacía se crean las tablas desde los modelos y se marcan todas las migraciones como aplicadas.
+    En una base creada antes de este registro se toma la versión 1 como punto de partida.
+    Todo se hace dentro de una transacción exclusiva (BEGIN IMMEDIATE en SQLite, advisory lock en PostgreSQL),
+    para que varias instancias puedan arrancar a la vez. Con gunicorn corre una vez en el proceso maestro,
+    antes de crear los workers (ver gunicorn.conf.py).
+
+    Returns:
+        dict: 'creado' (la versión con la que se creó el esquema si la base estaba vacía, si no None) y
+            'aplicadas' (las migraciones aplicadas en esta ejecución).
+    """
+    aplicadas_ahora = []
+    creado = None
+    with db.engine.connect() as conexion:
+        if nombre_dialecto(conexion) == 'postgresql':
+            conexion.execute(text('SELECT pg_advisory_xact_lock(:clave)'), {'clave':_CLAVE_BLOQUEO_MIGRACIONES})
+        else:
+            conexion.exec_driver_sql('BEGIN IMMEDIATE')
+        conexion.execute(text('''
+            CREATE TABLE IF NOT EXISTS schema_migraciones (
+                version INTEGER NOT NULL PRIMARY KEY,
+                descripcion VARCHAR(200) NOT NULL,
+                aplicada TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        '''))
+        aplicadas = {version for (version,) in conexion.execute(text('SELECT version FROM schema_migraciones'))}
+
+        registrar = text('INSERT INTO schema_migraciones (version, descripcion) VALUES (:version, :descripcion)')
+        if not aplicadas:
+            if inspect(conexion).has_table('user'):
+                pendientes = MIGRACIONES[1:]
+                conexion.execute(registrar, {'version':MIGRACIONES[0][0], 'descripcion':MIGRACIONES[0][1]})
+            else:
+                db.metadata.create_all(conexion)
+                pendientes = []
+                creado = MIGRACIONES[-1][0]
+                conexion.execute(registrar, [{'version':version, 'descripcion':descripcion} for version, descripcion, _ in MIGRACIONES])
+        else:
+            pendientes = [m for m in MIGRACIONES if m[0] not in aplicadas]
+
+        for version, descripcion, migracion in pendientes:
+            migracion(conexion)
+            conexion.execute(registrar, {'version':version, 'descripcion':descripcion})
+            aplicadas_ahora.append(version)
+        conexion.commit()
+    return {'creado':creado, 'aplicadas':aplicadas_ahora}
+
+
+@app.cli.command('migrar')
+def migrar_comando():
+    """Aplica las migraciones pendientes del esquema."""
+    resultado = migrar()
+    if resultado['creado']:
+        print(f"Esquema creado en la versión {resultado['creado']}.")
+    elif resultado['aplicadas']:
+        print(f"Migraciones aplicadas: {resultado['aplicadas']}")
+    else:
+        print('El esquema ya está actualizado.')
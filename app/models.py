@@ -1,26 +1,126 @@
 from app import app, db
 
+# Los importes (saldos, transferencias, cuotas, movimientos) se guardan en centavos: ver app/dinero.py.
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user = db.Column(db.String(120), unique=True, nullable=False)
-    saldo = db.Column(db.Integer)
-    dolares = db.Column(db.Integer, nullable=False, default=0)
+    saldo = db.Column(db.BigInteger)
+    dolares = db.Column(db.BigInteger, nullable=False, default=0)
 
 class Transferencias(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    id_usuario_remitente = db.Column(db.Integer, nullable=False)
-    id_usuario_beneficiario = db.Column(db.Integer, nullable=False)
-    transaccion = db.Column(db.Integer, nullable=False)
+    id_usuario_remitente = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    id_usuario_beneficiario = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    transaccion = db.Column(db.BigInteger, nullable=False)
+    fecha = db.Column(db.DateTime, server_default=db.func.current_timestamp())
+
+    __table_args__ = (
+        db.Index('ix_transferencias_remitente', 'id_usuario_remitente', 'id', 'id_usuario_beneficiario', 'transaccion', 'fecha'),
+        db.Index('ix_transferencias_beneficiario', 'id_usuario_beneficiario', 'id', 'id_usuario_remitente', 'transaccion', 'fecha'),
+    )
 
 class Prestamos(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    id_usuario = db.Column(db.Integer, nullable=False)
+    id_usuario = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     cuotas = db.Column(db.Integer, nullable=False)
     cuotas_pagadas = db.Column(db.Integer, nullable=True)
-    cuota_mensual = db.Column(db.Integer)
+    cuota_mensual = db.Column(db.BigInteger)
     interes_anual = db.Column(db.Integer, nullable=False)
-    monto = db.Column(db.Integer, nullable=False)
-    monto_total = db.Column(db.Integer, nullable=False)
+    monto = db.Column(db.BigInteger, nullable=False)
+    monto_total = db.Column(db.BigInteger, nullable=False)
+    periodo_cobrado = db.Column(db.String(7))
+
+    __table_args__ = (
+        db.Index('ix_prestamos_usuario_cuotas', 'id_usuario', 'cuotas'),
+    )
+
+class CuotasRechazadas(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    id_prestamo = db.Column(db.Integer, db.ForeignKey('prestamos.id'), nullable=False)
+    periodo = db.Column(db.String(7), nullable=False)
+    motivo = db.Column(db.String(200), nullable=False)
+    fecha = db.Column(db.DateTime, server_default=db.func.current_timestamp())
+
+    __table_args__ = (
+        db.UniqueConstraint('id_prestamo', 'periodo', name='uq_cuotas_rechazadas_prestamo_periodo'),
+    )
+
+class Movimientos(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    id_usuario = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    moneda = db.Column(db.String(3), nullable=False)
+    monto = db.Column(db.BigInteger, nullable=False)
+    tipo = db.Column(db.String(20), nullable=False)
+    referencia = db.Column(db.Integer)
+    fecha = db.Column(db.DateTime, server_default=db.func.current_timestamp())
+
+    __table_args__ = (
+        db.Index('ix_movimientos_usuario_moneda', 'id_usuario', 'moneda', 'id'),
+    )
+
+class SaldosInstantanea(db.Model):
+    id_usuario = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    moneda = db.Column(db.String(3), primary_key=True)
+    id_movimiento = db.Column(db.Integer, primary_key=True)
+    saldo = db.Column(db.BigInteger, nullable=False)
+    fecha = db.Column(db.DateTime, server_default=db.func.current_timestamp())
+
+class Sesiones(db.Model):
+    id = db.Column(db.String(64), primary_key=True)
+    usuario = db.Column(db.String(120))
+    datos = db.Column(db.Text, nullable=False)
+    expira = db.Column(db.BigInteger, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_sesiones_expira', 'expira'),
+        db.Index('ix_sesiones_usuario', 'usuario'),
+    )
+
+class Tenencias(db.Model):
+    id_usuario = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    moneda = db.Column(db.String(3), primary_key=True)
+    cantidad = db.Column(db.BigInteger, nullable=False, default=0)
+
+class Agregados(db.Model):
+    periodo = db.Column(db.String(10), primary_key=True)
+    concepto = db.Column(db.String(30), primary_key=True)
+    moneda = db.Column(db.String(3), primary_key=True)
+    ranura = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    cantidad = db.Column(db.BigInteger, nullable=False, default=0)
+    monto = db.Column(db.BigInteger, nullable=False, default=0)
+
+class ArchivoBloques(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(20), nullable=False)
+    desde_id = db.Column(db.Integer)
+    hasta_id = db.Column(db.Integer)
+    desde_mes = db.Column(db.String(7))
+    hasta_mes = db.Column(db.String(7))
+    filas = db.Column(db.Integer, nullable=False)
+    resumen = db.Column(db.Text, nullable=False)
+    datos = db.Column(db.LargeBinary, nullable=False)
+    creado = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_archivo_bloques_tipo_meses', 'tipo', 'hasta_mes', 'desde_mes'),
+    )
+
+class ResumenArchivo(db.Model):
+    id_usuario = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    mes = db.Column(db.String(7), primary_key=True)
+    concepto = db.Column(db.String(20), primary_key=True)
+    cantidad = db.Column(db.BigInteger, nullable=False)
+    monto = db.Column(db.BigInteger, nullable=False)
+
+class ClavesIdempotencia(db.Model):
+    usuario = db.Column(db.String(120), primary_key=True)
+    clave = db.Column(db.String(100), primary_key=True)
+    huella = db.Column(db.String(64), nullable=False)
+    estado = db.Column(db.Integer)
+    cuerpo = db.Column(db.Text)
+    creada = db.Column(db.BigInteger, nullable=False)
 
-with app.app_context():
-    db.create_all()
\ No newline at end of file
+    __table_args__ = (
+        db.Index('ix_claves_idempotencia_creada', 'creada'),
+    )
@@ -0,0 +1,272 @@
+"""
+Totales de todo el banco mantenidos de forma incremental: depósitos por moneda, cuentas, deuda de préstamos
+y volúmenes de transferencias, préstamos, cuotas y cambios de moneda.
+
+Cada operación que escribe saldos suma sus variaciones a la tabla 'agregados' en la misma transacción
+(`acumular`), con dos filas por variación: el total acumulado (periodo 'total') y el del día (periodo
+'AAAA-MM-DD', en UTC). Así el reporte lee una cantidad fija de filas, sin recorrer las tablas de la base.
+
+Para que las operaciones concurrentes no se bloqueen en la misma fila, cada total está repartido en
+REPORTES_RANURAS filas (ranuras) que se suman al leer; cada operación escribe en la ranura de su usuario.
+
+`verificar_agregados` recalcula los totales desde las tablas, por rangos de ids, y los compara.
+"""
+import datetime
+import json
+import random
+import time
+import click
+from flask import abort, jsonify, request
+from sqlalchemy import inspect, text
+from app import app, db
+from app.basedatos import nombre_dialecto
+from app.dinero import Dinero
+
+# Conceptos que se pueden recalcular desde las tablas. Los volúmenes de cambio de moneda no: los movimientos
+# de los usuarios temporales se borran con ellos, y esos volúmenes quedan solo en los agregados.
+CONCEPTOS_VERIFICABLES = ('cuentas', 'depositos', 'deuda_prestamos', 'prestamos_otorgados', 'cuotas_cobradas', 'transferencias')
+
+_ACUMULAR = text('''
+    INSERT INTO agregados (periodo, concepto, moneda, ranura, cantidad, monto)
+    VALUES (:periodo, :concepto, :moneda, :ranura, :cantidad, :monto)
+    ON CONFLICT (periodo, concepto, moneda, ranura)
+    DO UPDATE SET cantidad = agregados.cantidad + excluded.cantidad, monto = agregados.monto + excluded.monto
+''')
+
+
+def dia_actual():
+    """
+    Devuelve el período diario en curso de los agregados.
+
+    Returns:
+        str: Fecha UTC con formato 'AAAA-MM-DD'.
+    """
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d')
+
+
+def acumular(conexion, variaciones, clave=None):
+    """
+    Suma variaciones a los agregados, en el total y en el día. Se llama en la misma transacción que modifica
+    las tablas de las que salen.
+
+    Args:
+        conexion(Connection | Session): Conexión o sesión con la transacción en curso.
+        variaciones(list): Tuplas (concepto, moneda, cantidad, monto en centavos). Las de un mismo concepto y
+            moneda se juntan en una sola.
+        clave(int): Elige la ranura (por ejemplo, el id interno del usuario). Sin ella, se elige al azar.
+    Returns:
+        Esta función no retorna valor.
+    """
+    ranuras = app.config['REPORTES_RANURAS']
+    ranura = clave % ranuras if clave is not None else random.randrange(ranuras)
+    sumas = {}
+    for concepto, moneda, cantidad, monto in variaciones:
+        anterior = sumas.get((concepto, moneda), (0, 0))
+        sumas[(concepto, moneda)] = (anterior[0] + int(cantidad), anterior[1] + int(monto))
+    # Siempre en el mismo orden, así dos transacciones no se esperan entre sí en filas cruzadas.
+    filas = sorted(
+        (periodo, concepto, moneda, cantidad, monto)
+        for (concepto, moneda), (cantidad, monto) in sumas.items() if cantidad or monto
+        for periodo in ('total', dia_actual())
+    )
+    if filas:
+        conexion.execute(_ACUMULAR, [
+            {'periodo':periodo, 'concepto':concepto, 'moneda':moneda, 'ranura':ranura, 'cantidad':cantidad, 'monto':monto}
+            for periodo, concepto, moneda, cantidad, monto in filas
+        ])
+
+
+def reporte(dias=7):
+    """
+    Devuelve los totales del banco y los de los últimos días.
+
+    Args:
+        dias(int): Cantidad de días, contando el de hoy, de los que se incluyen los totales diarios.
+    Returns:
+        dict: 'totales' (concepto -> moneda -> {'cantidad', 'monto'}) y 'dias' (fecha -> lo mismo, solo los
+            días con operaciones), con los montos como Dinero.
+    """
+    desde = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=max(dias, 1) - 1)).strftime('%Y-%m-%d')
+    consulta = text('''
+        SELECT periodo, concepto, moneda, SUM(cantidad) AS cantidad, SUM(monto) AS monto
+        FROM agregados
+        WHERE periodo = 'total' OR (periodo >= :desde AND periodo < 'total')
+        GROUP BY periodo, concepto, moneda
+        ORDER BY periodo DESC, concepto, moneda
+    ''')
+    resultado = {'totales':{}, 'dias':{}}
+    for fila in db.session.execute(consulta, {'desde':desde}):
+        destino = resultado['totales'] if fila.periodo == 'total' else resultado['dias'].setdefault(fila.periodo, {})
+        destino.setdefault(fila.concepto, {})[fila.moneda] = {'cantidad':int(fila.cantidad), 'monto':Dinero(int(fila.monto))}
+    return resultado
+
+
+def _rangos(conexion, tabla, columna, tamano_lote):
+    maximo = conexion.execute(text(f'SELECT COALESCE(MAX({columna}), 0) FROM {tabla}')).scalar()
+    return [(desde, desde + tamano_lote) for desde in range(0, maximo, tamano_lote)]
+
+
+def recalcular_totales(conexion, tamano_lote=50000):
+    """
+    Calcula los totales verificables desde las tablas y el archivo, recorriéndolos por rangos de ids con una
+    consulta por rango.
+
+    Args:
+        conexion(Connection): Conexión de la que se leen las tablas.
+        tamano_lote(int): Filas (ids) por consulta.
+    Returns:
+        dict: (concepto, moneda) -> [cantidad, monto en centavos].
+    """
+    totales = {}
+
+    def sumar(concepto, moneda, cantidad, monto):
+        total = totales.setdefault((concepto, moneda), [0, 0])
+        total[0] += int(cantidad or 0)
+        total[1] += int(monto or 0)
+
+    for desde, hasta in _rangos(conexion, '"user"', 'id', tamano_lote):
+        cuentas, saldo, dolares = conexion.execute(text('''
+            SELECT COUNT(*), SUM(saldo), SUM(dolares) FROM "user" WHERE id > :desde AND id <= :hasta
+        '''), {'desde':desde, 'hasta':hasta}).fetchone()
+        sumar('cuentas', 'ARS', cuentas, 0)
+        sumar('depositos', 'ARS', 0, saldo)
+        sumar('depositos', 'USD', 0, dolares)
+        for moneda, cantidad in conexion.execute(text('''
+            SELECT moneda, SUM(cantidad) FROM tenencias WHERE id_usuario > :desde AND id_usuario <= :hasta GROUP BY moneda
+        '''), {'desde':desde, 'hasta':hasta}):
+            sumar('depositos', moneda, 0, cantidad)
+
+    for desde, hasta in _rangos(conexion, 'prestamos', 'id', tamano_lote):
+        fila = conexion.execute(text('''
+            SELECT COUNT(*) AS otorgados, SUM(monto) AS monto,
+                SUM(CASE WHEN cuotas > 0 THEN 1 ELSE 0 END) AS vigentes, SUM(monto_total) AS deuda,
+                SUM(COALESCE(cuotas_pagadas, 0)) AS cuotas_pagadas, SUM(COALESCE(cuotas_pagadas, 0) * cuota_mensual) AS cobrado
+            FROM prestamos WHERE id > :desde AND id <= :hasta
+        '''), {'desde':desde, 'hasta':hasta}).fetchone()
+        sumar('prestamos_otorgados', 'ARS', fila.otorgados, fila.monto)
+        sumar('deuda_prestamos', 'ARS', fila.vigentes, fila.deuda)
+        sumar('cuotas_cobradas', 'ARS', fila.cuotas_pagadas, fila.cobrado)
+
+    for desde, hasta in _rangos(conexion, 'transferencias', 'id', tamano_lote):
+        cantidad, monto = conexion.execute(text('''
+            SELECT COUNT(*), SUM(transaccion) FROM transferencias WHERE id > :desde AND id <= :hasta
+        '''), {'desde':desde, 'hasta':hasta}).fetchone()
+        sumar('transferencias', 'ARS', cantidad, monto)
+
+    # Lo archivado (ver app/archivo.py) se suma desde el resumen de cada bloque, sin descomprimirlo.
+    # La migración que crea los agregados corre antes que la que crea el archivo.
+    bloques = _rangos(conexion, 'archivo_bloques', 'id', tamano_lote) if inspect(conexion).has_table('archivo_bloques') else []
+    for desde, hasta in bloques:
+        for tipo, resumen in conexion.execute(text('''
+            SELECT tipo, resumen FROM archivo_bloques WHERE id > :desde AND id <= :hasta AND tipo IN ('transferencias', 'prestamos')
+        '''), {'desde':desde, 'hasta':hasta}):
+            resumen = json.loads(resumen)
+            if tipo == 'transferencias':
+                sumar('transferencias', 'ARS', resumen['cantidad'], resumen['monto'])
+            else:
+                sumar('prestamos_otorgados', 'ARS', resumen['cantidad'], resumen['monto'])
+                sumar('deuda_prestamos', 'ARS', 0, resumen['deuda'])
+                sumar('cuotas_cobradas', 'ARS', resumen['cuotas_pagadas'], resumen['cobrado'])
+
+    return {clave:total for clave, total in totales.items() if total != [0, 0]}
+
+
+def guardar_totales(conexion, totales):
+    """
+    Reemplaza los totales verificables de los agregados por los recalculados.
+
+    Args:
+        conexion(Connection): Conexión con la transacción en curso.
+        totales(dict): Lo que devuelve `recalcular_totales`.
+    Returns:
+        Esta función no retorna valor.
+    """
+    conceptos = ', '.join(f"'{concepto}'" for concepto in CONCEPTOS_VERIFICABLES)
+    conexion.execute(text(f"DELETE FROM agregados WHERE periodo = 'total' AND concepto IN ({conceptos})"))
+    if totales:
+        conexion.execute(text('''
+            INSERT INTO agregados (periodo, concepto, moneda, ranura, cantidad, monto)
+            VALUES ('total', :concepto, :moneda, 0, :cantidad, :monto)
+        '''), [{'concepto':concepto, 'moneda':moneda, 'cantidad':cantidad, 'monto':monto}
+               for (concepto, moneda), (cantidad, monto) in sorted(totales.items())])
+
+
+def verificar_agregados(tamano_lote=50000, reparar=False):
+    """
+    Compara los totales acumulados con los que resultan de recorrer las tablas.
+
+    La lectura se hace en una sola transacción, sobre una foto consistente de la base. Con `reparar`, además,
+    frena a las operaciones que escriben agregados hasta terminar, y reemplaza los totales por los recalculados.
+
+    Args:
+        tamano_lote(int): Filas (ids) por consulta.
+        reparar(bool): Si es True, los totales toman los valores recalculados.
+    Returns:
+        list: Tuplas (concepto, moneda, cantidad acumulada, cantidad recalculada, monto acumulado, monto
+            recalculado), con los montos en centavos, de los totales con diferencias.
+    """
+    conceptos = ', '.join(f"'{concepto}'" for concepto in CONCEPTOS_VERIFICABLES)
+    with db.engine.connect() as conexion:
+        if nombre_dialecto(conexion) == 'postgresql':
+            conexion = conexion.execution_options(isolation_level='REPEATABLE READ')
+            if reparar:
+                conexion.execute(text('LOCK TABLE agregados IN SHARE ROW EXCLUSIVE MODE'))
+        else:
+            conexion.exec_driver_sql('BEGIN IMMEDIATE' if reparar else 'BEGIN')
+        acumulados = {(fila.concepto, fila.moneda):[int(fila.cantidad), int(fila.monto)] for fila in conexion.execute(text(f'''
+            SELECT concepto, moneda, SUM(cantidad) AS cantidad, SUM(monto) AS monto
+            FROM agregados WHERE periodo = 'total' AND concepto IN ({conceptos})
+            GROUP BY concepto, moneda
+        '''))}
+        recalculados = recalcular_totales(conexion, tamano_lote)
+        diferencias = []
+        for concepto, moneda in sorted(acumulados.keys() | recalculados.keys()):
+            cantidad, monto = acumulados.get((concepto, moneda), [0, 0])
+            cantidad_tablas, monto_tablas = recalculados.get((concepto, moneda), [0, 0])
+            if (cantidad, monto) != (cantidad_tablas, monto_tablas):
+                diferencias.append((concepto, moneda, cantidad, cantidad_tablas, monto, monto_tablas))
+        if reparar and diferencias:
+            guardar_totales(conexion, recalculados)
+        conexion.commit()
+    return diferencias
+
+
+def _solo_local():
+    if app.config['REPORTES_SOLO_LOCAL'] and request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(404)
+
+
+@app.route('/admin/reporte')
+def reporte_banco():
+    _solo_local()
+    dias = request.args.get('dias', 7, type=int)
+    if dias < 1 or dias > 366:
+        return jsonify({'error':'La cantidad de días debe estar entre 1 y 366.'}), 400
+    return jsonify(reporte(dias))
+
+
+@app.cli.command('reporte')
+@click.option('--dias', default=7, show_default=True, help='Días, contando el de hoy, con totales diarios.')
+def reporte_comando(dias):
+    """Muestra los totales del banco y los de los últimos días."""
+    datos = reporte(dias)
+    for titulo, totales in [('Totales', datos['totales'])] + list(datos['dias'].items()):
+        print(f'{titulo}:')
+        for concepto, monedas in totales.items():
+            for moneda, total in monedas.items():
+                print(f"  {concepto:<20} {moneda}  cantidad {total['cantidad']:>10}  monto {total['monto']:>20}")
+
+
+@app.cli.command('verificar-agregados')
+@click.option('--lote', default=50000, show_default=True, help='Filas (ids) por consulta.')
+@click.option('--reparar', is_flag=True, help='Reemplaza los totales con diferencias por los recalculados.')
+def verificar_agregados_comando(lote, reparar):
+    """Compara los totales acumulados del banco con las tablas."""
+    inicio = time.perf_counter()
+    diferencias = verificar_agregados(lote, reparar)
+    for concepto, moneda, cantidad, cantidad_tablas, monto, monto_tablas in diferencias:
+        print(f'{concepto} {moneda}: cantidad {cantidad} (tablas {cantidad_tablas}), monto {Dinero(monto)} (tablas {Dinero(monto_tablas)})')
+    if not diferencias:
+        print(f'Los totales coinciden con las tablas ({time.perf_counter() - inicio:.2f} s).')
+    elif reparar:
+        print(f'Totales corregidos: {len(diferencias)}')
@@ -1,7 +1,72 @@
-from flask import render_template, request, redirect, flash, session, url_for
+from flask import Response, jsonify, render_template, request, redirect, flash, session, stream_with_context, url_for
+import csv
+import io
+import itertools
+import json
 from app import app
-from app.funciones import actualizar_dolares, actualizar_saldo, crear_usuario_temporal, obtener_detalle_prestamo, obtener_dolares, obtener_prestamos_usuario, obtener_saldo, obtener_transferencias_usuario, pagar_cuota_prestamo, realizar_transferencia, registrar_prestamo, simular_prestamo
-import requests
+from app.cache import cachear_pagina
+from app.amortizacion import PLAZO_MAXIMO, SISTEMAS, SISTEMAS_CUOTA_FIJA, comparar, cronograma
+from app.archivo import iterar_transferencias_archivadas
+from app.cotizacion import obtener_precio_dolar
+from app.divisas import emitir_cotizacion, leer_cotizacion
+from app.dinero import CERO, Dinero, a_centavos, desde_centavos, sumar
+from app.interes import proyectar_interes_compuesto
+from app.funciones import aprovisionar_usuario, version_cuenta, crear_usuario_temporal, iterar_transferencias_usuario, obtener_detalle_prestamo, obtener_dolares, obtener_prestamos_usuario, obtener_saldo, leer_lote_transferencias, obtener_transferencias_usuario, pagar_cuota_prestamo, realizar_transferencia, registrar_compra_dolares, registrar_venta_dolares, realizar_transferencias_lote, registrar_prestamo, simular_prestamo
+
+# Endpoints que no necesitan el usuario de la sesión guardado en la base.
+ENDPOINTS_SIN_USUARIO = ('auth', 'static', 'metricas', 'perfil', 'reporte_banco', 'api.crear_sesion')
+
+# Lo que se informa cuando el escritor no confirmó la operación a tiempo (TimeoutError de `ejecutar_escritura`):
+# todavía puede confirmarse, así que no se dice que falló.
+OPERACION_PENDIENTE = 'La operación está demorada y todavía puede confirmarse. Revisa tu saldo antes de repetirla.'
+
+# Plazos (en meses) que se muestran en la matriz comparativa del simulador de préstamos.
+PLAZOS_COMPARACION = (6, 12, 24, 36, 48, 60)
+
+
+@app.template_filter('dinero')
+def filtro_dinero(centavos):
+    # Los importes leídos de la base vienen en centavos.
+    return Dinero(centavos) if centavos is not None else ''
+
+
+def cotizar_dolar():
+    # Precio del dólar en pesos y la cotización firmada que lo fija para el POST del formulario.
+    try:
+        cotizacion = emitir_cotizacion(session.get('usuario_id'), 'USD', 'ARS')
+    except ValueError:
+        return None, None
+    return cotizacion['tasa'], cotizacion['token']
+
+
+def precio_operacion():
+    # Precio al que se opera: el de la cotización que se mostró, o el vigente si el formulario no la trae.
+    token = request.form.get('cotizacion')
+    if token:
+        return leer_cotizacion(token, session.get('usuario_id'), 'USD', 'ARS')
+    precio = obtener_precio_dolar()
+    if precio is None:
+        raise ValueError('No se pudo obtener el precio del dólar')
+    return precio
+
+
+def version_sesion():
+    return version_cuenta(session.get('usuario_id'))
+
+
+def version_prestamo_sesion():
+    return version_cuenta(session.get('usuario_id'), request.args.get('prestamo_id'))
+
+
+@app.before_request
+def crear_usuario_pendiente():
+    if request.endpoint in ENDPOINTS_SIN_USUARIO:
+        return
+    try:
+        aprovisionar_usuario()
+    except Exception:
+        flash('Hubo un problema al crear el usuario temporal.', 'error')
+
 
 @app.route('/')
 def auth():
@@ -17,6 +82,7 @@ def auth():
 
 
 @app.route('/home', methods=['GET', 'POST'])
+@cachear_pagina(version_sesion)
 def home():
     if 'usuario_id' not in session:
         return redirect(url_for('auth'))
@@ -29,23 +95,68 @@ def home():
         flash('Error al obtener el saldo del usuario.')
         return redirect(url_for('home'))
 
+    por_pagina = app.config['HISTORIAL_POR_PAGINA']
     try:
-        # Consulta para obtener transferencias enviadas y recibidas
-        data = obtener_transferencias_usuario(usuario)
+        # Consulta para obtener una página de transferencias enviadas y recibidas
+        antes_de = request.args.get('antes_de', type=int)
+        data = obtener_transferencias_usuario(usuario, antes_de, por_pagina)
     except Exception:
         flash('Error al cargar historial de transferencias del usuario.', 'error')
         data = []
 
-    return render_template('home.html', data=data, saldo=saldo, dolares=dolares)
+    # Cursor de la página siguiente: el id de la transferencia más antigua mostrada
+    siguiente = data[-1][3] if len(data) == por_pagina else None
+    return render_template('home.html', data=data, saldo=saldo, dolares=dolares, siguiente=siguiente)
+
+
+@app.route('/home/exportar')
+def exportar_transferencias():
+    if 'usuario_id' not in session:
+        return redirect(url_for('auth'))
+
+    usuario = session['usuario_id']
+    formato = request.args.get('formato', 'csv')
+    columnas = ['remitente', 'beneficiario', 'transaccion', 'id', 'fecha']
+
+    def transferencias():
+        # Las de la tabla y, a continuación, las archivadas, todas de la más reciente a la más antigua.
+        return itertools.chain(iterar_transferencias_usuario(usuario), iterar_transferencias_archivadas(usuario))
+
+    def generar_csv():
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        escritor.writerow(columnas)
+        for fila in transferencias():
+            escritor.writerow((fila[0], fila[1], Dinero(fila[2]), *fila[3:]))
+            if buffer.tell() > 8192:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    def generar_json():
+        separador = '['
+        for fila in transferencias():
+            yield separador + json.dumps(dict(zip(columnas, (fila[0], fila[1], float(Dinero(fila[2])), *fila[3:]))), default=str)
+            separador = ','
+        yield ']' if separador == ',' else '[]'
+
+    if formato == 'json':
+        generador, mimetype = generar_json, 'application/json'
+    else:
+        generador, mimetype = generar_csv, 'text/csv'
+    return Response(stream_with_context(generador()), mimetype=mimetype,
+                    headers={'Content-Disposition':f'attachment; filename=transferencias.{formato if formato == "json" else "csv"}'})
 
 
 @app.route('/transferencia', methods=['GET','POST'])
+@cachear_pagina()
 def transferencia():
     if request.method == 'POST':
 
         #Conseguir los datos del formulario.
         try:
-            transferencia = int(request.form['montotransferencia'])
+            transferencia = Dinero.desde(request.form['montotransferencia'])
             id_beneficiario = request.form['ID']
         except Exception:
             flash('Error al procesar datos de la transferencia', 'error')
@@ -55,14 +166,15 @@ def transferencia():
         
         #Se realiza la transferencia.
         try:
-            saldo = obtener_saldo(usuario)
-            if saldo is not None and saldo >= transferencia:
-                realizar_transferencia(id_beneficiario, usuario, transferencia, saldo)
-                flash('Transferencia Realizada con exito.', 'success')
-                return redirect(url_for('transferencia'))
-            else:
-                flash('No hay suficiente saldo para realizar la transferencia.', 'error')    
-                return redirect(url_for('transferencia'))
+            realizar_transferencia(id_beneficiario, usuario, transferencia)
+            flash('Transferencia Realizada con exito.', 'success')
+            return redirect(url_for('transferencia'))
+        except ValueError as e:
+            flash(f'{e}.', 'error')
+            return redirect(url_for('transferencia'))
+        except TimeoutError:
+            flash(OPERACION_PENDIENTE, 'warning')
+            return redirect(url_for('transferencia'))
         except Exception:
             flash('Error al realizar la transferencia.', 'error') 
             return redirect(url_for('transferencia'))
@@ -71,27 +183,63 @@ def transferencia():
         return render_template('transferencia.html')
 
 
+@app.route('/transferencia/lote', methods=['POST'])
+def transferencia_lote():
+    usuario = session.get('usuario_id')
+    if not usuario:
+        return jsonify({'error':'Usuario no identificado.'}), 401
+
+    #Conseguir el lote desde un JSON, un archivo CSV/JSON o un campo de texto CSV.
+    try:
+        archivo = request.files.get('archivo')
+        if request.is_json:
+            pagos = leer_lote_transferencias(request.get_json(), 'json')
+        elif archivo:
+            formato = 'json' if archivo.filename.lower().endswith('.json') else 'csv'
+            pagos = leer_lote_transferencias(archivo.read().decode('utf-8-sig'), formato)
+        else:
+            pagos = leer_lote_transferencias(request.form['lote'])
+    except Exception:
+        return jsonify({'error':'Error al procesar los datos del lote.'}), 400
+
+    if not pagos:
+        return jsonify({'error':'El lote no contiene transferencias.'}), 400
+    if len(pagos) > app.config['TRANSFERENCIAS_LOTE_MAXIMO']:
+        return jsonify({'error':f"El lote supera el máximo de {app.config['TRANSFERENCIAS_LOTE_MAXIMO']} transferencias."}), 400
+
+    try:
+        resultados = realizar_transferencias_lote(usuario, pagos)
+    except ValueError as e:
+        return jsonify({'error':f'{e}.'}), 400
+    except TimeoutError:
+        return jsonify({'estado':'pendiente', 'detalle':OPERACION_PENDIENTE}), 202
+
+    realizadas = [r for r in resultados if r['estado'] == 'realizada']
+    return jsonify({
+        'realizadas':len(realizadas),
+        'rechazadas':len(resultados) - len(realizadas),
+        'total':sumar(r['monto'] for r in realizadas),
+        'resultados':resultados,
+    })
+
+
 @app.route('/interescompuesto', methods=['GET','POST'])
+@cachear_pagina()
 def interescompuesto():
     if request.method == 'POST':
 
         try:    
-            capital = int(request.form['capital'])
+            capital = float(request.form['capital'])
             tasainteres = float(request.form['tasainteres'])
             tiempo = int(request.form['tiempo'])
-            aportemensual = int(request.form['aportemensual'])
+            aportemensual = float(request.form['aportemensual'])
         except Exception:
             flash('Error al conseguir los datos del formulario.', 'error')
             return redirect(url_for('interescompuesto'))
 
         try:
-            tasamensual = tasainteres / 100 / 12
-            tiempo_meses = tiempo * 12
-
-            capitalfinal = round(capital * (1 + tasamensual) ** tiempo_meses + aportemensual 
-                                * (((1 + tasamensual) ** tiempo_meses - 1) / tasamensual), 2)
-            
-            return render_template('interescompuesto.html',capitalfinal=capitalfinal,tiempo=tiempo)
+            proyeccion = proyectar_interes_compuesto(capital, tasainteres, tiempo, aportemensual)
+            return render_template('interescompuesto.html', capitalfinal=proyeccion['capitalfinal'], tiempo=tiempo)
         
         except ValueError as e:
             flash(f'Error al realizar los calculos, Porfavor intente nuevamente.{e}')
@@ -101,16 +249,49 @@ def interescompuesto():
         return render_template('interescompuesto.html', capitalfinal=None)
 
 
+@app.route('/api/interescompuesto', methods=['GET', 'POST'])
+def api_interescompuesto():
+    datos = (request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+    try:
+        proyeccion = proyectar_interes_compuesto(
+            datos['capital'], datos['tasainteres'], datos['tiempo'], datos.get('aportemensual', 0)
+        )
+    except KeyError:
+        return jsonify({'error':'Faltan datos: capital, tasainteres y tiempo son obligatorios.'}), 400
+    except (TypeError, ValueError) as e:
+        return jsonify({'error':f'Datos inválidos: {e}'}), 400
+
+    respuesta = jsonify(proyeccion)
+    # El resultado depende solo de los parámetros: el navegador puede reutilizarlo.
+    respuesta.cache_control.public = True
+    respuesta.cache_control.max_age = 3600
+    return respuesta
+
+
 @app.route('/prestamo', methods=['GET','POST'])
+@cachear_pagina()
 def prestamo():
     if request.method == 'POST':
         try:
-            montoprestamo = int(request.form['montoprestamo'])
+            montoprestamo = Dinero.desde(request.form['montoprestamo'])
             interesanual = int(request.form['tasaprestamo'])
             plazomeses = int(request.form['plazoprestamo'])
+            sistema = request.form.get('sistema', 'plano')
+            if sistema not in SISTEMAS or montoprestamo <= CERO or not 0 < plazomeses <= PLAZO_MAXIMO or interesanual < 0:
+                raise ValueError('Datos del préstamo inválidos')
 
             # Cálculo del préstamo
-            totalinteres, totalpagar, cuotamensual = simular_prestamo(interesanual, montoprestamo, plazomeses) 
+            totalinteres, totalpagar, cuotamensual = simular_prestamo(interesanual, montoprestamo, plazomeses, sistema) 
+
+            # Matriz comparativa: cada sistema contra varios plazos, calculada en una sola pasada
+            plazos = sorted(set(PLAZOS_COMPARACION) | {plazomeses})
+            matriz = comparar([float(montoprestamo)], [interesanual], plazos)
+            cuotas = a_centavos(matriz['cuota_inicial'][:, 0, :, 0])
+            totales = a_centavos(matriz['total_pagar'][:, 0, :, 0])
+            comparacion = [
+                {'sistema':nombre, 'cuotas':desde_centavos(cuotas[i]), 'totales':desde_centavos(totales[i])}
+                for i, nombre in enumerate(SISTEMAS)
+            ]
             
             return render_template(
                 'prestamo.html',
@@ -120,9 +301,14 @@ def prestamo():
                 plazomeses=plazomeses,
                 montoprestamo=montoprestamo,
                 tasaprestamo=interesanual,
-                plazoprestamo=plazomeses
+                plazoprestamo=plazomeses,
+                sistema=sistema,
+                solicitable=sistema in SISTEMAS_CUOTA_FIJA,
+                cronograma=cronograma(montoprestamo, interesanual, plazomeses, sistema),
+                plazos=plazos,
+                comparacion=comparacion
             )
-        except ValueError:
+        except (KeyError, ValueError):
             flash('Error al simular prestamo.', 'error')
             return render_template('prestamo.html', totalpagar=None)
         
@@ -132,24 +318,32 @@ def prestamo():
 
 @app.route('/solicitar_prestamo', methods=['POST'])
 def solicitar_prestamo():
-    montoprestamo = int(request.form['monto'])
-    tasaprestamo = int(request.form['tasa'])
-    plazoprestamo = int(request.form['plazo'])
-    cuotamensual = float(request.form['cuotamensual'])
-    total = float(request.form['total'])
+    sistema = request.form.get('sistema', 'plano')
 
     usuario = session.get('usuario_id')
     
     try:
+        montoprestamo = Dinero.desde(request.form['monto'])
+        tasaprestamo = int(request.form['tasa'])
+        plazoprestamo = int(request.form['plazo'])
+        # La cuota se guarda fija, así que solo se pueden solicitar préstamos de cuota constante.
+        # Las condiciones se recalculan acá en lugar de confiar en las que envía el formulario.
+        if sistema not in SISTEMAS_CUOTA_FIJA or montoprestamo <= CERO or not 0 < plazoprestamo <= PLAZO_MAXIMO or tasaprestamo < 0:
+            raise ValueError('Datos del préstamo inválidos')
+        _, total, cuotamensual = simular_prestamo(tasaprestamo, montoprestamo, plazoprestamo, sistema)
         registrar_prestamo(usuario, montoprestamo, plazoprestamo, cuotamensual, tasaprestamo, total)
         flash('Prestamo solicitado correctamente.', 'success')
         return redirect(url_for('home'))
-    except ValueError:
+    except TimeoutError:
+        flash(OPERACION_PENDIENTE, 'warning')
+        return redirect(url_for('home'))
+    except (KeyError, ValueError):
         flash('Ocurrió un error al solicitar el préstamo.', 'error')
         return redirect(url_for('prestamo'))
     
     
 @app.route('/misprestamos')
+@cachear_pagina(version_sesion)
 def misprestamos():
     try:
         usuario = session.get('usuario_id')
@@ -163,6 +357,7 @@ def misprestamos():
 
 
 @app.route('/misprestamos/prestamo_detalle')
+@cachear_pagina(version_prestamo_sesion)
 def prestamo_detalle():
     prestamo_id = request.args.get('prestamo_id')
     usuario_id = session.get('usuario_id')
@@ -186,32 +381,26 @@ def pagar_cuota():
     except ValueError as e:
         flash(f"Error: {e}", "error")
         return redirect(url_for('prestamo_detalle', prestamo_id=prestamo_id))
+    except TimeoutError:
+        flash(OPERACION_PENDIENTE, "warning")
+        return redirect(url_for('prestamo_detalle', prestamo_id=prestamo_id))
+    except Exception:
+        flash("Error al pagar la cuota.", "error")
+        return redirect(url_for('prestamo_detalle', prestamo_id=prestamo_id))
     
 
 @app.route('/comprardolares')
 def comprar_dolares():
-    try:
-        # Llamada a una API para obtener el precio del dólar
-        url = 'https://api.exchangerate-api.com/v4/latest/USD'
-        response = requests.get(url)
-        data = response.json()
-
-        # Toma el valor del dólar frente al peso argentino (ARS)
-        dollar_price = data['rates']['ARS']
-        return render_template('comprar_dolares.html', dollar_price=dollar_price)
-    except Exception:
+    # Precio del dólar frente al peso argentino (ARS), servido desde el cache de cotizaciones
+    dollar_price, cotizacion = cotizar_dolar()
+    if dollar_price is None:
         flash('No se pudo obtener el precio del dólar. Inténtelo más tarde.', 'error')
         return render_template('comprar_dolares.html', dollar_price='Error')
+    return render_template('comprar_dolares.html', dollar_price=dollar_price, cotizacion=cotizacion)
 
 
 @app.route('/comprar_dolares', methods=['GET', 'POST'])
 def compra_dolares():
-    # Llamada a la API para obtener el precio del dólar
-    url = 'https://api.exchangerate-api.com/v4/latest/USD'
-    response = requests.get(url)
-    data = response.json()
-    dollar_price = data['rates']['ARS']
-
     usuario = session.get('usuario_id')  # Obtenemos el usuario desde la sesión
     if not usuario:
         flash('Usuario no identificado. Por favor, inicia sesión.', 'error')
@@ -219,56 +408,49 @@ def compra_dolares():
 
     if request.method == 'POST':
         try:
-            cantidad_dolares = float(request.form['cantidad_dolares'])
-            if cantidad_dolares <= 0:
-                flash('La cantidad de dólares debe ser válida.', 'error')
-                return render_template('comprar_dolares.html', dollar_price=dollar_price)
-
-            costo_total = cantidad_dolares * dollar_price
-            saldo = obtener_saldo(usuario)
-            dolares = obtener_dolares(usuario)
-            # Verificar si el usuario tiene saldo suficiente
-            if saldo is None or saldo < costo_total:
-                flash('No tienes saldo suficiente para realizar esta compra.', 'error')
-            else:
-                # Realizar la compra
-                actualizar_saldo(usuario, saldo - costo_total)
-                actualizar_dolares(usuario, cantidad_dolares + dolares)
-                flash(f'Compra realizada con éxito. Compraste {cantidad_dolares} USD por ${costo_total:.2f} ARS.', 'success')
+            cantidad_dolares = Dinero.desde(request.form['cantidad_dolares'])
         except ValueError:
             flash('Error al procesar la compra. Inténtelo más tarde.', 'error')
+        else:
+            try:
+                # Se compra al precio que se mostró. El saldo se verifica y se debita en la misma transacción que acredita los dólares
+                costo_total = registrar_compra_dolares(usuario, cantidad_dolares, precio_operacion())
+                flash(f'Compra realizada con éxito. Compraste {cantidad_dolares} USD por ${costo_total:.2f} ARS.', 'success')
+            except ValueError as e:
+                flash(f'{e}.', 'error')
+            except TimeoutError:
+                flash(OPERACION_PENDIENTE, 'warning')
 
-    return render_template('comprar_dolares.html', dollar_price=dollar_price)
+    dollar_price, cotizacion = cotizar_dolar()
+    if dollar_price is None:
+        flash('No se pudo obtener el precio del dólar. Inténtelo más tarde.', 'error')
+        return render_template('comprar_dolares.html', dollar_price='Error')
+    return render_template('comprar_dolares.html', dollar_price=dollar_price, cotizacion=cotizacion)
 
 
 @app.route('/vender_dolares', methods=['GET','POST'])
 def vender_dolares():
-    # Llamada a la API para obtener el precio del dólar
-    url = 'https://api.exchangerate-api.com/v4/latest/USD'
-    response = requests.get(url)
-    data = response.json()
-    dollar_price = data['rates']['ARS']
     usuario = session.get('usuario_id')
-    saldo = obtener_saldo(usuario)
-    dolares = obtener_dolares(usuario)
 
     if request.method == 'POST':
         try:
-            cantidad_dolares = float(request.form['cantidad_dolares'])
-            if cantidad_dolares <= 0:
-                flash('La cantidad de dólares debe ser válida.', 'error')
-                return render_template('vender_dolares.html', dollar_price=dollar_price)
-
-            costo_total = cantidad_dolares * dollar_price
-            
-            # Verificar si el usuario tiene saldo suficiente
-            if dolares is None or dolares < cantidad_dolares:
-                flash('No tienes dólares suficiente para realizar esta venta.', 'error')
-            else:
-                # Realizar la compra
-                actualizar_saldo(usuario, saldo + costo_total)
-                actualizar_dolares(usuario,  dolares - cantidad_dolares)
-                flash(f'Venta realizada con éxito. Vendiste {cantidad_dolares} USD por ${costo_total:.2f} ARS.', 'success')
+            cantidad_dolares = Dinero.desde(request.form['cantidad_dolares'])
         except ValueError:
             flash('Error al procesar la venta. Inténtelo más tarde.', 'error')
-    return render_template('vender_dolares.html', dollar_price=dollar_price, saldo=saldo, dolares=dolares)
\ No newline at end of file
+        else:
+            try:
+                # Se vende al precio que se mostró. Los dólares se verifican y se debitan en la misma transacción que acredita los pesos
+                costo_total = registrar_venta_dolares(usuario, cantidad_dolares, precio_operacion())
+                flash(f'Venta realizada con éxito. Vendiste {cantidad_dolares} USD por ${costo_total:.2f} ARS.', 'success')
+            except ValueError as e:
+                flash(f'{e}.', 'error')
+            except TimeoutError:
+                flash(OPERACION_PENDIENTE, 'warning')
+
+    dollar_price, cotizacion = cotizar_dolar()
+    if dollar_price is None:
+        flash('No se pudo obtener el precio del dólar. Inténtelo más tarde.', 'error')
+        return render_template('vender_dolares.html', dollar_price='Error')
+    saldo = obtener_saldo(usuario)
+    dolares = obtener_dolares(usuario)
+    return render_template('vender_dolares.html', dollar_price=dollar_price, cotizacion=cotizacion, saldo=saldo, dolares=dolares)
\ No newline at end of file
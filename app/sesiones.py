@@ -0,0 +1,204 @@
+import secrets
+import threading
+import time
+from datetime import datetime, timezone
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer, URLSafeTimedSerializer
+from sqlalchemy import text
+from werkzeug.datastructures import CallbackDict
+
+_serializador = TaggedJSONSerializer()
+
+
+class AlmacenBase:
+    """
+    Guarda las sesiones en la tabla 'sesiones' de la base de la aplicación, compartida por todos los workers.
+
+    Args:
+        engine(Engine): Motor de SQLAlchemy de la aplicación.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def leer(self, sid, ahora):
+        with self.engine.connect() as conexion:
+            fila = conexion.execute(text('SELECT datos, expira FROM sesiones WHERE id = :id AND expira > :ahora'), {'id':sid, 'ahora':ahora}).fetchone()
+        return (fila.datos, fila.expira) if fila else None
+
+    def guardar(self, sid, datos, usuario, expira):
+        consulta = text('''
+            INSERT INTO sesiones (id, usuario, datos, expira) VALUES (:id, :usuario, :datos, :expira)
+            ON CONFLICT (id) DO UPDATE SET usuario = excluded.usuario, datos = excluded.datos, expira = excluded.expira
+        ''')
+        with self.engine.begin() as conexion:
+            conexion.execute(consulta, {'id':sid, 'usuario':usuario, 'datos':datos, 'expira':expira})
+
+    def borrar(self, sid):
+        with self.engine.begin() as conexion:
+            conexion.execute(text('DELETE FROM sesiones WHERE id = :id'), {'id':sid})
+
+    def purgar(self, ahora):
+        with self.engine.begin() as conexion:
+            return conexion.execute(text('DELETE FROM sesiones WHERE expira <= :ahora'), {'ahora':ahora}).rowcount
+
+
+class AlmacenMemoria:
+    """
+    Guarda las sesiones en memoria. Reemplazo local de AlmacenBase para desarrollo y pruebas con un solo proceso.
+    """
+
+    def __init__(self):
+        self._sesiones = {}
+        self._lock = threading.Lock()
+
+    def leer(self, sid, ahora):
+        with self._lock:
+            fila = self._sesiones.get(sid)
+        return (fila[0], fila[2]) if fila and fila[2] > ahora else None
+
+    def guardar(self, sid, datos, usuario, expira):
+        with self._lock:
+            self._sesiones[sid] = (datos, usuario, expira)
+
+    def borrar(self, sid):
+        with self._lock:
+            self._sesiones.pop(sid, None)
+
+    def purgar(self, ahora):
+        with self._lock:
+            vencidas = [sid for sid, fila in self._sesiones.items() if fila[2] <= ahora]
+            for sid in vencidas:
+                del self._sesiones[sid]
+        return len(vencidas)
+
+
+class SesionServidor(CallbackDict, SessionMixin):
+    """
+    Datos de una sesión guardada en el servidor. La cookie solo lleva su id, firmado.
+
+    Args:
+        datos(dict): Contenido de la sesión.
+        sid(str): Id de la sesión.
+        expira(int): Vencimiento en segundos desde epoch (0 si todavía no se guardó).
+    """
+
+    def __init__(self, datos, sid, expira):
+        def al_modificar(sesion):
+            sesion.modified = True
+
+        super().__init__(datos, al_modificar)
+        self.sid = sid
+        self.expira = expira
+        self.nueva = not expira
+        self.modified = False
+        # Recién pasada al almacén desde una cookie pendiente: la respuesta tiene que llevar la cookie con el id.
+        self.convertida = False
+
+
+class InterfazSesiones(SessionInterface):
+    """
+    Sesiones del lado del servidor: solo se escribe en el almacén cuando la sesión cambia o pasó la mitad
+    de su vida, así las requests que solo leen la sesión no generan escrituras.
+
+    Una sesión nueva no se escribe en el almacén: viaja entera en una cookie firmada (pendiente) hasta que el
+    cliente la devuelve, y recién ahí se guarda. Los clientes que no guardan cookies, como crawlers o health
+    checks, no generan escrituras.
+
+    Args:
+        almacen(AlmacenBase | AlmacenMemoria): Dónde se guardan las sesiones.
+    """
+
+    def __init__(self, almacen):
+        self.almacen = almacen
+
+    def firmante(self, app):
+        return Signer(app.secret_key, salt='sesion-servidor')
+
+    def serializador_pendiente(self, app):
+        return URLSafeTimedSerializer(app.secret_key, salt='sesion-pendiente', serializer=_serializador)
+
+    def open_session(self, app, request):
+        valor = request.cookies.get(self.get_cookie_name(app))
+        if valor:
+            ahora = int(time.time())
+            try:
+                sid = self.firmante(app).unsign(valor).decode()
+            except BadSignature:
+                sid = None
+            fila = self.almacen.leer(sid, ahora) if sid else None
+            if fila:
+                return SesionServidor(_serializador.loads(fila[0]), sid, fila[1])
+            if sid is None:
+                return self._convertir_pendiente(app, valor, ahora) or SesionServidor(None, secrets.token_urlsafe(32), 0)
+        return SesionServidor(None, secrets.token_urlsafe(32), 0)
+
+    def _convertir_pendiente(self, app, valor, ahora):
+        # El cliente devolvió la cookie pendiente: demostró que guarda cookies y la sesión pasa al almacén.
+        # Se guarda antes de atender la request, así el usuario que se crea en ella ya tiene una sesión vigente.
+        vida = int(app.permanent_session_lifetime.total_seconds())
+        try:
+            datos = self.serializador_pendiente(app).loads(valor, max_age=vida)
+        except BadSignature:
+            return None
+        if not isinstance(datos, dict) or not datos:
+            return None
+        sesion = SesionServidor(datos, secrets.token_urlsafe(32), ahora + vida)
+        self.almacen.guardar(sesion.sid, _serializador.dumps(datos), datos.get('usuario_id'), sesion.expira)
+        sesion.convertida = True
+        return sesion
+
+    def save_session(self, app, session, response):
+        if not session:
+            if session.modified and not session.nueva:
+                self.almacen.borrar(session.sid)
+                response.delete_cookie(self.get_cookie_name(app), domain=self.get_cookie_domain(app), path=self.get_cookie_path(app))
+            return
+
+        response.vary.add('Cookie')
+        ahora = int(time.time())
+        vida = int(app.permanent_session_lifetime.total_seconds())
+        if session.nueva:
+            if session.modified:
+                self._guardar_cookie(app, response, self.serializador_pendiente(app).dumps(dict(session)), ahora + vida)
+            return
+        if session.modified or session.expira - ahora < vida / 2:
+            session.expira = ahora + vida
+            self.almacen.guardar(session.sid, _serializador.dumps(dict(session)), session.get('usuario_id'), session.expira)
+        elif not session.convertida:
+            return
+        self._guardar_cookie(app, response, self.firmante(app).sign(session.sid).decode(), session.expira)
+
+    def _guardar_cookie(self, app, response, valor, expira):
+        response.set_cookie(
+            self.get_cookie_name(app),
+            valor,
+            expires=datetime.fromtimestamp(expira, timezone.utc),
+            httponly=self.get_cookie_httponly(app),
+            domain=self.get_cookie_domain(app),
+            path=self.get_cookie_path(app),
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def configurar_sesiones(app, engine):
+    """
+    Reemplaza las sesiones en cookie de Flask por las del almacén configurado en SESION_ALMACEN.
+
+    Args:
+        app(Flask): La aplicación.
+        engine(Engine): Motor de SQLAlchemy de la aplicación.
+    Returns:
+        Esta función no retorna valor.
+    Raises:
+        ValueError: Si el almacén configurado no existe.
+    """
+    almacen = app.config['SESION_ALMACEN']
+    if almacen == 'base':
+        app.session_interface = InterfazSesiones(AlmacenBase(engine))
+    elif almacen == 'memoria':
+        app.session_interface = InterfazSesiones(AlmacenMemoria())
+    elif almacen != 'cookie':
+        raise ValueError(f'Almacén de sesiones desconocido: {almacen}')
@@ -0,0 +1,50 @@
+// Dibuja la proyección del interés compuesto mientras el usuario completa el formulario,
+// consultando /api/interescompuesto en lugar de recargar la página.
+document.addEventListener("DOMContentLoaded", () => {
+    const form = document.getElementById("interesCompuestoForm");
+    const canvas = document.getElementById("graficoProyeccion");
+    const titulo = document.getElementById("proyeccionFinal");
+    if (!form || !canvas) {
+        return;
+    }
+    let espera = null;
+
+    const dibujar = (curva) => {
+        const ctx = canvas.getContext("2d");
+        const maximo = Math.max(...curva) || 1;
+        ctx.clearRect(0, 0, canvas.width, canvas.height);
+        ctx.beginPath();
+        curva.forEach((saldo, mes) => {
+            const x = (mes / Math.max(curva.length - 1, 1)) * canvas.width;
+            const y = canvas.height - (saldo / maximo) * (canvas.height - 10);
+            if (mes === 0) {
+                ctx.moveTo(x, y);
+            } else {
+                ctx.lineTo(x, y);
+            }
+        });
+        ctx.strokeStyle = "#007bff";
+        ctx.lineWidth = 2;
+        ctx.stroke();
+    };
+
+    const proyectar = () => {
+        const datos = Object.fromEntries(new FormData(form));
+        if (!datos.capital || !datos.tasainteres || !datos.tiempo) {
+            return;
+        }
+        fetch("/api/interescompuesto?" + new URLSearchParams(datos))
+            .then((respuesta) => (respuesta.ok ? respuesta.json() : null))
+            .then((proyeccion) => {
+                if (proyeccion) {
+                    titulo.textContent = `Proyección: $${proyeccion.capitalfinal} (aportado $${proyeccion.aportado})`;
+                    dibujar(proyeccion.curva);
+                }
+            });
+    };
+
+    form.addEventListener("input", () => {
+        clearTimeout(espera);
+        espera = setTimeout(proyectar, 250);
+    });
+});
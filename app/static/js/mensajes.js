@@ -15,6 +15,12 @@ document.addEventListener("DOMContentLoaded", () => {
                     title: message,
                     showConfirmButton: true,
                 });
+            } else if (category === "warning") {
+                Swal.fire({
+                    icon: "warning",
+                    title: message,
+                    showConfirmButton: true,
+                });
             }
         });
     }
@@ -0,0 +1,211 @@
+import logging
+import os
+import threading
+import time
+import click
+from sqlalchemy import bindparam, text
+from app import app, db
+from app.archivo import guardar_bloque
+from app.basedatos import nombre_dialecto, para_actualizar
+from app.dinero import Dinero
+from app.idempotencia import purgar_claves_vencidas
+from app.reportes import acumular
+from app.sesiones import AlmacenBase
+
+logger = logging.getLogger(__name__)
+
+# Saldo con el que empieza cada usuario temporal.
+SALDO_INICIAL = Dinero.desde(1000000)
+
+
+def crear_usuarios(conexion, usuarios):
+    """
+    Crea usuarios temporales con el saldo inicial y su movimiento de 'apertura', en una sola transacción.
+
+    Los que ya existen se ignoran, así dos workers pueden aprovisionar el mismo usuario sin duplicarlo.
+
+    Args:
+        conexion(Connection): Conexión sin transacción en curso.
+        usuarios(list): IDs (uuid) de los usuarios.
+    Returns:
+        Esta función no retorna valor.
+    """
+    if nombre_dialecto(conexion) == 'sqlite':
+        conexion.exec_driver_sql('BEGIN IMMEDIATE')
+    conexion.execute(
+        text('INSERT INTO "user" ("user", saldo, dolares) VALUES (:usuario, :saldo, 0) ON CONFLICT ("user") DO NOTHING'),
+        [{'usuario':usuario, 'saldo':SALDO_INICIAL.centavos} for usuario in usuarios],
+    )
+    creados = conexion.execute(text('''
+        INSERT INTO movimientos (id_usuario, moneda, monto, tipo, fecha)
+        SELECT id, 'ARS', saldo, 'apertura', CURRENT_TIMESTAMP FROM "user" u
+        WHERE "user" IN :usuarios AND NOT EXISTS (SELECT 1 FROM movimientos m WHERE m.id_usuario = u.id)
+        ORDER BY id
+    ''').bindparams(bindparam('usuarios', expanding=True)), {'usuarios':usuarios}).rowcount
+    acumular(conexion, [('cuentas', 'ARS', creados, 0), ('depositos', 'ARS', 0, creados * SALDO_INICIAL.centavos)])
+    conexion.commit()
+
+
+class Aprovisionador:
+    """
+    Crea los usuarios pendientes juntando en una transacción los pedidos que llegan casi a la vez.
+
+    Cada request que necesita su usuario deja el pedido y espera; un hilo del proceso toma los pedidos
+    acumulados cada `espera` segundos (como máximo `maximo` por vez) y los crea con `crear_usuarios`.
+
+    Args:
+        espera(float): Segundos que se esperan para juntar pedidos antes de escribir.
+        maximo(int): Usuarios por transacción.
+        timeout(float): Segundos que una request espera su usuario antes de rendirse.
+    """
+
+    def __init__(self, espera=0.005, maximo=500, timeout=30):
+        self.espera = espera
+        self.maximo = maximo
+        self.timeout = timeout
+        self._pendientes = []
+        self._condicion = threading.Condition()
+        self._pid = None
+
+    def aprovisionar(self, usuario):
+        """
+        Crea el usuario si todavía no existe y espera a que quede confirmado.
+
+        Args:
+            usuario(str): ID (uuid) del usuario.
+        Returns:
+            Esta función no retorna valor.
+        Raises:
+            TimeoutError: Si el lote no se escribió a tiempo.
+            Exception: El error de la base, si falló la transacción del lote.
+        """
+        pedido = {'usuario':usuario, 'listo':threading.Event(), 'error':None}
+        with self._condicion:
+            # Los hilos no sobreviven al fork de gunicorn, por eso se arranca uno por proceso.
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pendientes = []
+                threading.Thread(target=self._procesar, daemon=True, name='aprovisionador').start()
+            self._pendientes.append(pedido)
+            self._condicion.notify()
+        if not pedido['listo'].wait(self.timeout):
+            raise TimeoutError('No se pudo crear el usuario a tiempo')
+        if pedido['error'] is not None:
+            raise pedido['error']
+
+    def _procesar(self):
+        while True:
+            with self._condicion:
+                while not self._pendientes:
+                    self._condicion.wait()
+            time.sleep(self.espera)
+            with self._condicion:
+                lote = self._pendientes[:self.maximo]
+                del self._pendientes[:self.maximo]
+            try:
+                with app.app_context(), db.engine.connect() as conexion:
+                    crear_usuarios(conexion, list({pedido['usuario'] for pedido in lote}))
+            except Exception as e:
+                logger.warning('No se pudo crear un lote de %d usuarios.', len(lote), exc_info=True)
+                for pedido in lote:
+                    pedido['error'] = e
+            finally:
+                for pedido in lote:
+                    pedido['listo'].set()
+
+
+aprovisionador = Aprovisionador(app.config['APROVISIONAMIENTO_ESPERA_MS'] / 1000, app.config['APROVISIONAMIENTO_LOTE'])
+
+
+def limpiar_usuarios_temporales(lote=1000):
+    """
+    Borra las sesiones vencidas y los usuarios temporales que ya no tienen una sesión vigente.
+
+    Solo se borran usuarios sin transferencias ni préstamos en las tablas: los que operaron con otros son parte
+    del historial de esos otros y se conservan hasta que ese historial se archiva (ver `app.archivo`). Con cada
+    usuario se borran sus movimientos, instantáneas, tenencias y resumen archivado; la cuenta y sus tenencias
+    quedan en un bloque del archivo.
+    Los usuarios en uso solo se conocen con las sesiones en la base (SESION_ALMACEN='base'); con otro
+    almacén no se borra ningún usuario.
+
+    Args:
+        lote(int): Usuarios que se borran por transacción.
+    Returns:
+        tuple: (sesiones borradas, usuarios borrados).
+    """
+    almacen = getattr(app.session_interface, 'almacen', None)
+    sesiones = almacen.purgar(int(time.time())) if almacen else 0
+    if not isinstance(almacen, AlmacenBase):
+        return sesiones, 0
+
+    borrados = 0
+    with db.engine.connect() as conexion:
+        candidatos = text('''
+            SELECT id FROM "user" u
+            WHERE NOT EXISTS (SELECT 1 FROM sesiones s WHERE s.usuario = u."user")
+              AND NOT EXISTS (SELECT 1 FROM transferencias t WHERE t.id_usuario_remitente = u.id)
+              AND NOT EXISTS (SELECT 1 FROM transferencias t WHERE t.id_usuario_beneficiario = u.id)
+              AND NOT EXISTS (SELECT 1 FROM prestamos p WHERE p.id_usuario = u.id)
+            ORDER BY id LIMIT :lote
+        ''' + para_actualizar(conexion))
+        while True:
+            if nombre_dialecto(conexion) == 'sqlite':
+                conexion.exec_driver_sql('BEGIN IMMEDIATE')
+            ids = conexion.execute(candidatos, {'lote':lote}).scalars().all()
+            if ids:
+                # Lo que tenían los usuarios borrados deja de contarse en los depósitos del banco.
+                por_id = bindparam('ids', expanding=True)
+                cuentas = conexion.execute(text('SELECT id, "user", saldo, dolares FROM "user" WHERE id IN :ids ORDER BY id').bindparams(por_id), {'ids':ids}).fetchall()
+                tenencias = conexion.execute(text('SELECT id_usuario, moneda, cantidad FROM tenencias WHERE id_usuario IN :ids ORDER BY id_usuario, moneda').bindparams(por_id), {'ids':ids}).fetchall()
+                depositos = {'ARS':sum(c.saldo for c in cuentas), 'USD':sum(c.dolares for c in cuentas)}
+                for tenencia in tenencias:
+                    depositos[tenencia.moneda] = depositos.get(tenencia.moneda, 0) + tenencia.cantidad
+                acumular(conexion, [('cuentas', 'ARS', -len(ids), 0)] + [('depositos', moneda, 0, -monto) for moneda, monto in depositos.items()])
+                guardar_bloque(conexion, 'usuarios', {
+                    'usuarios':{'id':[c.id for c in cuentas], 'user':[c.user for c in cuentas], 'saldo':[c.saldo for c in cuentas], 'dolares':[c.dolares for c in cuentas]},
+                    'tenencias':{'id_usuario':[t.id_usuario for t in tenencias], 'moneda':[t.moneda for t in tenencias], 'cantidad':[t.cantidad for t in tenencias]},
+                }, {'cantidad':len(ids), 'depositos':depositos}, ids[0], ids[-1])
+                for tabla, columna in (('tenencias', 'id_usuario'), ('saldos_instantanea', 'id_usuario'), ('movimientos', 'id_usuario'), ('resumen_archivo', 'id_usuario'), ('"user"', 'id')):
+                    conexion.execute(text(f'DELETE FROM {tabla} WHERE {columna} IN :ids').bindparams(bindparam('ids', expanding=True)), {'ids':ids})
+            conexion.commit()
+            borrados += len(ids)
+            if len(ids) < lote:
+                break
+    return sesiones, borrados
+
+
+_pid_limpieza = None
+_lock_limpieza = threading.Lock()
+
+
+def _limpiar_periodicamente(intervalo):
+    while True:
+        time.sleep(intervalo)
+        try:
+            with app.app_context():
+                limpiar_usuarios_temporales()
+                purgar_claves_vencidas()
+        except Exception:
+            logger.warning('No se pudieron limpiar los usuarios temporales.', exc_info=True)
+
+
+@app.before_request
+def iniciar_limpieza():
+    # Un hilo de limpieza por proceso, arrancado con la primera request (los hilos no sobreviven al fork).
+    global _pid_limpieza
+    intervalo = app.config['SESIONES_LIMPIEZA_INTERVALO']
+    if not intervalo or _pid_limpieza == os.getpid():
+        return
+    with _lock_limpieza:
+        if _pid_limpieza != os.getpid():
+            _pid_limpieza = os.getpid()
+            threading.Thread(target=_limpiar_periodicamente, args=(intervalo,), daemon=True, name='limpieza-usuarios').start()
+
+
+@app.cli.command('limpiar-usuarios')
+@click.option('--lote', default=1000, show_default=True, help='Usuarios borrados por transacción.')
+def limpiar_usuarios_comando(lote):
+    """Borra las sesiones vencidas y los usuarios temporales sin sesión ni operaciones."""
+    sesiones, usuarios = limpiar_usuarios_temporales(lote)
+    claves = purgar_claves_vencidas()
+    print(f'Sesiones vencidas borradas: {sesiones}. Usuarios temporales borrados: {usuarios}. Claves de idempotencia vencidas: {claves}.')
@@ -1,3 +1,10 @@
-from app import app
+from app import crear_app
 
-app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+app = crear_app()
+
+if __name__ == '__main__':
+    # Servidor de desarrollo. En producción el esquema lo migra gunicorn.conf.py antes de crear los workers.
+    from app.migraciones import migrar
+    with app.app_context():
+        migrar()
+    app.run(host='0.0.0.0', port=5000)
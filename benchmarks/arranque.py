@@ -0,0 +1,176 @@
+"""
+Mide cuánto tarda en arrancar la aplicación: lo que paga cada worker nuevo de gunicorn y cada instancia
+que se levanta al escalar.
+
+Cada repetición corre en un intérprete nuevo y toma por separado:
+    - importar: `import app` (crea `app` y `db`, sin rutas ni conexiones).
+    - crear_app: carga de rutas, comandos y hooks de todos los módulos (ver `crear_app` en app/__init__.py).
+    - migrar: verificación del esquema ya actualizado, que ahora corre una vez en el maestro y no por worker.
+    - primera_request: la primera request de un proceso que cargó la aplicación por su cuenta.
+    - fork_request: fork de un proceso con la aplicación cargada hasta que el hijo responde su primera
+      request; es lo que tarda un worker con preload_app.
+    - proceso: el intérprete completo, de afuera, incluida la carga de Python.
+
+Con --gunicorn además levanta gunicorn con y sin precarga y mide, desde los hooks de cada worker
+(benchmarks/gunicorn_arranque.conf.py), cuánto tarda un worker desde el fork hasta quedar listo y cuánto
+pasa desde el arranque hasta que están listos todos.
+
+Uso:
+    python benchmarks/arranque.py [--repeticiones N] [--base URL] [--gunicorn] [--workers N]
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUTA = '/api/interescompuesto?capital=1000&tasainteres=10&tiempo=12'
+FASES = ('importar', 'crear_app', 'migrar', 'primera_request', 'fork_request', 'proceso')
+
+# Se ejecuta en un intérprete nuevo por repetición e imprime los tiempos en segundos como JSON.
+_MEDICION = f'''
+import json, os, sys, time
+inicio = time.perf_counter()
+import app as paquete
+importado = time.perf_counter()
+aplicacion = paquete.crear_app()
+creada = time.perf_counter()
+from app import db
+from app.migraciones import migrar
+with aplicacion.app_context():
+    migrar()
+    db.engine.dispose()
+migrado = time.perf_counter()
+tiempos = {{'importar':importado - inicio, 'crear_app':creada - importado, 'migrar':migrado - creada}}
+if hasattr(os, 'fork'):
+    lectura, escritura = os.pipe()
+    antes = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        aplicacion.test_client().get({RUTA!r})
+        os.write(escritura, b'.')
+        os._exit(0)
+    os.read(lectura, 1)
+    tiempos['fork_request'] = time.perf_counter() - antes
+    os.waitpid(pid, 0)
+antes = time.perf_counter()
+respuesta = aplicacion.test_client().get({RUTA!r})
+tiempos['primera_request'] = time.perf_counter() - antes
+assert respuesta.status_code == 200, respuesta.status_code
+tiempos['requests_importado'] = 'requests' in sys.modules
+print(json.dumps(tiempos))
+'''
+
+
+def medir_proceso(entorno):
+    """
+    Arranca la aplicación en un intérprete nuevo y devuelve los tiempos de cada fase, en segundos.
+
+    Args:
+        entorno(dict): Variables de entorno del proceso.
+    Returns:
+        dict: Segundos por fase, más 'requests_importado'.
+    """
+    inicio = time.perf_counter()
+    salida = subprocess.run([sys.executable, '-c', _MEDICION], cwd=RAIZ, env=entorno, capture_output=True, text=True)
+    if salida.returncode:
+        raise SystemExit(f'La medición falló:\n{salida.stderr}')
+    tiempos = json.loads(salida.stdout.strip().splitlines()[-1])
+    tiempos['proceso'] = time.perf_counter() - inicio
+    return tiempos
+
+
+def medir_gunicorn(entorno, workers, precarga):
+    """
+    Levanta gunicorn y espera a que todos sus workers terminen de arrancar.
+
+    Args:
+        entorno(dict): Variables de entorno del proceso.
+        workers(int): Procesos de gunicorn.
+        precarga(bool): Si se precarga la aplicación en el maestro (GUNICORN_PRELOAD).
+    Returns:
+        dict: 'worker_ms' (mediana desde el fork hasta que el worker queda listo) y 'listos_ms' (desde
+            que se lanza gunicorn hasta que están listos todos los workers).
+    """
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        puerto = s.getsockname()[1]
+    with tempfile.TemporaryDirectory() as directorio:
+        registro = os.path.join(directorio, 'workers.log')
+        entorno = dict(entorno, PORT=str(puerto), WEB_CONCURRENCY=str(workers), GUNICORN_WORKER_CLASS='gthread',
+                       GUNICORN_PRELOAD='1' if precarga else '0', BENCHMARK_ARRANQUE_REGISTRO=registro)
+        inicio = time.time()
+        proceso = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', os.path.join(RAIZ, 'benchmarks', 'gunicorn_arranque.conf.py'), 'banco:app'],
+            cwd=RAIZ, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        try:
+            listos = []
+            for _ in range(1200):
+                if os.path.exists(registro):
+                    with open(registro, encoding='utf-8') as archivo:
+                        listos = [tuple(map(float, linea.split())) for linea in archivo if linea.strip()]
+                if len(listos) >= workers:
+                    break
+                if proceso.poll() is not None:
+                    raise SystemExit(f'gunicorn terminó al arrancar:\n{proceso.stderr.read().decode()}')
+                time.sleep(0.05)
+            else:
+                raise SystemExit('Los workers de gunicorn no terminaron de arrancar.')
+        finally:
+            proceso.terminate()
+            proceso.wait()
+    return {
+        'worker_ms':statistics.median(listo - fork for fork, listo in listos) * 1000,
+        'listos_ms':(max(listo for _, listo in listos) - inicio) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--base', help='URL de la base. Por defecto, un SQLite temporal.')
+    parser.add_argument('--gunicorn', action='store_true', help='Medir también el arranque de los workers de gunicorn.')
+    parser.add_argument('--workers', type=int, default=4, help='Procesos de gunicorn.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        entorno = dict(
+            os.environ,
+            DATABASE_URL=args.base or f"sqlite:///{os.path.join(directorio, 'bench.db')}",
+            COTIZACION_FUENTE='fija',
+            SESIONES_LIMPIEZA_INTERVALO='0',
+            PYTHONPATH=RAIZ,
+        )
+        # La primera corrida crea el esquema y calienta los .pyc: no se cuenta.
+        medir_proceso(entorno)
+        corridas = [medir_proceso(entorno) for _ in range(args.repeticiones)]
+
+        print(f'{args.repeticiones} repeticiones, Python {sys.version.split()[0]}')
+        print(f"{'fase':>16} {'mediana ms':>11} {'mín ms':>8} {'máx ms':>8}")
+        for fase in FASES:
+            valores = [corrida[fase] * 1000 for corrida in corridas if fase in corrida]
+            if valores:
+                print(f'{fase:>16} {statistics.median(valores):>11.1f} {min(valores):>8.1f} {max(valores):>8.1f}')
+        sin_precarga = statistics.median(c['importar'] + c['crear_app'] + c['primera_request'] for c in corridas) * 1000
+        print(f'\nWorker sin precarga (importar + crear_app + primera_request): {sin_precarga:.1f} ms')
+        if all('fork_request' in corrida for corrida in corridas):
+            print(f"Worker con precarga (fork_request): {statistics.median(c['fork_request'] for c in corridas) * 1000:.1f} ms")
+        if any(corrida['requests_importado'] for corrida in corridas):
+            print('Atención: `requests` se importó al arrancar con la fuente de cotizaciones fija.')
+
+        if args.gunicorn:
+            print(f"\n{'gunicorn':>16} {'worker ms':>10} {'todos listos ms':>16}")
+            for precarga in (False, True):
+                resultado = medir_gunicorn(entorno, args.workers, precarga)
+                nombre = 'con precarga' if precarga else 'sin precarga'
+                print(f"{nombre:>16} {resultado['worker_ms']:>10.1f} {resultado['listos_ms']:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
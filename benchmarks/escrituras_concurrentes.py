@@ -0,0 +1,144 @@
+"""
+Compara el rendimiento de escrituras concurrentes entre el perfil 'default' de SQLite, el perfil
+'produccion' de app/basedatos.py (WAL, synchronous=NORMAL, busy timeout, pool) y el perfil 'produccion'
+con el escritor agrupado de app/escritor.py (ESCRITOR_AGRUPADO=1).
+
+Cada proceso simula un worker de gunicorn con varios hilos que hacen transferencias con
+`realizar_transferencia` sobre una base temporal, mientras otro proceso lee historiales como lo haría /home.
+
+Uso:
+    python benchmarks/escrituras_concurrentes.py [procesos] [transferencias_por_proceso] [hilos_por_proceso]
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+USUARIOS = 200
+
+
+# (nombre, DB_PERFIL, ESCRITOR_AGRUPADO)
+CONFIGURACIONES = (
+    ('default', 'default', '0'),
+    ('default agrupado', 'default', '1'),
+    ('produccion', 'produccion', '0'),
+    ('produccion agrupado', 'produccion', '1'),
+)
+
+
+def _preparar_entorno(ruta, perfil, agrupado='0'):
+    os.environ['DATABASE_URL'] = f'sqlite:///{ruta}'
+    os.environ['DB_PERFIL'] = perfil
+    os.environ['ESCRITOR_AGRUPADO'] = agrupado
+    os.environ['SESIONES_LIMPIEZA_INTERVALO'] = '0'
+    os.environ['COTIZACION_FUENTE'] = 'fija'
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def sembrar(ruta, perfil):
+    _preparar_entorno(ruta, perfil)
+    import uuid
+    from sqlalchemy import text
+    from app import crear_app, db
+    from app.migraciones import migrar
+    app = crear_app()
+    usuarios = [str(uuid.uuid4()) for _ in range(USUARIOS)]
+    with app.app_context():
+        migrar()
+        db.session.execute(text('INSERT INTO "user" ("user", saldo, dolares) VALUES (:user, 100000000, 0)'), [{'user':u} for u in usuarios])
+        db.session.commit()
+    return usuarios
+
+
+def escritor(ruta, perfil, agrupado, usuarios, cantidad, hilos, semilla, listos, resultados):
+    _preparar_entorno(ruta, perfil, agrupado)
+    import random
+    from app import crear_app
+    from app.funciones import realizar_transferencia
+    app = crear_app()
+    contadores = {'realizadas':0, 'errores':0}
+    lock = threading.Lock()
+
+    def transferir(semilla_hilo, cantidad_hilo):
+        aleatorio = random.Random(semilla_hilo)
+        for _ in range(cantidad_hilo):
+            remitente, beneficiario = aleatorio.sample(usuarios, 2)
+            with app.test_request_context():
+                try:
+                    realizar_transferencia(beneficiario, remitente, 1)
+                    resultado = 'realizadas'
+                except Exception:
+                    resultado = 'errores'
+            with lock:
+                contadores[resultado] += 1
+
+    trabajadores = [threading.Thread(target=transferir, args=(semilla * hilos + i, cantidad // hilos)) for i in range(hilos)]
+    listos.wait()  # Se mide desde que todos los procesos terminaron de importar la aplicación.
+    inicio = time.perf_counter()
+    for trabajador in trabajadores:
+        trabajador.start()
+    for trabajador in trabajadores:
+        trabajador.join()
+    resultados.put((contadores['realizadas'], contadores['errores'], time.perf_counter() - inicio))
+
+
+def lector(ruta, perfil, usuarios, fin):
+    _preparar_entorno(ruta, perfil)
+    from app import crear_app
+    from app.funciones import obtener_transferencias_usuario
+    app = crear_app()
+    i = 0
+    while not fin.is_set():
+        with app.test_request_context():
+            try:
+                obtener_transferencias_usuario(usuarios[i % len(usuarios)])
+            except Exception:
+                pass
+        i += 1
+
+
+def medir(perfil, agrupado, procesos, cantidad, hilos):
+    contexto = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, 'bench.db')
+        with contexto.Pool(1) as pool:
+            usuarios = pool.apply(sembrar, (ruta, perfil))
+
+        resultados = contexto.Queue()
+        fin = contexto.Event()
+        listos = contexto.Barrier(procesos)
+        lectura = contexto.Process(target=lector, args=(ruta, perfil, usuarios, fin))
+        escritores = [
+            contexto.Process(target=escritor, args=(ruta, perfil, agrupado, usuarios, cantidad, hilos, i, listos, resultados))
+            for i in range(procesos)
+        ]
+        lectura.start()
+        for proceso in escritores:
+            proceso.start()
+        totales = [resultados.get() for _ in escritores]
+        duracion = max(d for _, _, d in totales)
+        for proceso in escritores:
+            proceso.join()
+        fin.set()
+        lectura.join()
+
+    realizadas = sum(r for r, _, _ in totales)
+    errores = sum(e for _, e, _ in totales)
+    return realizadas, errores, duracion
+
+
+def main():
+    procesos = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    cantidad = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    hilos = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    print(f'{procesos} procesos x {hilos} hilos, {cantidad} transferencias por proceso')
+    print(f"{'perfil':>20} {'realizadas':>11} {'errores':>8} {'segundos':>9} {'transf/s':>9}")
+    for nombre, perfil, agrupado in CONFIGURACIONES:
+        realizadas, errores, duracion = medir(perfil, agrupado, procesos, cantidad, hilos)
+        print(f'{nombre:>20} {realizadas:>11} {errores:>8} {duracion:>9.2f} {realizadas / duracion:>9.0f}')
+
+
+if __name__ == '__main__':
+    main()
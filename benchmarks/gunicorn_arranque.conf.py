@@ -0,0 +1,23 @@
+"""
+Configuración de gunicorn para benchmarks/arranque.py: la del proyecto más el registro de cuándo arranca
+cada worker y cuándo queda listo, en el archivo de BENCHMARK_ARRANQUE_REGISTRO.
+"""
+import os
+import time
+
+_RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+with open(os.path.join(_RAIZ, 'gunicorn.conf.py'), encoding='utf-8') as _archivo:
+    exec(compile(_archivo.read(), 'gunicorn.conf.py', 'exec'))
+
+accesslog = None
+_post_fork_proyecto = post_fork
+
+
+def post_fork(server, worker):
+    worker.inicio_arranque = time.time()
+    _post_fork_proyecto(server, worker)
+
+
+def post_worker_init(worker):
+    with open(os.environ['BENCHMARK_ARRANQUE_REGISTRO'], 'a', encoding='utf-8') as archivo:
+        archivo.write(f'{worker.inicio_arranque} {time.time()}\n')
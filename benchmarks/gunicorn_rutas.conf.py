@@ -0,0 +1,18 @@
+"""
+Configuración de gunicorn para benchmarks/rutas.py: la del proyecto más la medición del tiempo de base de datos.
+"""
+import os
+import sys
+
+_RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+with open(os.path.join(_RAIZ, 'gunicorn.conf.py'), encoding='utf-8') as _archivo:
+    exec(compile(_archivo.read(), 'gunicorn.conf.py', 'exec'))
+
+accesslog = None
+
+
+def post_worker_init(worker):
+    sys.path.insert(0, os.path.join(_RAIZ, 'benchmarks'))
+    from rutas import instrumentar
+    from app import app, db
+    instrumentar(app, db)
@@ -0,0 +1,97 @@
+"""
+Mide la consulta del historial de transferencias a medida que crece la tabla 'transferencias',
+con y sin los índices de la migración 3 (app/migraciones.py).
+
+Uso:
+    python benchmarks/historial.py [tamaño ...]
+
+Por defecto usa 10.000, 100.000 y 1.000.000 de transferencias. Cada usuario medido tiene siempre
+las mismas 50 transferencias, así que con índices el tiempo debería mantenerse plano.
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+
+USUARIOS = 10000
+TRANSFERENCIAS_POR_USUARIO_MEDIDO = 50
+REPETICIONES = 200
+
+ESQUEMA = '''
+    CREATE TABLE user (id INTEGER NOT NULL PRIMARY KEY, user VARCHAR(120) NOT NULL UNIQUE, saldo INTEGER, dolares INTEGER NOT NULL);
+    CREATE TABLE transferencias (
+        id INTEGER NOT NULL PRIMARY KEY,
+        id_usuario_remitente INTEGER NOT NULL REFERENCES user (id),
+        id_usuario_beneficiario INTEGER NOT NULL REFERENCES user (id),
+        transaccion INTEGER NOT NULL
+    );
+'''
+
+INDICES = '''
+    CREATE INDEX ix_transferencias_remitente ON transferencias (id_usuario_remitente, id, id_usuario_beneficiario, transaccion);
+    CREATE INDEX ix_transferencias_beneficiario ON transferencias (id_usuario_beneficiario, id, id_usuario_remitente, transaccion);
+'''
+
+# La misma consulta que obtener_transferencias_usuario en app/funciones.py.
+HISTORIAL = '''
+    SELECT u.user AS remitente, u_b.user AS beneficiario, t.transaccion
+    FROM transferencias t
+    INNER JOIN user u ON t.id_usuario_remitente = u.id
+    INNER JOIN user u_b ON t.id_usuario_beneficiario = u_b.id
+    WHERE u.user = :usuario
+    UNION ALL
+    SELECT u_b.user AS remitente, u.user AS beneficiario, t.transaccion
+    FROM transferencias t
+    INNER JOIN user u ON t.id_usuario_beneficiario = u.id
+    INNER JOIN user u_b ON t.id_usuario_remitente = u_b.id
+    WHERE u.user = :usuario
+'''
+
+
+def poblar(conexion, tamano):
+    usuarios = [(i, str(uuid.uuid4()), 1000000, 0) for i in range(1, USUARIOS + 1)]
+    conexion.executemany('INSERT INTO user VALUES (?, ?, ?, ?)', usuarios)
+
+    # Los usuarios 1 a 10 son los medidos: tienen una cantidad fija de transferencias.
+    # El resto de la tabla se reparte entre los demás.
+    aleatorio = random.Random(0)
+    medidos = [(1 + i % 10, aleatorio.randint(11, USUARIOS), 1) for i in range(10 * TRANSFERENCIAS_POR_USUARIO_MEDIDO)]
+    resto = ((aleatorio.randint(11, USUARIOS), aleatorio.randint(11, USUARIOS), aleatorio.randint(1, 1000))
+             for _ in range(tamano - len(medidos)))
+    conexion.executemany('INSERT INTO transferencias (id_usuario_remitente, id_usuario_beneficiario, transaccion) VALUES (?, ?, ?)', resto)
+    conexion.executemany('INSERT INTO transferencias (id_usuario_remitente, id_usuario_beneficiario, transaccion) VALUES (?, ?, ?)', medidos)
+    conexion.commit()
+    return [u[1] for u in usuarios[:10]]
+
+
+def medir(conexion, usuarios):
+    # Sin índices, a gran escala, alcanza con las muestras que entren en dos segundos.
+    inicio = time.perf_counter()
+    for i in range(REPETICIONES):
+        filas = conexion.execute(HISTORIAL, {'usuario':usuarios[i % len(usuarios)]}).fetchall()
+        assert len(filas) == TRANSFERENCIAS_POR_USUARIO_MEDIDO
+        if time.perf_counter() - inicio > 2:
+            break
+    return (time.perf_counter() - inicio) / (i + 1) * 1000
+
+
+def main():
+    tamanos = [int(t) for t in sys.argv[1:]] or [10000, 100000, 1000000]
+    print(f"{'transferencias':>15} {'sin índices (ms)':>18} {'con índices (ms)':>18}")
+    for tamano in tamanos:
+        with tempfile.TemporaryDirectory() as directorio:
+            conexion = sqlite3.connect(os.path.join(directorio, 'bench.db'))
+            conexion.executescript(ESQUEMA)
+            usuarios = poblar(conexion, tamano)
+            sin_indices = medir(conexion, usuarios)
+            conexion.executescript(INDICES)
+            con_indices = medir(conexion, usuarios)
+            conexion.close()
+        print(f'{tamano:>15,} {sin_indices:>18.3f} {con_indices:>18.3f}')
+
+
+if __name__ == '__main__':
+    main()
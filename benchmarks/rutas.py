@@ -0,0 +1,437 @@
+"""
+Mide latencia (p50/p95/p99), throughput y tiempo de base de datos de cada ruta de app/routes.py.
+
+Siembra una base temporal (o la indicada con --base, que debe estar vacía) con usuarios, transferencias
+y préstamos sintéticos, levanta un servidor local que imita la API de cotizaciones y maneja la aplicación
+con el cliente de pruebas de Flask o con un gunicorn lanzado localmente (benchmarks/gunicorn_rutas.conf.py).
+El tiempo de base de datos lo informa la propia aplicación en el encabezado X-Tiempo-DB-ms, que agrega
+`instrumentar` solo durante la medición; en las respuestas que se generan de a partes (la exportación) solo
+cuenta las consultas anteriores al primer fragmento.
+
+Los resultados se pueden guardar como línea base en JSON y comparar contra una anterior: con --comparar,
+el script termina con código 1 si el p95 de alguna ruta empeoró más que la tolerancia.
+
+Uso:
+    python benchmarks/rutas.py [--usuarios N] [--transferencias N] [--prestamos N]
+                               [--driver cliente|gunicorn] [--concurrencia N] [--solicitudes N]
+                               [--rutas home,transferencia,...] [--base URL]
+                               [--guardar base.json] [--comparar base.json] [--tolerancia 0.2]
+
+Ejemplo a gran escala:
+    python benchmarks/rutas.py --usuarios 100000 --transferencias 10000000 --prestamos 1000000
+"""
+import argparse
+import contextlib
+import http.server
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLAVE_SESION = 'benchmark-rutas'
+USUARIOS_MEDIDOS = 50
+BLOQUE_SIEMBRA = 20000
+SALDO_INICIAL_CENTAVOS = 10 ** 12
+PRECIO_DOLAR = 1000.0
+
+
+# Cada escenario: (método, ruta, datos del formulario o JSON, usa la sesión de un usuario sembrado).
+# Los datos pueden depender del usuario medido: 'usuario', 'beneficiario' y 'prestamo'.
+def _escenarios():
+    return {
+        'alta_usuario': ('GET', '/', None, False),
+        'home': ('GET', '/home', None, True),
+        'home_pagina': ('GET', '/home?antes_de={antes_de}', None, True),
+        'exportar_csv': ('GET', '/home/exportar', None, True),
+        'transferencia_form': ('GET', '/transferencia', None, True),
+        'transferencia': ('POST', '/transferencia', {'montotransferencia':'1.50', 'ID':'{beneficiario}'}, True),
+        'transferencia_lote': ('POST', '/transferencia/lote', {'json':[['{beneficiario}', '1.00']] * 20}, True),
+        'interescompuesto': ('POST', '/interescompuesto', {'capital':'1000', 'tasainteres':'10', 'tiempo':'10', 'aportemensual':'100'}, True),
+        'api_interescompuesto': ('GET', '/api/interescompuesto?capital=1000&tasainteres=10&tiempo=10', None, False),
+        'prestamo': ('POST', '/prestamo', {'montoprestamo':'100000', 'tasaprestamo':'45', 'plazoprestamo':'24', 'sistema':'frances'}, True),
+        'solicitar_prestamo': ('POST', '/solicitar_prestamo', {'monto':'1000', 'tasa':'45', 'plazo':'12', 'sistema':'frances'}, True),
+        'misprestamos': ('GET', '/misprestamos', None, True),
+        'prestamo_detalle': ('GET', '/misprestamos/prestamo_detalle?prestamo_id={prestamo}', None, True),
+        'pagar_cuota': ('POST', '/misprestamos/pagar_cuota', {'prestamo_id':'{prestamo}'}, True),
+        'comprardolares': ('GET', '/comprardolares', None, True),
+        'comprar_dolares': ('POST', '/comprar_dolares', {'cantidad_dolares':'1'}, True),
+        'vender_dolares': ('POST', '/vender_dolares', {'cantidad_dolares':'0.5'}, True),
+    }
+
+
+def instrumentar(app, db):
+    """
+    Suma el tiempo de las consultas SQL de cada request y lo devuelve en el encabezado X-Tiempo-DB-ms.
+
+    Args:
+        app(Flask): La aplicación.
+        db(SQLAlchemy): La extensión de base de datos de la aplicación.
+    Returns:
+        Esta función no retorna valor.
+    """
+    from flask import g, has_app_context
+    from sqlalchemy import event
+
+    with app.app_context():
+        motor = db.engine
+
+    @event.listens_for(motor, 'before_cursor_execute')
+    def antes(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('inicios', []).append(time.perf_counter())
+
+    @event.listens_for(motor, 'after_cursor_execute')
+    def despues(conn, cursor, statement, parameters, context, executemany):
+        duracion = time.perf_counter() - conn.info['inicios'].pop()
+        if has_app_context():
+            g.tiempo_db = g.get('tiempo_db', 0.0) + duracion
+
+    @app.after_request
+    def informar(response):
+        response.headers['X-Tiempo-DB-ms'] = f"{g.get('tiempo_db', 0.0) * 1000:.3f}"
+        return response
+
+
+class _Cotizaciones(http.server.BaseHTTPRequestHandler):
+    demora = 0.0
+
+    def do_GET(self):
+        time.sleep(self.demora)
+        cuerpo = json.dumps({'base':'USD', 'rates':{'USD':1.0, 'ARS':PRECIO_DOLAR}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def servidor_cotizaciones(demora):
+    """Levanta una API de cotizaciones local con el formato de exchangerate-api."""
+    manejador = type('Cotizaciones', (_Cotizaciones,), {'demora':demora})
+    servidor = http.server.ThreadingHTTPServer(('127.0.0.1', 0), manejador)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    try:
+        yield f'http://127.0.0.1:{servidor.server_address[1]}/latest/USD'
+    finally:
+        servidor.shutdown()
+
+
+def _uuid(aleatorio):
+    return str(uuid.UUID(int=aleatorio.getrandbits(128), version=4))
+
+
+def sembrar(usuarios, transferencias, prestamos, semilla=0):
+    """
+    Carga datos sintéticos por bloques, sin tener toda la tabla en memoria.
+
+    Los primeros USUARIOS_MEDIDOS usuarios son los que usan los escenarios: cada uno tiene al menos un préstamo.
+
+    Returns:
+        list: Diccionarios con 'usuario', 'beneficiario', 'prestamo' y 'antes_de' para cada usuario medido.
+    """
+    from sqlalchemy import text
+    from app import app, db
+    from app.migraciones import migrar
+
+    aleatorio = random.Random(semilla)
+    nombres = []
+    with app.app_context():
+        migrar()
+    with app.app_context(), db.engine.connect() as conexion:
+        if conexion.execute(text('SELECT COUNT(*) FROM "user"')).scalar():
+            raise SystemExit('La base de datos tiene que estar vacía.')
+
+        insertar_usuarios = text('INSERT INTO "user" ("user", saldo, dolares) VALUES (:user, :saldo, :dolares)')
+        for inicio in range(0, usuarios, BLOQUE_SIEMBRA):
+            bloque = [_uuid(aleatorio) for _ in range(min(BLOQUE_SIEMBRA, usuarios - inicio))]
+            nombres.extend(bloque)
+            conexion.execute(insertar_usuarios, [{'user':u, 'saldo':SALDO_INICIAL_CENTAVOS, 'dolares':10000} for u in bloque])
+        conexion.execute(text('''
+            INSERT INTO movimientos (id_usuario, moneda, monto, tipo, fecha)
+            SELECT id, 'ARS', saldo, 'apertura', CURRENT_TIMESTAMP FROM "user"
+            UNION ALL
+            SELECT id, 'USD', dolares, 'apertura', CURRENT_TIMESTAMP FROM "user"
+        '''))
+        conexion.commit()
+        if tuple(conexion.execute(text('SELECT MIN(id), MAX(id) FROM "user"')).one()) != (1, usuarios):
+            raise SystemExit('Se esperaban ids de usuario consecutivos desde 1.')
+
+        insertar_transferencias = text('''INSERT INTO transferencias (id_usuario_remitente, id_usuario_beneficiario, transaccion, fecha)
+                                          VALUES (:remitente, :beneficiario, :monto, CURRENT_TIMESTAMP)''')
+        for inicio in range(0, transferencias, BLOQUE_SIEMBRA):
+            conexion.execute(insertar_transferencias, [
+                {'remitente':aleatorio.randint(1, usuarios), 'beneficiario':aleatorio.randint(1, usuarios), 'monto':aleatorio.randint(100, 100000)}
+                for _ in range(min(BLOQUE_SIEMBRA, transferencias - inicio))
+            ])
+            conexion.commit()
+
+        insertar_prestamos = text('''INSERT INTO prestamos (id_usuario, cuotas, cuotas_pagadas, cuota_mensual, interes_anual, monto, monto_total)
+                                     VALUES (:usuario, 100000, 0, 10000, 45, 500000000, 1000000000)''')
+        medidos = min(USUARIOS_MEDIDOS, usuarios)
+        prestamos = max(prestamos, medidos)
+        for inicio in range(0, prestamos, BLOQUE_SIEMBRA):
+            conexion.execute(insertar_prestamos, [
+                {'usuario':i + 1 if i < medidos else aleatorio.randint(1, usuarios)}
+                for i in range(inicio, min(inicio + BLOQUE_SIEMBRA, prestamos))
+            ])
+            conexion.commit()
+
+        ultimo_id = conexion.execute(text('SELECT MAX(id) FROM transferencias')).scalar() or 0
+        prestamo_de = dict(conexion.execute(text('SELECT id_usuario, MIN(id) FROM prestamos WHERE id_usuario <= :medidos GROUP BY id_usuario'), {'medidos':medidos}).all())
+
+    return [
+        {'usuario':nombres[i], 'beneficiario':nombres[(i + 1) % usuarios], 'prestamo':prestamo_de[i + 1], 'antes_de':ultimo_id // 2 + 1}
+        for i in range(medidos)
+    ]
+
+
+def _preparar(escenario, medido):
+    metodo, ruta, datos, con_sesion = escenario
+    ruta = ruta.format(**medido)
+    if datos is not None:
+        datos = json.loads(json.dumps(datos).replace('{beneficiario}', medido['beneficiario']).replace('{prestamo}', str(medido['prestamo'])))
+    return metodo, ruta, datos, con_sesion
+
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados) + 0.5) - 1))]
+
+
+def _resumir(muestras, duracion):
+    latencias = [m[0] for m in muestras]
+    errores = sum(1 for m in muestras if m[1] is None or m[1] >= 400)
+    tiempos_db = [m[2] for m in muestras if m[2] is not None]
+    return {
+        'solicitudes':len(muestras),
+        'errores':errores,
+        'p50_ms':round(_percentil(latencias, 50), 3),
+        'p95_ms':round(_percentil(latencias, 95), 3),
+        'p99_ms':round(_percentil(latencias, 99), 3),
+        'por_segundo':round(len(muestras) / duracion, 1),
+        'db_ms':round(sum(tiempos_db) / len(tiempos_db), 3) if tiempos_db else None,
+    }
+
+
+def _medir(hacer_solicitud, escenario, medidos, solicitudes, concurrencia):
+    def trabajador(indice):
+        muestras = []
+        for n in range(indice, solicitudes, concurrencia):
+            medido = medidos[n % len(medidos)]
+            inicio = time.perf_counter()
+            try:
+                estado, tiempo_db = hacer_solicitud(indice, medido, *_preparar(escenario, medido))
+            except Exception:
+                estado, tiempo_db = None, None
+            muestras.append(((time.perf_counter() - inicio) * 1000, estado, tiempo_db))
+        return muestras
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(concurrencia) as ejecutor:
+        muestras = [m for parte in ejecutor.map(trabajador, range(concurrencia)) for m in parte]
+    return _resumir(muestras, time.perf_counter() - inicio)
+
+
+def _tiempo_db(headers):
+    valor = headers.get('X-Tiempo-DB-ms')
+    return float(valor) if valor is not None else None
+
+
+def driver_cliente(escenarios, medidos, solicitudes, concurrencia):
+    """Maneja la aplicación en el mismo proceso, con un cliente de pruebas por hilo."""
+    from app import crear_app, db
+    app = crear_app()
+    instrumentar(app, db)
+    clientes = {}
+
+    def hacer_solicitud(indice, medido, metodo, ruta, datos, con_sesion):
+        clave = (indice, medido['usuario'] if con_sesion else None)
+        if clave not in clientes:
+            clientes[clave] = app.test_client()
+            if con_sesion:
+                with clientes[clave].session_transaction() as sesion:
+                    sesion['usuario_id'] = medido['usuario']
+        cliente = clientes[clave] if con_sesion else app.test_client()
+        if datos is not None and 'json' in datos:
+            respuesta = cliente.open(ruta, method=metodo, json=datos['json'])
+        else:
+            respuesta = cliente.open(ruta, method=metodo, data=datos)
+        respuesta.close()
+        return respuesta.status_code, _tiempo_db(respuesta.headers)
+
+    return {nombre:_medir(hacer_solicitud, escenario, medidos, solicitudes, concurrencia) for nombre, escenario in escenarios.items()}
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def driver_gunicorn(escenarios, medidos, solicitudes, concurrencia, workers, worker_class):
+    """Lanza gunicorn con la configuración del proyecto y lo maneja por HTTP con varias conexiones."""
+    import requests
+    from app import crear_app
+
+    app = crear_app()
+    puerto = _puerto_libre()
+    entorno = dict(os.environ, PORT=str(puerto), WEB_CONCURRENCY=str(workers), GUNICORN_WORKER_CLASS=worker_class,
+                   PYTHONPATH=RAIZ)
+    proceso = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(RAIZ, 'benchmarks', 'gunicorn_rutas.conf.py'), 'banco:app'],
+        cwd=RAIZ, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    url = f'http://127.0.0.1:{puerto}'
+    try:
+        for _ in range(600):
+            try:
+                requests.get(url + '/api/interescompuesto?capital=1&tasainteres=1&tiempo=1', timeout=5)
+                break
+            except requests.RequestException:
+                if proceso.poll() is not None:
+                    raise SystemExit(f'gunicorn terminó al arrancar:\n{proceso.stderr.read().decode()}')
+                time.sleep(0.1)
+
+        # Las sesiones se crean desde este proceso, con la misma clave y el mismo almacén que usa gunicorn.
+        cookies = {}
+        for medido in medidos:
+            cliente = app.test_client()
+            with cliente.session_transaction() as sesion:
+                sesion['usuario_id'] = medido['usuario']
+            cookies[medido['usuario']] = cliente.get_cookie(app.config['SESSION_COOKIE_NAME']).value
+        sesiones = {}
+
+        def hacer_solicitud(indice, medido, metodo, ruta, datos, con_sesion):
+            clave = (indice, medido['usuario'] if con_sesion else None)
+            if clave not in sesiones:
+                sesiones[clave] = requests.Session()
+                if con_sesion:
+                    sesiones[clave].cookies.set(app.config['SESSION_COOKIE_NAME'], cookies[medido['usuario']])
+            sesion = sesiones[clave] if con_sesion else requests.Session()
+            if datos is not None and 'json' in datos:
+                respuesta = sesion.request(metodo, url + ruta, json=datos['json'], allow_redirects=False)
+            else:
+                respuesta = sesion.request(metodo, url + ruta, data=datos, allow_redirects=False)
+            return respuesta.status_code, _tiempo_db(respuesta.headers)
+
+        return {nombre:_medir(hacer_solicitud, escenario, medidos, solicitudes, concurrencia) for nombre, escenario in escenarios.items()}
+    finally:
+        proceso.terminate()
+        proceso.wait()
+
+
+def comparar(resultados, resultados_meta, base, tolerancia):
+    """
+    Compara el p95 de cada ruta con una línea base.
+
+    Returns:
+        list: Rutas cuyo p95 empeoró más que `tolerancia` (proporción, 0.2 = 20%).
+    """
+    regresiones = []
+    if base['meta']['driver'] != resultados_meta['driver'] or base['meta']['base'] != resultados_meta['base']:
+        print(f"\nAtención: la línea base se midió con {base['meta']['driver']}/{base['meta']['base']}, "
+              f"no con {resultados_meta['driver']}/{resultados_meta['base']}.")
+    print(f"\n{'ruta':>22} {'p95 base':>10} {'p95 actual':>11} {'cambio':>8}")
+    for nombre, actual in resultados.items():
+        anterior = base['rutas'].get(nombre)
+        if not anterior:
+            continue
+        cambio = actual['p95_ms'] / anterior['p95_ms'] - 1 if anterior['p95_ms'] else 0
+        marca = ' <- regresión' if cambio > tolerancia else ''
+        if marca:
+            regresiones.append(nombre)
+        print(f"{nombre:>22} {anterior['p95_ms']:>10.2f} {actual['p95_ms']:>11.2f} {cambio:>+8.0%}{marca}")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--usuarios', type=int, default=10000)
+    parser.add_argument('--transferencias', type=int, default=100000)
+    parser.add_argument('--prestamos', type=int, default=10000)
+    parser.add_argument('--driver', choices=('cliente', 'gunicorn'), default='cliente')
+    parser.add_argument('--concurrencia', type=int, default=4, help='Clientes simultáneos.')
+    parser.add_argument('--solicitudes', type=int, default=200, help='Solicitudes por ruta.')
+    parser.add_argument('--workers', type=int, default=2, help='Procesos de gunicorn.')
+    parser.add_argument('--worker-class', default='gthread')
+    parser.add_argument('--rutas', help='Escenarios a medir, separados por coma. Por defecto, todos.')
+    parser.add_argument('--base', help='URL de una base vacía. Por defecto, un SQLite temporal.')
+    parser.add_argument('--demora-cotizacion', type=float, default=0.0, help='Segundos que tarda la API de cotizaciones simulada.')
+    parser.add_argument('--guardar', help='Archivo JSON donde guardar los resultados como línea base.')
+    parser.add_argument('--comparar', help='Línea base JSON contra la que comparar.')
+    parser.add_argument('--tolerancia', type=float, default=0.2, help='Empeoramiento de p95 tolerado (0.2 = 20%%).')
+    args = parser.parse_args()
+
+    escenarios = _escenarios()
+    if args.rutas:
+        escenarios = {nombre:escenarios[nombre] for nombre in args.rutas.split(',')}
+
+    with tempfile.TemporaryDirectory() as directorio, servidor_cotizaciones(args.demora_cotizacion) as url_cotizaciones:
+        os.environ.update({
+            'DATABASE_URL':args.base or f"sqlite:///{os.path.join(directorio, 'bench.db')}",
+            'COTIZACION_FUENTE':'http',
+            'COTIZACION_URL':url_cotizaciones,
+            'COTIZACION_CACHE':os.path.join(directorio, 'cotizacion_cache.json'),
+            'SECRET_KEY':CLAVE_SESION,
+            # Los usuarios sembrados no tienen sesión: la limpieza los borraría durante la medición.
+            'SESIONES_LIMPIEZA_INTERVALO':'0',
+        })
+        sys.path.insert(0, RAIZ)
+
+        inicio = time.perf_counter()
+        medidos = sembrar(args.usuarios, args.transferencias, args.prestamos)
+        print(f'Siembra: {args.usuarios:,} usuarios, {args.transferencias:,} transferencias, '
+              f'{args.prestamos:,} préstamos en {time.perf_counter() - inicio:.1f} s')
+
+        if args.driver == 'gunicorn':
+            resultados = driver_gunicorn(escenarios, medidos, args.solicitudes, args.concurrencia, args.workers, args.worker_class)
+        else:
+            resultados = driver_cliente(escenarios, medidos, args.solicitudes, args.concurrencia)
+
+    print(f"\n{'ruta':>22} {'n':>6} {'errores':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'db ms':>8}")
+    for nombre, r in resultados.items():
+        db_ms = f"{r['db_ms']:>8.2f}" if r['db_ms'] is not None else f"{'-':>8}"
+        print(f"{nombre:>22} {r['solicitudes']:>6} {r['errores']:>8} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['por_segundo']:>8.1f} {db_ms}")
+
+    informe = {
+        'meta':{
+            'fecha':time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'driver':args.driver,
+            'worker_class':args.worker_class if args.driver == 'gunicorn' else None,
+            'workers':args.workers if args.driver == 'gunicorn' else None,
+            'concurrencia':args.concurrencia,
+            'solicitudes':args.solicitudes,
+            'usuarios':args.usuarios,
+            'transferencias':args.transferencias,
+            'prestamos':args.prestamos,
+            'base':'postgresql' if args.base and args.base.startswith('postgres') else 'sqlite',
+            'python':platform.python_version(),
+        },
+        'rutas':resultados,
+    }
+    if args.guardar:
+        with open(args.guardar, 'w', encoding='utf-8') as archivo:
+            json.dump(informe, archivo, indent=2)
+        print(f'\nResultados guardados en {args.guardar}')
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as archivo:
+            regresiones = comparar(resultados, informe['meta'], json.load(archivo), args.tolerancia)
+        if regresiones:
+            print(f"\nRegresiones: {', '.join(regresiones)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Configuración de gunicorn. Se carga sola al correr `gunicorn banco:app` desde la raíz del proyecto.
+
+Los workers atienden varias requests a la vez, así la espera de red o de base de datos de una request
+no frena a las demás y la concurrencia crece sin agregar procesos:
+    - 'gthread' (por defecto): hilos por worker. No necesita dependencias extra.
+    - 'gevent': greenlets, para miles de conexiones lentas por worker. Requiere gevent, y con PostgreSQL
+      psycogreen para que las consultas no bloqueen el loop.
+
+Con 'gthread' la aplicación se precarga en el proceso maestro (preload_app): los workers nacen con un fork
+que ya la tiene importada, arrancan en milisegundos y comparten su memoria mientras no la modifiquen. Con
+gevent no se precarga, porque el parche de gevent tiene que aplicarse antes de importar la aplicación.
+En los dos casos el esquema se migra una sola vez, en el maestro, antes de crear los workers (on_starting).
+
+Variables de entorno:
+    PORT, WEB_CONCURRENCY (procesos), GUNICORN_WORKER_CLASS, GUNICORN_THREADS,
+    GUNICORN_WORKER_CONNECTIONS, GUNICORN_TIMEOUT, GUNICORN_PRELOAD (1 o 0).
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 4)))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1' if worker_class == 'gthread' else '0') == '1'
+
+# Cada hilo que atiende una request puede tener una conexión de la base tomada: el pool del worker
+# tiene que alcanzar para todos. Con gevent el pool limita cuántas requests usan la base a la vez.
+os.environ.setdefault('DB_POOL_SIZE', str(threads if worker_class == 'gthread' else 20))
+
+
+def on_starting(server):
+    # Una sola vez por arranque, en el maestro y antes del fork, en vez de en cada worker.
+    if not preload_app:
+        # Sin precarga el maestro no importa la aplicación: la migración corre en un proceso aparte.
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'banco', 'migrar'], check=True)
+        return
+    from app import app, db
+    from app.migraciones import migrar
+    with app.app_context():
+        resultado = migrar()
+        # Las conexiones abiertas en el maestro no deben heredarlas los workers.
+        db.engine.dispose()
+    if resultado['creado']:
+        server.log.info('Esquema creado en la versión %s', resultado['creado'])
+    elif resultado['aplicadas']:
+        server.log.info('Migraciones aplicadas: %s', resultado['aplicadas'])
+
+
+def post_fork(server, worker):
+    if preload_app:
+        # Por si el maestro abrió conexiones después de on_starting: el worker arma su propio pool.
+        from app import app, db
+        with app.app_context():
+            db.engine.dispose(close=False)
+    # Antes de que el worker cargue la aplicación, así todas las conexiones nacen cooperativas.
+    if worker_class != 'gevent':
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        server.log.warning('psycogreen no está instalado: las consultas a PostgreSQL bloquearán el worker de gevent.')
+    else:
+        patch_psycopg()
@@ -0,0 +1,59 @@
+import os
+import sys
+import tempfile
+import uuid
+import pytest
+
+# La configuración se lee al importar `app`: la base de las pruebas es un SQLite temporal, sin red ni hilos de limpieza.
+_DIRECTORIO = tempfile.mkdtemp(prefix='banco-pruebas-')
+os.environ.update({
+    'DATABASE_URL':f"sqlite:///{os.path.join(_DIRECTORIO, 'app.db')}",
+    'SECRET_KEY':'pruebas',
+    'COTIZACION_FUENTE':'fija',
+    'COTIZACION_CACHE':os.path.join(_DIRECTORIO, 'cotizacion_cache.json'),
+    'SESIONES_LIMPIEZA_INTERVALO':'0',
+    'ARCHIVO_INTERVALO':'0',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import crear_app, db
+from app.migraciones import migrar
+from app.usuarios import crear_usuarios
+
+
+@pytest.fixture(scope='session')
+def aplicacion():
+    aplicacion = crear_app()
+    aplicacion.config['TESTING'] = True
+    with aplicacion.app_context():
+        migrar()
+    return aplicacion
+
+
+@pytest.fixture
+def contexto(aplicacion):
+    with aplicacion.test_request_context():
+        yield aplicacion
+
+
+@pytest.fixture
+def nuevo_usuario(aplicacion):
+    """Crea usuarios con el saldo inicial y devuelve su ID."""
+    def crear():
+        usuario = str(uuid.uuid4())
+        with aplicacion.app_context(), db.engine.connect() as conexion:
+            crear_usuarios(conexion, [usuario])
+        return usuario
+    return crear
+
+
+@pytest.fixture
+def nuevo_cliente(aplicacion):
+    """Crea clientes de la API con su usuario ya guardado en la base y devuelve (cliente, usuario)."""
+    def crear():
+        cliente = aplicacion.test_client()
+        usuario = cliente.post('/api/v1/sesion').json['usuario']
+        # El usuario se guarda cuando la sesión vuelve en la segunda request.
+        assert cliente.get('/api/v1/cuenta').status_code == 200
+        return cliente, usuario
+    return crear
@@ -0,0 +1,51 @@
+from decimal import ROUND_FLOOR
+import pytest
+from app.dinero import Dinero
+from app.divisas import MatrizCotizaciones
+from app.funciones import cambiar_moneda, obtener_saldo, obtener_tenencias
+from app.libro import verificar_saldos
+from app.usuarios import SALDO_INICIAL
+
+MATRIZ = MatrizCotizaciones({'ARS':1000.0, 'GBP':0.79, 'EUR':0.92, 'JPY':151.37})
+
+
+def test_cambio_acredita_redondeando_hacia_abajo(contexto, nuevo_usuario):
+    usuario = nuevo_usuario()
+    importe = cambiar_moneda(usuario, 'ARS', 'USD', '1000.99', MATRIZ.tasa('ARS', 'USD'))
+
+    assert importe == Dinero.desde('1.00')
+    assert obtener_saldo(usuario) == SALDO_INICIAL - Dinero.desde('1000.99')
+    assert obtener_tenencias(usuario)['USD'] == importe
+    assert verificar_saldos() == []
+
+
+def test_ida_y_vuelta_no_gana_dinero(contexto, nuevo_usuario):
+    # Con redondeo al más cercano, 0.02 USD -> 0.02 GBP -> 0.03 USD.
+    usuario = nuevo_usuario()
+    cambiar_moneda(usuario, 'ARS', 'USD', '20', MATRIZ.tasa('ARS', 'USD'))
+    assert obtener_tenencias(usuario)['USD'] == Dinero.desde('0.02')
+
+    libras = cambiar_moneda(usuario, 'USD', 'GBP', '0.02', MATRIZ.tasa('USD', 'GBP'))
+    dolares = cambiar_moneda(usuario, 'GBP', 'USD', libras, MATRIZ.tasa('GBP', 'USD'))
+
+    assert dolares <= Dinero.desde('0.02')
+    tenencias = obtener_tenencias(usuario)
+    assert tenencias['USD'] == dolares
+    assert 'GBP' not in tenencias
+    assert verificar_saldos() == []
+
+
+@pytest.mark.parametrize('origen, destino', [
+    (origen, destino) for origen in MATRIZ.monedas for destino in MATRIZ.monedas if origen != destino
+])
+def test_ida_y_vuelta_entre_cada_par(origen, destino):
+    ida, vuelta = MATRIZ.tasa(origen, destino), MATRIZ.tasa(destino, origen)
+    for centavos in list(range(1, 500)) + [99999, 123456789]:
+        cantidad = Dinero(centavos)
+        recibido = cantidad.multiplicar(ida, ROUND_FLOOR)
+        assert recibido.multiplicar(vuelta, ROUND_FLOOR) <= cantidad
+
+
+def test_cambio_que_no_llega_a_un_centavo(contexto, nuevo_usuario):
+    with pytest.raises(ValueError):
+        cambiar_moneda(nuevo_usuario(), 'ARS', 'USD', '9.99', MATRIZ.tasa('ARS', 'USD'))
@@ -0,0 +1,56 @@
+from decimal import Decimal
+import pytest
+from app.dinero import CENTAVOS_MAXIMOS, Dinero, en_rango, sumar, sumar_por_grupo
+
+
+@pytest.mark.parametrize('valor, centavos', [
+    ('10', 1000),
+    ('0.1', 10),
+    (0.1, 10),
+    ('1.005', 101),
+    ('-1.005', -101),
+    (Decimal('2.50'), 250),
+    (7, 700),
+])
+def test_desde_redondea_al_centavo(valor, centavos):
+    assert Dinero.desde(valor).centavos == centavos
+
+
+@pytest.mark.parametrize('valor', ['abc', '', 'nan', 'inf', '-inf', '1e20', '1e30', '1e999999'])
+def test_desde_rechaza_importes_invalidos_o_fuera_de_rango(valor):
+    with pytest.raises(ValueError):
+        Dinero.desde(valor)
+
+
+def test_desde_acepta_el_maximo_de_la_base():
+    assert Dinero.desde(Decimal(CENTAVOS_MAXIMOS).scaleb(-2)).centavos == CENTAVOS_MAXIMOS
+
+
+def test_operaciones_exactas():
+    assert Dinero.desde('0.1') + Dinero.desde('0.2') == Dinero.desde('0.3')
+    assert Dinero.desde('10') - Dinero.desde('0.01') == Dinero.desde('9.99')
+    assert Dinero.desde('33.33') * 3 == Dinero.desde('99.99')
+    assert Dinero.desde('1.5') * 0.5 == Dinero(75)
+    assert str(Dinero(-5)) == '-0.05'
+
+
+def test_sumar():
+    assert sumar(Dinero.desde(v) for v in ('0.1', '0.2', '0.3')) == Dinero.desde('0.6')
+    assert sumar([]) == Dinero(0)
+
+
+def test_sumar_no_desborda():
+    importes = [Dinero(CENTAVOS_MAXIMOS), Dinero(CENTAVOS_MAXIMOS)]
+    total = sumar(importes)
+    assert total.centavos == 2 * CENTAVOS_MAXIMOS
+    assert not en_rango(total)
+
+
+def test_sumar_por_grupo():
+    sumas = sumar_por_grupo([3, 1, 3], [100, 5, 250])
+    assert sumas == {1:Dinero(5), 3:Dinero(350)}
+
+
+def test_sumar_por_grupo_no_desborda():
+    sumas = sumar_por_grupo([1, 1], [CENTAVOS_MAXIMOS, CENTAVOS_MAXIMOS])
+    assert sumas[1].centavos == 2 * CENTAVOS_MAXIMOS
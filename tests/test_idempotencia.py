@@ -0,0 +1,85 @@
+import pytest
+from app import api
+from app.dinero import Dinero
+from app.escritor import escritor
+from app.usuarios import SALDO_INICIAL
+
+
+def _transferir(cliente, beneficiario, clave, monto='10'):
+    return cliente.post('/api/v1/transferencias', json={'beneficiario':beneficiario, 'monto':monto}, headers={'Idempotency-Key':clave})
+
+
+def _saldo(cliente):
+    return Dinero.desde(cliente.get('/api/v1/cuenta').json['saldo'])
+
+
+def test_reintento_devuelve_la_respuesta_guardada(nuevo_cliente):
+    cliente, _ = nuevo_cliente()
+    _, beneficiario = nuevo_cliente()
+    primera = _transferir(cliente, beneficiario, 'clave-1')
+    segunda = _transferir(cliente, beneficiario, 'clave-1')
+
+    assert primera.status_code == 201
+    assert segunda.status_code == 201
+    assert segunda.headers['Idempotent-Replayed'] == 'true'
+    assert segunda.json == primera.json
+    assert _saldo(cliente) == SALDO_INICIAL - Dinero.desde('10')
+
+
+def test_clave_con_otro_pedido(nuevo_cliente):
+    cliente, _ = nuevo_cliente()
+    _, beneficiario = nuevo_cliente()
+    _transferir(cliente, beneficiario, 'clave-2')
+
+    assert _transferir(cliente, beneficiario, 'clave-2', monto='11').status_code == 422
+
+
+def test_error_antes_de_escribir_libera_la_clave(nuevo_cliente, monkeypatch):
+    cliente, _ = nuevo_cliente()
+    _, beneficiario = nuevo_cliente()
+
+    def fallar(*args):
+        raise RuntimeError('sin conexión')
+    monkeypatch.setattr(api, 'realizar_transferencia', fallar)
+    with pytest.raises(RuntimeError):
+        _transferir(cliente, beneficiario, 'clave-3')
+    monkeypatch.undo()
+
+    assert _transferir(cliente, beneficiario, 'clave-3').status_code == 201
+    assert _saldo(cliente) == SALDO_INICIAL - Dinero.desde('10')
+
+
+def test_timeout_del_escritor_no_repite_la_operacion(aplicacion, nuevo_cliente, monkeypatch):
+    # El escritor confirma la transferencia pero la request deja de esperarla: un reintento no debe aplicarla de nuevo.
+    cliente, _ = nuevo_cliente()
+    _, beneficiario = nuevo_cliente()
+    ejecutar = escritor.ejecutar
+
+    def confirmar_y_vencer(operacion, *args):
+        ejecutar(operacion, *args)
+        raise TimeoutError()
+    monkeypatch.setitem(aplicacion.config, 'ESCRITOR_AGRUPADO', True)
+    monkeypatch.setattr(escritor, 'ejecutar', confirmar_y_vencer)
+    with pytest.raises(TimeoutError):
+        _transferir(cliente, beneficiario, 'clave-4')
+    monkeypatch.undo()
+
+    reintento = _transferir(cliente, beneficiario, 'clave-4')
+    assert reintento.status_code == 500
+    assert reintento.headers['Idempotent-Replayed'] == 'true'
+    assert _saldo(cliente) == SALDO_INICIAL - Dinero.desde('10')
+
+
+def test_error_despues_de_escribir_no_repite_la_operacion(nuevo_cliente, monkeypatch):
+    cliente, _ = nuevo_cliente()
+    _, beneficiario = nuevo_cliente()
+
+    def fallar(usuario):
+        raise RuntimeError('no se pudo leer la cuenta')
+    monkeypatch.setattr(api, '_cuenta', fallar)
+    with pytest.raises(RuntimeError):
+        _transferir(cliente, beneficiario, 'clave-5')
+    monkeypatch.undo()
+
+    assert _transferir(cliente, beneficiario, 'clave-5').status_code == 500
+    assert _saldo(cliente) == SALDO_INICIAL - Dinero.desde('10')
@@ -0,0 +1,48 @@
+import math
+import pytest
+from app.interes import CAPITAL_MAXIMO, TASA_MAXIMA, _curva, proyectar_interes_compuesto
+
+
+def test_proyeccion():
+    proyeccion = proyectar_interes_compuesto(1000, 12, 1, 100)
+
+    assert proyeccion['aportado'] == 2200
+    assert len(proyeccion['curva']) == 13
+    assert proyeccion['curva'][0] == 1000
+    assert proyeccion['capitalfinal'] == pytest.approx(1000 * 1.01 ** 12 + 100 * (1.01 ** 12 - 1) / 0.01, abs=0.01)
+
+
+def test_proyeccion_sin_interes():
+    assert proyectar_interes_compuesto('500', '0', '2', '10')['capitalfinal'] == 740
+
+
+@pytest.mark.parametrize('capital, tasa, anios, aporte', [
+    ('nan', 5, 1, 0),
+    (1000, 'nan', 1, 0),
+    (1000, 5, 1, 'nan'),
+    ('inf', 5, 1, 0),
+    (1000, 'inf', 1, 0),
+    (1000, 5, float('inf'), 0),
+    (1000, 5, 'nan', 0),
+    (-1, 5, 1, 0),
+    (1000, 5, 0, 0),
+    (1000, 5, 101, 0),
+    (CAPITAL_MAXIMO * 10, 5, 1, 0),
+    (1000, 5, 1, CAPITAL_MAXIMO * 10),
+    (1000, TASA_MAXIMA + 1, 1, 0),
+])
+def test_rechaza_parametros_invalidos(capital, tasa, anios, aporte):
+    _curva.cache_clear()
+    with pytest.raises(ValueError):
+        proyectar_interes_compuesto(capital, tasa, anios, aporte)
+    assert _curva.cache_info().currsize == 0
+
+
+def test_los_maximos_dan_resultados_finitos():
+    proyeccion = proyectar_interes_compuesto(CAPITAL_MAXIMO, TASA_MAXIMA, 100, CAPITAL_MAXIMO)
+    assert all(math.isfinite(saldo) for saldo in proyeccion['curva'])
+
+
+def test_api_rechaza_nan(aplicacion):
+    respuesta = aplicacion.test_client().get('/api/interescompuesto?capital=nan&tasainteres=5&tiempo=1')
+    assert respuesta.status_code == 400
@@ -0,0 +1,27 @@
+import json
+import os
+import subprocess
+import sys
+from sqlalchemy import text
+from app import db
+from app.migraciones import MIGRACIONES, migrar
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_base_actualizada_no_aplica_nada(contexto):
+    assert migrar() == {'creado':None, 'aplicadas':[]}
+    versiones = [version for (version,) in db.session.execute(text('SELECT version FROM schema_migraciones ORDER BY version'))]
+    assert versiones == [version for version, _, _ in MIGRACIONES]
+
+
+def test_base_vacia_crea_el_esquema(tmp_path):
+    # En otro intérprete, porque la base se elige al importar la aplicación.
+    codigo = 'import json; from app import crear_app; from app.migraciones import migrar\n' \
+             'with crear_app().app_context(): print(json.dumps([migrar(), migrar()]))'
+    entorno = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'nueva.db'}", PYTHONPATH=RAIZ)
+    salida = subprocess.run([sys.executable, '-c', codigo], cwd=RAIZ, env=entorno, capture_output=True, text=True, check=True)
+
+    primera, segunda = json.loads(salida.stdout.strip().splitlines()[-1])
+    assert primera == {'creado':MIGRACIONES[-1][0], 'aplicadas':[]}
+    assert segunda == {'creado':None, 'aplicadas':[]}
@@ -0,0 +1,54 @@
+import pytest
+from app.dinero import Dinero
+from app.escritor import escritor
+from app.funciones import obtener_dolares, obtener_saldo
+from app.usuarios import SALDO_INICIAL
+
+
+@pytest.fixture
+def navegador(aplicacion):
+    """Cliente de las páginas con su usuario ya guardado en la base; devuelve (cliente, usuario)."""
+    cliente = aplicacion.test_client()
+    cliente.get('/')
+    cliente.get('/home')
+    with cliente.session_transaction() as sesion:
+        return cliente, sesion['usuario_id']
+
+
+@pytest.fixture
+def escritor_demorado(aplicacion, monkeypatch):
+    # El escritor confirma la operación, pero la request se cansa de esperar.
+    ejecutar = escritor.ejecutar
+
+    def confirmar_y_vencer(operacion, *args):
+        ejecutar(operacion, *args)
+        raise TimeoutError()
+    monkeypatch.setitem(aplicacion.config, 'ESCRITOR_AGRUPADO', True)
+    monkeypatch.setattr(escritor, 'ejecutar', confirmar_y_vencer)
+
+
+def test_compra_demorada_no_se_informa_como_fallida(contexto, navegador, escritor_demorado):
+    cliente, usuario = navegador
+    respuesta = cliente.post('/comprar_dolares', data={'cantidad_dolares':'1'})
+
+    assert respuesta.status_code == 200
+    assert b'Revisa tu saldo' in respuesta.data
+    assert obtener_dolares(usuario) == Dinero.desde('1')
+
+
+def test_transferencia_demorada_no_se_informa_como_fallida(contexto, navegador, nuevo_usuario, escritor_demorado):
+    cliente, usuario = navegador
+    respuesta = cliente.post('/transferencia', data={'montotransferencia':'5', 'ID':nuevo_usuario()}, follow_redirects=True)
+
+    assert respuesta.status_code == 200
+    assert b'Revisa tu saldo' in respuesta.data
+    assert b'Error al realizar la transferencia' not in respuesta.data
+    assert obtener_saldo(usuario) == SALDO_INICIAL - Dinero.desde('5')
+
+
+def test_lote_demorado_responde_pendiente(navegador, nuevo_usuario, escritor_demorado):
+    cliente, _ = navegador
+    respuesta = cliente.post('/transferencia/lote', json=[{'beneficiario':nuevo_usuario(), 'monto':'1'}])
+
+    assert respuesta.status_code == 202
+    assert respuesta.json['estado'] == 'pendiente'
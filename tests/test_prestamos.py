@@ -0,0 +1,48 @@
+import random
+import pytest
+from app.amortizacion import PLAZO_MAXIMO, resumen
+from app.dinero import Dinero
+from app.funciones import obtener_saldo, pagar_cuota_prestamo, registrar_prestamo, simular_prestamo
+from app.libro import verificar_saldos
+from app.usuarios import SALDO_INICIAL
+
+
+def test_cuota_fija_se_redondea_hacia_arriba():
+    interes, total, cuota = simular_prestamo(0, Dinero.desde('100'), 3)
+
+    assert cuota == Dinero.desde('33.34')
+    assert total == Dinero.desde('100.02')
+    assert interes == Dinero.desde('0.02')
+
+
+@pytest.mark.parametrize('sistema', ['plano', 'frances'])
+def test_las_cuotas_cubren_capital_e_interes(sistema):
+    azar = random.Random(14)
+    for _ in range(500):
+        monto = Dinero(azar.randint(100, 100000000))
+        tasa = azar.randint(0, 150)
+        plazo = azar.randint(1, PLAZO_MAXIMO)
+        _, total, cuota = simular_prestamo(tasa, monto, plazo, sistema)
+        debido = resumen(float(monto), tasa, plazo, sistema)['total_pagar']
+        assert total == cuota * plazo
+        assert total.centavos >= debido * 100 - 1e-6
+
+
+@pytest.mark.parametrize('tasa, plazo', [(-1, 12), (10, 0), (10, PLAZO_MAXIMO + 1)])
+def test_simulacion_rechaza_condiciones_invalidas(tasa, plazo):
+    with pytest.raises(ValueError):
+        simular_prestamo(tasa, Dinero.desde('1000'), plazo)
+
+
+def test_pagar_todas_las_cuotas(contexto, nuevo_usuario):
+    usuario = nuevo_usuario()
+    monto = Dinero.desde('100')
+    _, total, cuota = simular_prestamo(0, monto, 3)
+    prestamo = registrar_prestamo(usuario, monto, 3, cuota, 0, total)
+    for _ in range(3):
+        pagar_cuota_prestamo(prestamo, usuario)
+
+    assert obtener_saldo(usuario) == SALDO_INICIAL + monto - total
+    with pytest.raises(ValueError):
+        pagar_cuota_prestamo(prestamo, usuario)
+    assert verificar_saldos() == []
@@ -0,0 +1,60 @@
+from sqlalchemy import text
+from app import db
+from app.dinero import Dinero
+from app.funciones import obtener_saldo, realizar_transferencias_lote
+from app.libro import verificar_saldos
+from app.usuarios import SALDO_INICIAL
+
+
+def _transferencias(remitente):
+    consulta = text('''SELECT COUNT(*) FROM transferencias t JOIN "user" u ON u.id = t.id_usuario_remitente WHERE u."user" = :usuario''')
+    return db.session.execute(consulta, {'usuario':remitente}).scalar()
+
+
+def test_lote_acredita_a_cada_beneficiario(contexto, nuevo_usuario):
+    remitente, uno, otro = nuevo_usuario(), nuevo_usuario(), nuevo_usuario()
+    resultados = realizar_transferencias_lote(remitente, [(uno, '10.50'), (otro, '1'), (uno, '0.25'), (remitente, '5'), ('', '1')])
+
+    assert [r['estado'] for r in resultados] == ['realizada', 'realizada', 'realizada', 'rechazada', 'rechazada']
+    assert obtener_saldo(remitente) == SALDO_INICIAL - Dinero.desde('11.75')
+    assert obtener_saldo(uno) == SALDO_INICIAL + Dinero.desde('10.75')
+    assert obtener_saldo(otro) == SALDO_INICIAL + Dinero.desde('1')
+    assert _transferencias(remitente) == 3
+    assert verificar_saldos() == []
+
+
+def test_lote_sin_saldo_no_realiza_ninguna(contexto, nuevo_usuario):
+    remitente, beneficiario = nuevo_usuario(), nuevo_usuario()
+    resultados = realizar_transferencias_lote(remitente, [(beneficiario, SALDO_INICIAL), (beneficiario, '0.01')])
+
+    assert all(r['estado'] == 'rechazada' for r in resultados)
+    assert obtener_saldo(remitente) == SALDO_INICIAL
+    assert obtener_saldo(beneficiario) == SALDO_INICIAL
+    assert _transferencias(remitente) == 0
+
+
+def test_lote_con_total_fuera_de_rango_no_crea_dinero(contexto, nuevo_usuario):
+    # Cada monto entra en un BIGINT, pero la suma no: con int64 daba negativa y el débito condicional pasaba.
+    remitente, uno, otro = nuevo_usuario(), nuevo_usuario(), nuevo_usuario()
+    monto = '50000000000000000'
+    resultados = realizar_transferencias_lote(remitente, [(uno, monto), (otro, monto)])
+
+    assert all(r['estado'] == 'rechazada' for r in resultados)
+    assert obtener_saldo(remitente) == SALDO_INICIAL
+    assert obtener_saldo(uno) == SALDO_INICIAL
+    assert obtener_saldo(otro) == SALDO_INICIAL
+    assert _transferencias(remitente) == 0
+
+
+def test_api_lote_con_total_fuera_de_rango(nuevo_cliente):
+    cliente, _ = nuevo_cliente()
+    _, beneficiario = nuevo_cliente()
+    respuesta = cliente.post('/api/v1/transferencias/lote', json=[
+        {'beneficiario':beneficiario, 'monto':'50000000000000000'},
+        {'beneficiario':beneficiario, 'monto':'50000000000000000'},
+    ])
+
+    assert respuesta.status_code == 200
+    assert respuesta.json['realizadas'] == 0
+    assert respuesta.json['total'] == 0
+    assert respuesta.json['saldo'] == float(SALDO_INICIAL)